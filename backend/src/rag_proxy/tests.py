@@ -23,6 +23,14 @@ class TestRagProxy(TestCase):
         self.assertEqual(r.status_code, 400)
         self.assertIn('error', r.json())
 
+    def test_wire_decodes_json_and_msgpack(self):
+        from rag_proxy import wire
+
+        payload = {'results': [{'doc': 'Capitulo2.pdf', 'page': 1, 'score': 0.8, 'text': 'x'}]}
+        self.assertEqual(wire.decode(json.dumps(payload).encode(), 'application/json; charset=utf-8'), payload)
+        if wire.msgpack is not None:
+            self.assertEqual(wire.decode(wire.msgpack.packb(payload), 'application/x-msgpack'), payload)
+
     @override_settings()
     def test_no_rag_endpoint_returns_500(self):
         # Ensure env var is not set
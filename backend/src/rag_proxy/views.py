@@ -8,20 +8,25 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 
 from chat_app.ai_service import consultar_gemini
+from . import wire
 
 # Configuración del RAG Service externo
 ENABLE_RAG = os.environ.get("ENABLE_RAG", "0") == "1"
 RAG_SERVICE_URL = os.environ.get("RAG_SERVICE_URL", "https://rag-service-265462853523.us-central1.run.app")
 RAG_TIMEOUT = int(os.environ.get("RAG_TIMEOUT", "30"))  # segundos
+# Pide msgpack al RAG Service (si está instalado aquí); el servicio responde JSON si él no lo tiene
+RAG_SERVICE_COMPACT = os.environ.get("RAG_SERVICE_COMPACT", "1") == "1"
 
 
-def buscar_contexto_rag(query: str, top_k: int = 5) -> Tuple[str, List[Dict[str, Any]]]:
+def buscar_contexto_rag(query: str, top_k: int = 5,
+                        compact: bool = RAG_SERVICE_COMPACT) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Función interna para buscar contexto en el RAG Service externo.
     
     Args:
         query: Pregunta o consulta del usuario
         top_k: Número de resultados a retornar (default: 5)
+        compact: Pide la respuesta en msgpack comprimida (con JSON como alternativa)
         
     Returns:
         Tuple con (contexto_formateado: str, fuentes: List[Dict])
@@ -31,13 +36,17 @@ def buscar_contexto_rag(query: str, top_k: int = 5) -> Tuple[str, List[Dict[str,
         httpx.HTTPError: Si hay error HTTP en la llamada
         Exception: Otros errores inesperados
     """
+    headers = {"Accept": wire.JSON}
+    if compact and wire.msgpack is not None:
+        headers["Accept"] = f"{wire.MSGPACK}, {wire.JSON};q=0.5"
     with httpx.Client(timeout=RAG_TIMEOUT) as client:
         response = client.post(
             f"{RAG_SERVICE_URL}/search",
-            json={"query": query, "top_k": top_k}
+            json={"query": query, "top_k": top_k},
+            headers=headers,
         )
         response.raise_for_status()
-        rag_data = response.json()
+        rag_data = wire.decode(response.content, response.headers.get("content-type", wire.JSON))
         results = rag_data.get("results", [])
     
     # Formatear contexto desde resultados
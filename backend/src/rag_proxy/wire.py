@@ -0,0 +1,37 @@
+"""Decodificación de las respuestas del RAG Service (lado cliente).
+
+El servicio negocia el formato según ``Accept``: ``application/json`` (por
+defecto) o ``application/msgpack`` si ``msgpack`` está instalado. httpx
+descomprime gzip/br de forma transparente.
+"""
+from __future__ import annotations
+import json
+from typing import Any
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def _media(content_type: str) -> str:
+    media = (content_type or "").split(";")[0].strip().lower()
+    return _ALIASES.get(media, media)
+
+
+def decode(content: bytes, content_type: str) -> Any:
+    """Decodifica una respuesta JSON o msgpack."""
+    if _media(content_type) == MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("respuesta msgpack sin la librería msgpack instalada")
+        return msgpack.unpackb(content, raw=False)
+    return orjson.loads(content) if orjson is not None else json.loads(content)
@@ -0,0 +1,151 @@
+"""Coalescedor de requests concurrentes (micro-batching) para el retrieval.
+
+Las búsquedas que llegan dentro de una ventana de ``window_ms`` (o hasta
+``max_batch``) se agrupan y se resuelven con una sola llamada a la función
+de lote; cada llamador espera su propio ``Future``.
+
+``length_buckets`` arma los lotes de ``encode`` por presupuesto de tokens y
+``shard_rows`` reparte un lote grande entre los workers de ``encode_pool``.
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+from limiter import QueueFull
+from metrics import BATCH_SIZE_BUCKETS as _SIZE_BUCKETS, MICROBATCH_SIZE, MICROBATCH_WAIT
+
+
+def length_buckets(lengths: Sequence[int], token_budget: int, max_batch: int) -> List[List[int]]:
+    """Agrupa posiciones ordenadas por largo de modo que ``filas x largo máximo <= token_budget``.
+
+    Como cada lote se rellena hasta su texto más largo, juntar textos de largo
+    parecido minimiza el padding. Un texto más largo que el presupuesto va solo.
+    Las posiciones refieren a ``lengths``; el llamador restaura el orden.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        # Orden ascendente: el texto que entra es el más largo del lote.
+        if current and ((len(current) + 1) * max(lengths[i], 1) > token_budget or len(current) >= max_batch):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def shard_rows(lengths: Sequence[int], n_shards: int) -> List[List[int]]:
+    """Reparte posiciones en ``n_shards`` grupos de largo total parecido.
+
+    Se recorren de la más larga a la más corta asignando cada una al shard
+    con menos carga acumulada; cada shard queda en orden ascendente.
+    """
+    n_shards = max(1, min(n_shards, len(lengths)))
+    loads = [0] * n_shards
+    shards: List[List[int]] = [[] for _ in range(n_shards)]
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        target = loads.index(min(loads))
+        shards[target].append(i)
+        loads[target] += max(lengths[i], 1)
+    return [sorted(s) for s in shards if s]
+
+
+class MicroBatcher:
+    """Agrupa items por ``group`` y llama ``fn(group, items) -> results`` por grupo.
+
+    ``fn`` debe devolver un resultado por item, en el mismo orden. Con
+    ``max_queue`` items esperando, ``submit`` lanza ``QueueFull``.
+    """
+
+    def __init__(self, fn: Callable[[Hashable, List[Any]], Sequence[Any]], window_ms: float,
+                 max_batch: int, name: str = "rag-microbatch", max_queue: int = 0):
+        self.fn = fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[Tuple[Hashable, Any, Future, float]]" = queue.Queue(max(0, max_queue))
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._size_hist = [0] * (len(_SIZE_BUCKETS) + 1)
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        self.name = name
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, group: Hashable, item: Any) -> Future:
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((group, item, fut, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull()
+        return fut
+
+    def _collect(self) -> List[Tuple[Hashable, Any, Future, float]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._record(len(batch), [(started - t) * 1000 for _, _, _, t in batch])
+            groups: Dict[Hashable, List[Tuple[Any, Future]]] = {}
+            for group, item, fut, _ in batch:
+                if fut.set_running_or_notify_cancel():  # el llamador pudo cancelar por timeout
+                    groups.setdefault(group, []).append((item, fut))
+            for group, entries in groups.items():
+                try:
+                    results = self.fn(group, [item for item, _ in entries])
+                except Exception as exc:  # el error se propaga a cada llamador
+                    for _, fut in entries:
+                        fut.set_exception(exc)
+                    continue
+                for (_, fut), result in zip(entries, results):
+                    fut.set_result(result)
+
+    def _record(self, size: int, waits_ms: List[float]) -> None:
+        # Histogramas de /metrics (label = nombre del batcher); ``stats`` guarda el resumen de /health.
+        MICROBATCH_SIZE.observe(self.name, size)
+        for wait in waits_ms:
+            MICROBATCH_WAIT.observe(self.name, wait / 1000)
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            bucket = next((i for i, b in enumerate(_SIZE_BUCKETS) if size <= b), len(_SIZE_BUCKETS))
+            self._size_hist[bucket] += 1
+            self._wait_ms_total += sum(waits_ms)
+            self._wait_ms_max = max(self._wait_ms_max, max(waits_ms))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [f"<={b}" for b in _SIZE_BUCKETS] + [f">{_SIZE_BUCKETS[-1]}"]
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "batch_size_hist": dict(zip(labels, self._size_hist)),
+                "queue_wait_ms_avg": round(self._wait_ms_total / self._items, 3) if self._items else 0.0,
+                "queue_wait_ms_max": round(self._wait_ms_max, 3),
+                "queued": self._queue.qsize(),
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,349 @@
+"""Benchmark del camino de búsqueda sobre corpus sintéticos (sin modelo ni red).
+
+Genera matrices normalizadas con estructura de tópicos (de 1k a 1M filas),
+las instala como índice en memoria y mide ``retrieval.search`` con un
+embedder falso determinista en cada modo del motor:
+
+- ``brute``: GEMV exacta en float32.
+- ``quantized``: preselección sobre la matriz compacta (int8/float16) + rescoring.
+- ``ann``: IVF con ``nprobe`` listas sondeadas.
+
+Reporta p50/p95/p99, QPS y recall@k frente a búsqueda exacta. El encode
+del embedder falso es un lookup: las latencias miden sólo el retrieval.
+
+Con ``--url`` mide en cambio un RAG Service corriendo (``POST /search``
+con modelo, red y serialización): latencia de punta a punta, la parte del
+servidor según ``Server-Timing`` y QPS con ``--concurrencia`` clientes.
+"""
+from __future__ import annotations
+import os
+import platform
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+import retrieval
+from ann import ANN_NPROBE_DEFAULT, build_ivf, sample_queries
+from cache import TTLCache
+from embedders import HashingEmbedder
+from quantization import quantize
+
+BENCH_MODES = ("brute", "quantized", "ann")
+HTTP_QUERIES = (
+    "¿Qué es la evaluación por competencias?",
+    "Taxonomía de Bloom aplicada a la evaluación de aprendizajes",
+    "uso ético de la inteligencia artificial generativa en la universidad",
+    "diseño de rúbricas para proyectos de ingeniería",
+    "alfabetización digital de los docentes",
+)
+_GEN_BLOCK = 65536  # filas generadas por bloque (acota la memoria temporal con 1M filas)
+
+
+def synthetic_corpus(n_rows: int, dim: int = 256, topics: Optional[int] = None, noise: float = 2.0,
+                     seed: int = 0):
+    """Matriz (n_rows x dim) float32 normalizada con filas agrupadas en tópicos.
+
+    Cada fila es el centro de su tópico más ruido gaussiano de norma relativa
+    ``noise`` (2.0 -> coseno ~0.45 con el centro). Con tópicos bien separados
+    el ANN tendría recall perfecto y con ruido uniforme no tendría estructura
+    que aprovechar; este punto intermedio se parece más a embeddings reales.
+    """
+    rng = np.random.default_rng(seed)
+    topics = topics or max(8, int(np.sqrt(n_rows)))
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    matrix = np.empty((n_rows, dim), dtype=np.float32)
+    scale = np.float32(noise / np.sqrt(dim))
+    for start in range(0, n_rows, _GEN_BLOCK):
+        size = min(_GEN_BLOCK, n_rows - start)
+        block = centers[rng.integers(0, topics, size=size)]
+        block += rng.standard_normal((size, dim), dtype=np.float32) * scale
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:start + size] = block
+    return matrix
+
+
+class FakeEmbedder(HashingEmbedder):
+    """``HashingEmbedder`` con vectores fijos para los textos de ``table``.
+
+    Las queries del benchmark devuelven su vector sintético; cualquier otro
+    texto, el vector determinista del embedder por hashing.
+    """
+
+    def __init__(self, dim: int, table: Optional[Dict[str, Any]] = None):
+        super().__init__(dim)
+        self.name = "bench"
+        self.table = dict(table or {})
+
+    def _vector(self, text: str):
+        vec = self.table.get(text)
+        if vec is None:
+            return super()._vector(text)
+        return np.array(vec, dtype=np.float32)
+
+
+def build_snapshot(matrix, mode: str, storage: str = "int8", nlist: Optional[int] = None):
+    """Índice en memoria para ``mode``; devuelve ``(snapshot, segundos de construcción)``."""
+    if mode not in BENCH_MODES:
+        raise ValueError(f"mode debe ser uno de {list(BENCH_MODES)}")
+    n_rows = matrix.shape[0]
+    chunks = [retrieval.ChunkMeta(doc=f"bench{i // 1000}.pdf", page=i, text=f"chunk {i}", vector_index=i)
+              for i in range(n_rows)]
+    t0 = time.perf_counter()
+    quant = quantize(matrix, storage) if mode == "quantized" else None
+    ann = build_ivf(matrix, nlist) if mode == "ann" else None
+    build_seconds = time.perf_counter() - t0
+    snapshot = retrieval.IndexSnapshot(
+        matrix=matrix, chunks=chunks, sig_ids=np.arange(n_rows), version=f"bench-{mode}-{n_rows}",
+        quant=quant, ann=ann, deduped=True, loaded_at=time.time(),
+    )
+    return snapshot, build_seconds
+
+
+def exact_top_k(matrix, queries, k: int):
+    """Top-k exacto por query (filas ordenadas por score), en bloques de queries."""
+    out = np.empty((queries.shape[0], k), dtype=np.int64)
+    for start in range(0, queries.shape[0], 64):
+        sims = queries[start:start + 64] @ matrix.T
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, part, axis=1), axis=1)
+        out[start:start + part.shape[0]] = np.take_along_axis(part, order, axis=1)
+    return out
+
+
+@contextmanager
+def installed(snapshot, embedder) -> Iterator[None]:
+    """Instala ``snapshot`` y ``embedder`` en ``retrieval`` sin caches ni micro-batching; restaura al salir."""
+    saved = {name: getattr(retrieval, name) for name in
+             ("_SNAPSHOT", "_EMBED_MODEL", "_RESULT_CACHE", "_QUERY_CACHE", "MIN_SCORE", "MICROBATCH_MS")}
+    retrieval._SNAPSHOT = snapshot
+    retrieval._EMBED_MODEL = embedder
+    retrieval._RESULT_CACHE = TTLCache(0, 0)
+    retrieval._QUERY_CACHE = TTLCache(0, 0)
+    retrieval.MIN_SCORE = -1.0  # siempre top_k resultados, para medir recall
+    retrieval.MICROBATCH_MS = 0.0
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(retrieval, name, value)
+
+
+def _percentiles(latencies_ms: Sequence[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(np.asarray(latencies_ms), [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def run_mode(matrix, queries, mode: str, k: int = 10, nprobe: int = ANN_NPROBE_DEFAULT,
+             storage: str = "int8", warmup: int = 5, truth=None) -> Dict[str, Any]:
+    """Mide ``retrieval.search`` con el índice de ``mode`` y ``queries`` (vectores normalizados)."""
+    snapshot, build_seconds = build_snapshot(matrix, mode, storage)
+    texts = [f"bench query {i}" for i in range(queries.shape[0])]
+    embedder = FakeEmbedder(matrix.shape[1], dict(zip(texts, queries)))
+    truth = exact_top_k(matrix, queries, k) if truth is None else truth
+    # Sin MMR: el recall se mide contra el top-k exacto por relevancia.
+    options = {"top_k": k, "exact": mode == "brute", "nprobe": nprobe, "mode": "dense", "mmr_lambda": 1.0}
+    latencies: List[float] = []
+    hits = 0
+    with installed(snapshot, embedder):
+        for text in texts[:warmup]:
+            retrieval.search(text, **options)
+        t_start = time.perf_counter()
+        for i, text in enumerate(texts):
+            t0 = time.perf_counter()
+            results = retrieval.search(text, **options)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits += len({r["page"] for r in results} & set(truth[i].tolist()))
+        elapsed = time.perf_counter() - t_start
+    index_bytes = matrix.nbytes + (snapshot.quant.nbytes if snapshot.quant is not None else 0)
+    row: Dict[str, Any] = {
+        "rows": int(matrix.shape[0]),
+        "mode": mode,
+        **_percentiles(latencies),
+        "qps": round(len(texts) / elapsed, 1),
+        "recall_at_k": round(hits / (k * len(texts)), 4),
+        "build_s": round(build_seconds, 3),
+        "index_mb": round(index_bytes / 2 ** 20, 1),
+    }
+    if mode == "ann":
+        row.update(nprobe=nprobe, nlist=snapshot.ann.nlist)
+    if mode == "quantized":
+        row["storage"] = storage
+    return row
+
+
+def _server_total_ms(header: str) -> Optional[float]:
+    """``total`` del header ``Server-Timing`` (ms), si viene."""
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name == "total" and params.startswith("dur="):
+            return float(params[4:])
+    return None
+
+
+def run_http(client, n_queries: int = 200, k: int = 10, concurrency: int = 1, warmup: int = 5,
+             queries: Sequence[str] = HTTP_QUERIES, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Mide ``POST /search`` de un servicio corriendo; ``client`` es un ``httpx.Client`` con ``base_url``.
+
+    Cada query lleva un sufijo distinto: si no, desde la segunda vuelta las
+    respuestas saldrían del cache de resultados y no del retrieval.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    health = client.get("/health").json()
+    texts = [f"{queries[i % len(queries)]} ({i})" for i in range(warmup + n_queries)]
+
+    def one(text: str) -> Tuple[float, Optional[float]]:
+        t0 = time.perf_counter()
+        response = client.post("/search", json={"query": text, "top_k": k, **(options or {})})
+        elapsed = (time.perf_counter() - t0) * 1000
+        response.raise_for_status()
+        return elapsed, _server_total_ms(response.headers.get("server-timing", ""))
+
+    for text in texts[:warmup]:
+        one(text)
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        measured = list(pool.map(one, texts[warmup:]))
+    elapsed = time.perf_counter() - t_start
+    server = [s for _, s in measured if s is not None]
+    row: Dict[str, Any] = {
+        "rows": int(health.get("index", {}).get("rows", 0)),
+        "mode": "http",
+        **_percentiles([latency for latency, _ in measured]),
+        "qps": round(len(measured) / elapsed, 1),
+        "concurrency": max(1, concurrency),
+        "model": health.get("model_name"),
+    }
+    if server:
+        row["server_p50_ms"] = _percentiles(server)["p50_ms"]
+    return row
+
+
+def run_benchmark(sizes: Sequence[int], modes: Sequence[str] = BENCH_MODES, dim: int = 256,
+                  n_queries: int = 200, k: int = 10, nprobe: int = ANN_NPROBE_DEFAULT,
+                  storage: str = "int8", seed: int = 0, log=print) -> Dict[str, Any]:
+    results = []
+    for n_rows in sizes:
+        t0 = time.perf_counter()
+        matrix = synthetic_corpus(n_rows, dim, seed=seed)
+        queries = sample_queries(matrix, n_queries, seed=seed + 1)
+        truth = exact_top_k(matrix, queries, k)
+        log(f"[RAG] 🧪 Corpus sintético {n_rows} x {dim} ({time.perf_counter() - t0:.1f} s)")
+        for mode in modes:
+            row = run_mode(matrix, queries, mode, k=k, nprobe=nprobe, storage=storage, truth=truth)
+            log(f"[RAG] 🧪 {mode:>9} {n_rows:>8}: p50 {row['p50_ms']} ms, p99 {row['p99_ms']} ms, "
+                f"{row['qps']} qps, recall {row['recall_at_k']}")
+            results.append(row)
+        del matrix
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "dim": dim,
+            "queries": n_queries,
+            "k": k,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Diferencias por (filas, modo) entre dos reportes: p95 y QPS en %, recall absoluto."""
+    before: Dict[Tuple[int, str], Dict[str, Any]] = {(r["rows"], r["mode"]): r for r in previous.get("results", [])}
+    diffs = []
+    for row in current.get("results", []):
+        old = before.get((row["rows"], row["mode"]))
+        if old is None:
+            continue
+        diffs.append({
+            "rows": row["rows"],
+            "mode": row["mode"],
+            "p95_pct": round(100 * (row["p95_ms"] / old["p95_ms"] - 1), 1) if old["p95_ms"] else None,
+            "qps_pct": round(100 * (row["qps"] / old["qps"] - 1), 1) if old["qps"] else None,
+            "recall_delta": round(row["recall_at_k"] - old["recall_at_k"], 4),
+        })
+    return diffs
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:  # pragma: no cover (IO test manual)
+    """Benchmark de retrieval.search sobre corpus sintéticos (o de un servicio con --url): p50/p95/p99, QPS y recall@k."""
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--tamanos", default="1000,10000,100000",
+                        help="Filas del corpus separadas por coma (hasta 1000000; ~1 GB de RAM con dim 256)")
+    parser.add_argument("--modos", default="brute,quantized,ann", help="Modos separados por coma")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensión de los vectores sintéticos")
+    parser.add_argument("--queries", type=int, default=200, help="Nº de queries medidas por modo")
+    parser.add_argument("--k", type=int, default=10, help="Tamaño del top-k")
+    parser.add_argument("--nprobe", type=int, default=None, help="Listas IVF sondeadas (modo ann)")
+    parser.add_argument("--storage", default="int8", choices=("int8", "float16"), help="Modo quantized")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--salida", default="rag_bench.json", help="Archivo JSON del reporte")
+    parser.add_argument("--comparar", default=None, help="Reporte previo contra el que comparar")
+    parser.add_argument("--url", default=None,
+                        help="Mide POST /search de un RAG Service corriendo en vez del corpus sintético")
+    parser.add_argument("--concurrencia", type=int, default=1, help="Clientes simultáneos (con --url)")
+    options = parser.parse_args(argv)
+
+    if options.url:
+        import httpx
+        with httpx.Client(base_url=options.url, timeout=60) as client:
+            row = run_http(client, n_queries=options.queries, k=options.k, concurrency=options.concurrencia)
+        report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "url": options.url,
+                           "queries": options.queries, "k": options.k}, "results": [row]}
+        print(f"{options.url} ({row['rows']} chunks, {row['concurrency']} clientes): p50 {row['p50_ms']} ms, "
+              f"p95 {row['p95_ms']} ms, p99 {row['p99_ms']} ms, {row['qps']} qps, "
+              f"servidor p50 {row.get('server_p50_ms', 'n/d')} ms")
+        if options.comparar:
+            with open(options.comparar, encoding="utf-8") as fh:
+                report["comparison"] = compare(report, json.load(fh))
+            print(f"Contra {options.comparar}: {report['comparison']}")
+        with open(options.salida, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Reporte guardado en {options.salida}")
+        return 0
+
+    sizes = [int(x) for x in options.tamanos.split(",") if x.strip()]
+    modes = [m.strip() for m in options.modos.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in BENCH_MODES]
+    if unknown:
+        parser.error(f"modos desconocidos: {unknown} (válidos: {list(BENCH_MODES)})")
+
+    report = run_benchmark(sizes, modes, dim=options.dim, n_queries=options.queries, k=options.k,
+                           nprobe=options.nprobe or ANN_NPROBE_DEFAULT, storage=options.storage, seed=options.seed)
+
+    print(f"{'filas':>9} {'modo':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'qps':>9} {'recall':>7}")
+    for row in report["results"]:
+        print(f"{row['rows']:>9} {row['mode']:>10} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['qps']:>9.1f} {row['recall_at_k']:>7.3f}")
+
+    if options.comparar:
+        with open(options.comparar, encoding="utf-8") as fh:
+            previous = json.load(fh)
+        report["comparison"] = compare(report, previous)
+        print(f"\nContra {options.comparar}:")
+        print(f"{'filas':>9} {'modo':>10} {'p95 %':>8} {'qps %':>8} {'Δ recall':>9}")
+        for diff in report["comparison"]:
+            print(f"{diff['rows']:>9} {diff['mode']:>10} {diff['p95_pct']!s:>8} {diff['qps_pct']!s:>8} "
+                  f"{diff['recall_delta']:>9.4f}")
+
+    with open(options.salida, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"Reporte guardado en {options.salida}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
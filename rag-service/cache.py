@@ -0,0 +1,71 @@
+"""Caches en proceso para el retrieval (LRU acotado con TTL)."""
+from __future__ import annotations
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Forma canónica de una query para usarla como clave de cache."""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+class TTLCache:
+    """LRU acotado por ``maxsize`` con expiración por entrada (``ttl`` segundos).
+
+    ``maxsize <= 0`` desactiva el cache; ``ttl <= 0`` no expira por tiempo.
+    Thread-safe: el executor de inferencia usa varios threads por proceso.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if not expires or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else 0.0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,154 @@
+"""Store persistente de embeddings por contenido de chunk (ingesta incremental).
+
+La clave de cada vector es ``sha1(modelo + texto normalizado)``: un chunk
+que no cambió entre ingestas reutiliza su vector y sólo se codifican los
+textos nuevos. Junto a los vectores se guarda el catálogo de documentos
+fuente, que permite agregar o quitar un PDF sin volver a extraer el resto.
+
+Estructura de ``RAG_CHUNK_STORE``::
+
+    keys.npy        sha1 binario por vector (uint8, n x 20)
+    vectors.npy     float32 (n x dim)
+    documents.json  doc -> {"fingerprint": sha1 del PDF, "chunks": [{"page", "text"}, ...]}
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from retrieval import COLLECTIONS_DIR, DEFAULT_COLLECTION, INDEX_DIR
+
+CHUNK_STORE_DIR = os.environ.get(
+    "RAG_CHUNK_STORE", os.path.join(os.path.dirname(INDEX_DIR.rstrip("/")), "chunk_store")
+)
+
+
+def chunk_key(text: str, model: str) -> bytes:
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha1(f"{model}\0{normalized}".encode("utf-8")).digest()
+
+
+def _replace_file(path: str, write: Callable[[str], None]) -> None:
+    """Escribe en ``path + '.tmp'`` y lo mueve encima (los lectores con mmap no se rompen)."""
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class EmbeddingStore:
+    """Vectores por clave de contenido + catálogo de documentos fuente."""
+
+    def __init__(self, directory: str, model: str):
+        self.directory = directory
+        self.model = model
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._keys: List[bytes] = []
+        self._blocks: List[Any] = []
+        self._index: Dict[bytes, int] = {}
+        self.last_stats = {"reused": 0, "embedded": 0}
+        keys_path = os.path.join(directory, "keys.npy")
+        if os.path.exists(keys_path):
+            keys = np.load(keys_path)
+            vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            if keys.shape[0] == vectors.shape[0]:
+                self._keys = [k.tobytes() for k in keys]
+                self._blocks = [vectors]
+                self._index = {k: i for i, k in enumerate(self._keys)}
+            else:  # escritura interrumpida: se vuelve a generar lo necesario
+                print(f"[RAG] ⚠️ Store de embeddings inconsistente en {directory}, se ignora")
+        docs_path = os.path.join(directory, "documents.json")
+        if os.path.exists(docs_path):
+            with open(docs_path, encoding="utf-8") as fh:
+                self.documents = json.load(fh)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _matrix(self):
+        if len(self._blocks) > 1:
+            self._blocks = [np.concatenate([np.asarray(b, dtype=np.float32) for b in self._blocks])]
+        return self._blocks[0]
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[Sequence[str]], Any]):
+        """Matriz de embeddings de ``texts``; ``embed_fn`` sólo recibe los textos sin vector guardado.
+
+        Devuelve None si ``embed_fn`` no pudo generar embeddings.
+        """
+        keys = [chunk_key(t, self.model) for t in texts]
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in self._index and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            if vectors is None:
+                return None
+            vectors = np.asarray(vectors, dtype=np.float32)
+            for key in missing:
+                self._index[key] = len(self._keys)
+                self._keys.append(key)
+            self._blocks.append(vectors)
+        self.last_stats = {"reused": len(texts) - len(missing), "embedded": len(missing)}
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = np.fromiter((self._index[k] for k in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(self._matrix()[rows], dtype=np.float32)
+
+    def texts(self) -> Iterable[str]:
+        for entry in self.documents.values():
+            for chunk in entry["chunks"]:
+                yield chunk["text"]
+
+    def prune(self) -> int:
+        """Compacta: descarta vectores que ningún documento del catálogo usa. Devuelve cuántos."""
+        used = {chunk_key(t, self.model) for t in self.texts()}
+        keep = [i for i, k in enumerate(self._keys) if k in used]
+        removed = len(self._keys) - len(keep)
+        if removed:
+            matrix = self._matrix()
+            self._keys = [self._keys[i] for i in keep]
+            self._blocks = [np.asarray(matrix[np.array(keep, dtype=np.int64)], dtype=np.float32)]
+            self._index = {k: i for i, k in enumerate(self._keys)}
+        return removed
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if self._keys:
+            # uint8 y no "S20": numpy recorta los bytes nulos finales de los strings.
+            keys = np.frombuffer(b"".join(self._keys), dtype=np.uint8).reshape(-1, 20)
+            matrix = np.asarray(self._matrix(), dtype=np.float32)
+
+            def write_vectors(tmp: str) -> None:
+                with open(tmp, "wb") as fh:
+                    np.save(fh, matrix)
+
+            def write_keys(tmp: str) -> None:
+                with open(tmp, "wb") as fh:
+                    np.save(fh, keys)
+
+            _replace_file(os.path.join(self.directory, "vectors.npy"), write_vectors)
+            _replace_file(os.path.join(self.directory, "keys.npy"), write_keys)
+
+        def write_documents(tmp: str) -> None:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self.documents, fh, ensure_ascii=False)
+
+        _replace_file(os.path.join(self.directory, "documents.json"), write_documents)
+
+
+def store_dir(collection: Optional[str] = None) -> str:
+    """``RAG_CHUNK_STORE`` para la colección por defecto; ``RAG_COLLECTIONS_DIR/<nombre>/chunk_store`` si no."""
+    if not collection or collection == DEFAULT_COLLECTION:
+        return CHUNK_STORE_DIR
+    return os.path.join(COLLECTIONS_DIR, collection, "chunk_store")
+
+
+def open_store(model: str, directory: Optional[str] = None, collection: Optional[str] = None) -> EmbeddingStore:
+    return EmbeddingStore(directory or store_dir(collection), model)
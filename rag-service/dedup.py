@@ -0,0 +1,83 @@
+"""Detección de chunks duplicados y casi duplicados en la ingesta (SimHash).
+
+Cada chunk recibe una firma SimHash de 64 bits sobre shingles de tokens.
+Un chunk a distancia de Hamming <= ``SIMHASH_DISTANCE`` del representante
+de un cluster queda en ese cluster; por el principio del palomar basta comparar
+contra los representantes que coinciden en alguna de ``SIMHASH_DISTANCE + 1``
+bandas de bits.
+"""
+from __future__ import annotations
+import hashlib
+import os
+from typing import Dict, List, Sequence
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from lexical import tokenize
+
+INGEST_DEDUP = os.environ.get("RAG_INGEST_DEDUP", "1") == "1"
+SIMHASH_DISTANCE = int(os.environ.get("RAG_SIMHASH_DISTANCE", "3"))  # bits; 0 = sólo duplicados exactos
+SIMHASH_NGRAM = 3
+
+_BITS = 64
+
+
+def _shingle_hashes(text: str):
+    tokens = tokenize(text)
+    if len(tokens) > SIMHASH_NGRAM:
+        shingles = [" ".join(tokens[i:i + SIMHASH_NGRAM]) for i in range(len(tokens) - SIMHASH_NGRAM + 1)]
+    else:
+        shingles = [" ".join(tokens)]
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def simhash(text: str) -> int:
+    """Firma SimHash de 64 bits: cada bit es el voto mayoritario de los shingles."""
+    hashes = _shingle_hashes(text)
+    bits = (hashes[:, None] >> np.arange(_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - hashes.shape[0]
+    return sum(1 << int(i) for i in np.flatnonzero(votes > 0))
+
+
+def near_duplicate_clusters(texts: Sequence[str], max_distance: int = SIMHASH_DISTANCE):
+    """Id de cluster por chunk: la posición del representante (primer chunk) de su grupo.
+
+    Cada chunk se compara contra los representantes de cluster, no contra
+    cualquier miembro: si A~B y B~C pero A y C superan ``max_distance``, C no
+    queda con A por encadenamiento.
+    """
+    n = len(texts)
+    labels = np.arange(n, dtype=np.int64)
+    exact: Dict[str, int] = {}
+    hashes = [simhash(t) for t in texts] if max_distance > 0 and n > 1 else None
+    bands = max_distance + 1
+    width = _BITS // bands
+    mask = (1 << width) - 1
+    buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]  # sólo representantes
+    for i, text in enumerate(texts):
+        first = exact.setdefault(" ".join(text.split()).lower(), i)
+        if first != i:
+            labels[i] = labels[first]
+            continue
+        if hashes is None:
+            continue
+        h = hashes[i]
+        keys = [(h >> (band * width)) & mask for band in range(bands)]
+        rep = min(
+            (r for band, key in enumerate(keys) for r in buckets[band].get(key, ())
+             if (h ^ hashes[r]).bit_count() <= max_distance),
+            default=None,
+        )
+        if rep is not None:
+            labels[i] = rep
+            continue
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(i)
+    return labels
@@ -0,0 +1,143 @@
+"""Interfaz común de los embedders y un embedder determinista sin modelo.
+
+``retrieval`` sólo usa ``encode`` (misma firma que
+``SentenceTransformer.encode``), ``dimension`` y ``name``; el backend se
+elige con ``RAG_EMBED_BACKEND``:
+
+- ``torch``: sentence-transformers (``SentenceTransformerEmbedder``).
+- ``onnx``: ONNX Runtime en CPU (``onnx_embedder.OnnxEmbedder``).
+- ``hashing``: ``HashingEmbedder``, feature hashing de tokens y bigramas.
+  No descarga nada ni necesita torch: sirve para correr ingesta, servidor y
+  benchmarks de punta a punta en una máquina sin red. Los textos que
+  comparten términos quedan cerca, pero no hay semántica: no es para
+  producción.
+"""
+from __future__ import annotations
+import hashlib
+import math
+import os
+from collections import Counter
+from functools import lru_cache
+from typing import Any, List, Protocol, Tuple, runtime_checkable
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from lexical import tokenize
+
+HASH_DIM = int(os.environ.get("RAG_HASH_DIM", "384"))
+HASH_NGRAMS = int(os.environ.get("RAG_HASH_NGRAMS", "2"))  # 1 = sólo tokens, 2 = + bigramas
+
+
+@runtime_checkable
+class Embedder(Protocol):
+    name: str
+
+    @property
+    def dimension(self) -> int: ...
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs: Any): ...
+
+
+def hashing_model_name(dim: int = HASH_DIM) -> str:
+    """Nombre con el que el embedder determinista firma índices, store y caches."""
+    return f"hashing-{dim}"
+
+
+def onnx_model_name(model: str, quantized: bool) -> str:
+    """Nombre del backend ONNX: la variante int8 firma aparte (``<modelo>+onnx-int8``).
+
+    El grafo float32 reproduce a PyTorch (coseno ~1) y conserva el nombre
+    del modelo, así reutiliza su índice y su chunk store.
+    """
+    return f"{model}+onnx-int8" if quantized else model
+
+
+@lru_cache(maxsize=65536)
+def _slot(feature: str, dim: int) -> Tuple[int, float]:
+    """Posición y signo de ``feature`` (el signo evita que las colisiones sólo sumen)."""
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return (h >> 1) % dim, 1.0 if h & 1 else -1.0
+
+
+class HashingEmbedder:
+    """Embedder determinista: tokens (y n-gramas) hasheados a ``dim`` posiciones.
+
+    Mismo texto, mismo vector en cualquier proceso y máquina. Peso por
+    término ``1 + log(tf)``; con ``normalize_embeddings`` cada fila tiene
+    norma 1, igual que el modelo real.
+    """
+
+    max_seq_length = 512  # sin tokenizer: embed_texts estima el largo como chars / 4
+
+    def __init__(self, dim: int = HASH_DIM, ngrams: int = HASH_NGRAMS):
+        if dim < 8:
+            raise ValueError("dim debe ser al menos 8")
+        self.dim = dim
+        self.ngrams = max(1, ngrams)
+        self.name = hashing_model_name(dim)
+
+    @property
+    def dimension(self) -> int:
+        return self.dim
+
+    def features(self, text: str) -> List[str]:
+        # Un texto sin tokens útiles (sólo stopwords o vacío) igual recibe un vector no nulo.
+        tokens = tokenize(text) or [text.strip().lower()]
+        feats = list(tokens)
+        for n in range(2, self.ngrams + 1):
+            feats += [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+        return feats
+
+    def _vector(self, text: str):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature, tf in Counter(self.features(text)).items():
+            slot, sign = _slot(feature, self.dim)
+            vec[slot] += sign * (1.0 + math.log(tf))
+        return vec
+
+    def encode(self, sentences, normalize_embeddings: bool = False, batch_size: int = 256,
+               show_progress_bar: bool = False, **kwargs: Any):
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            out[i] = self._vector(text)
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+
+class SentenceTransformerEmbedder:
+    """``SentenceTransformer`` detrás de la interfaz ``Embedder``."""
+
+    def __init__(self, model, name: str):
+        self.model = model
+        self.name = name
+
+    @property
+    def dimension(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension())
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, "tokenizer", None)
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.max_seq_length
+
+    @max_seq_length.setter
+    def max_seq_length(self, value: int) -> None:
+        self.model.max_seq_length = value
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs: Any):
+        return self.model.encode(sentences, normalize_embeddings=normalize_embeddings, **kwargs)
+
+
+def load_sentence_transformer(name: str, device: str) -> SentenceTransformerEmbedder:  # pragma: no cover (IO heavy)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(name, device=device, trust_remote_code=True)  # Necesario para gte-Qwen2-7B
+    return SentenceTransformerEmbedder(model, name)
@@ -0,0 +1,270 @@
+"""Encode en CPU repartido entre réplicas del modelo en procesos worker.
+
+En CPU un ``encode`` de PyTorch ocupa un solo pool intra-op y sumar workers
+de uvicorn multiplica la memoria del modelo en cada uno. ``EncodePool``
+levanta ``RAG_ENCODE_WORKERS`` procesos (``spawn``, seguro con torch), cada
+uno con su réplica del modelo y ``RAG_ENCODE_THREADS`` hilos, y
+``embed_texts`` les reparte los lotes grandes (ingesta y ``/embed`` masivos):
+
+- los textos se ordenan por largo y se reparten en shards de costo parecido;
+- cada worker codifica su shard con ``embed_texts`` local (lotes por
+  presupuesto de tokens) y escribe sus filas directo en un buffer de
+  ``shared_memory`` del tamaño del resultado: los vectores no vuelven
+  serializados por el pipe, sólo la cuenta de filas.
+
+Hay un solo pool por máquina (``shared_pool``): el primer proceso que toma
+el lock ``RAG_ENCODE_POOL_SOCKET.lock`` lo hospeda y lo sirve en ese socket
+Unix; los demás workers de uvicorn le mandan sus lotes (``PoolClient``) y
+sus workers escriben en el buffer de ``shared_memory`` del que pregunta.
+Con W workers de uvicorn quedan W + N réplicas del modelo, no W x (N + 1).
+
+Las queries de búsqueda no pasan por aquí: son pocos textos y la latencia
+del ida y vuelta entre procesos no compensa.
+"""
+from __future__ import annotations
+import math
+import os
+import sys
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Union
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from batching import shard_rows
+
+ENCODE_THREADS = int(os.environ.get("RAG_ENCODE_THREADS", "0"))  # hilos por worker; 0 = cores / workers
+ENCODE_SHARD_ROWS = int(os.environ.get("RAG_ENCODE_SHARD_ROWS", "1024"))  # filas máximas por shard
+ENCODE_POOL_SOCKET = os.environ.get("RAG_ENCODE_POOL_SOCKET", "/tmp/rag-encode-pool.sock")
+
+
+def _init_worker(threads: int, token_budget: Optional[int]) -> None:  # pragma: no cover (corre en el worker)
+    import retrieval
+    retrieval.USE_GPU = False
+    retrieval.EMBED_TOKEN_BUDGET = token_budget
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    retrieval._lazy_load_model()  # cada worker carga su réplica al arrancar, no en el primer shard
+
+
+def _worker_dimension() -> int:
+    import retrieval
+    model = retrieval._lazy_load_model()
+    if model is None:
+        raise RuntimeError("el worker no pudo cargar el modelo de embeddings")
+    return int(model.dimension)
+
+
+def _worker_encode(shm_name: str, shape: Sequence[int], rows: Sequence[int], texts: Sequence[str]) -> int:
+    import retrieval
+    vecs = retrieval._embed_local(texts)
+    if vecs is None:
+        raise RuntimeError("el worker no pudo cargar el modelo de embeddings")
+    shm = _attach(shm_name)
+    try:
+        # Vista temporal: no debe sobrevivir al close() del segmento.
+        np.ndarray(tuple(shape), dtype=np.float32, buffer=shm.buf)[np.asarray(rows, dtype=np.int64)] = vecs
+    finally:
+        shm.close()
+    return len(rows)
+
+
+def _attach(name: str):
+    """Abre el segmento ``name`` creado por otro proceso sin registrarlo en el resource tracker.
+
+    El segmento es del proceso que pidió el encode, que hace unlink. Si el
+    worker lo registrara (lo hace ``SharedMemory`` antes de 3.13), el tracker
+    del host acumularía un registro por pedido y al salir avisaría de
+    segmentos "filtrados" o haría unlink de segmentos ajenos.
+    """
+    from multiprocessing import resource_tracker, shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+    return shm
+
+
+class EncodePool:
+    """Despachador de ``encode`` sobre ``workers`` réplicas del modelo.
+
+    ``executor`` permite inyectar otro ``Executor`` (p. ej. threads en tests);
+    por defecto es un ``ProcessPoolExecutor`` con contexto ``spawn``.
+    """
+
+    def __init__(self, workers: int, threads: int = ENCODE_THREADS, token_budget: Optional[int] = None,
+                 shard_rows_max: int = ENCODE_SHARD_ROWS, executor: Optional[Executor] = None):
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.shard_rows_max = max(1, shard_rows_max)
+        if executor is None:  # pragma: no cover (IO heavy)
+            import multiprocessing
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads, token_budget),
+            )
+        self._executor = executor
+        self._listener = None   # socket de ``serve`` si este proceso hospeda el pool compartido
+        self._host_lock = None  # lock de ``shared_pool``, abierto mientras viva el pool
+        self._dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._texts = 0
+        self._shards = 0
+
+    @property
+    def dimension(self) -> int:
+        if self._dim is None:
+            self._dim = self._executor.submit(_worker_dimension).result()
+        return self._dim
+
+    def encode(self, texts: Sequence[str]):
+        """Embeddings normalizados (n x dim) float32, en el orden de ``texts``."""
+        return _encode_shared(self.fill, list(texts), self.dimension)
+
+    def fill(self, shm_name: str, shape: Sequence[int], texts: Sequence[str]) -> int:
+        """Codifica ``texts`` en el segmento ``shm_name`` (``shape`` float32) repartiéndolos entre los workers."""
+        n_shards = max(self.workers, math.ceil(len(texts) / self.shard_rows_max))
+        shards = shard_rows([len(t) for t in texts], min(n_shards, len(texts)))
+        futures = [
+            self._executor.submit(_worker_encode, shm_name, tuple(shape), rows, [texts[i] for i in rows])
+            for rows in shards
+        ]
+        for fut in futures:
+            fut.result()
+        with self._lock:
+            self._jobs += 1
+            self._texts += len(texts)
+            self._shards += len(shards)
+        return len(shards)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": self.workers, "threads_per_worker": self.threads, "jobs": self._jobs,
+                    "texts": self._texts, "shards": self._shards, "host_pid": os.getpid()}
+
+    def shutdown(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _encode_shared(fill: Callable[[str, Sequence[int], Sequence[str]], Any], texts: Sequence[str], dim: int):
+    """Crea el buffer compartido del resultado, lo hace llenar con ``fill`` y devuelve una copia."""
+    from multiprocessing import shared_memory
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32)
+    shape = (len(texts), dim)
+    shm = shared_memory.SharedMemory(create=True, size=len(texts) * dim * 4)
+    try:
+        fill(shm.name, shape, texts)
+        return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _key_path(address: str) -> str:
+    return address + ".key"
+
+
+def serve(pool: EncodePool, address: str, authkey: bytes) -> None:
+    """Sirve ``pool`` en el socket Unix ``address`` hasta ``pool.shutdown()`` (threads daemon; una conexión por pedido)."""
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Listener
+
+    if os.path.exists(address):
+        os.remove(address)  # socket de un host anterior: quien llama tiene el lock
+    listener = pool._listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    handlers = {"fill": pool.fill, "dimension": lambda: pool.dimension, "stats": pool.stats}
+
+    def handle(conn) -> None:
+        with conn:
+            op, *args = conn.recv()
+            try:
+                conn.send(("ok", handlers[op](*args)))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def accept_loop() -> None:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError):
+                continue  # cliente con otra clave o que cortó durante el handshake
+            except OSError:
+                return  # listener cerrado por shutdown()
+            threading.Thread(target=handle, args=(conn,), name="rag-encode-pool-conn", daemon=True).start()
+
+    threading.Thread(target=accept_loop, name="rag-encode-pool-server", daemon=True).start()
+
+
+class PoolClient:
+    """``EncodePool`` hospedado por otro proceso (``serve``); misma interfaz que ``EncodePool``."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self._dim: Optional[int] = None
+
+    def _call(self, op: str, *args: Any) -> Any:
+        from multiprocessing.connection import Client
+        # La clave se lee en cada pedido: el host la escribe después de tomar el lock.
+        with open(_key_path(self.address), "rb") as fh:
+            authkey = fh.read()
+        with Client(self.address, family="AF_UNIX", authkey=authkey) as conn:
+            conn.send((op, *args))
+            status, value = conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"pool de encode compartido: {value}")
+        return value
+
+    @property
+    def dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self._call("dimension"))
+        return self._dim
+
+    def encode(self, texts: Sequence[str]):
+        return _encode_shared(lambda *args: self._call("fill", *args), list(texts), self.dimension)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call("stats")
+
+    def shutdown(self) -> None:
+        pass
+
+
+def shared_pool(workers: int, token_budget: Optional[int] = None, address: str = ENCODE_POOL_SOCKET,
+                executor: Optional[Executor] = None) -> Union[EncodePool, PoolClient]:
+    """El pool de la máquina: lo hospeda quien toma el lock de ``address``; el resto recibe un ``PoolClient``.
+
+    El lock (``flock``) se libera solo si el host muere; entonces el próximo
+    proceso que llama vuelve a elegirse host.
+    """
+    import fcntl
+    import secrets
+
+    lock = open(address + ".lock", "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return PoolClient(address)
+    pool = EncodePool(workers, token_budget=token_budget, executor=executor)
+    pool._host_lock = lock
+    authkey = secrets.token_bytes(32)
+    serve(pool, address, authkey)
+    tmp = _key_path(address) + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(authkey)
+    os.replace(tmp, _key_path(address))
+    return pool
@@ -11,29 +11,27 @@ else
     echo "[RAG Service] ⚠️  nvidia-smi no disponible (ejecutando en CPU)"
 fi
 
-# Verificar si hay embeddings pre-generados
+# Verificar si hay un índice pre-generado
 EMBED_CACHE_PATH="${RAG_EMBED_CACHE:-/app/rag_cache/embeddings.npz}"
+INDEX_DIR="${RAG_INDEX_DIR:-$(dirname "$EMBED_CACHE_PATH")/index}"
+CHUNK_STORE="${RAG_CHUNK_STORE:-$(dirname "$INDEX_DIR")/chunk_store}"
+# CURRENT apunta a la versión publicada; manifest.json suelto es el formato anterior
+HAS_INDEX=0
+if [ -f "$INDEX_DIR/CURRENT" ] || [ -f "$INDEX_DIR/manifest.json" ]; then
+    HAS_INDEX=1
+fi
 
-if [ ! -f "$EMBED_CACHE_PATH" ]; then
-    echo "[RAG Service] 📚 Cache de embeddings no encontrado, ejecutando ingesta..."
-    python -c "
-from ingest import ingest_pdfs
-import os
-
-docs_dir = 'docs'
-cache_path = os.environ.get('RAG_EMBED_CACHE', '/app/rag_cache/embeddings.npz')
-
-try:
-    count = ingest_pdfs(docs_dir, cache_path)
-    print(f'[RAG Service] ✅ Ingesta completada: {count} chunks')
-except Exception as e:
-    print(f'[RAG Service] ⚠️  Error en ingesta: {e}')
-    import traceback
-    traceback.print_exc()
-    print('[RAG Service] Continuando sin embeddings pre-cargados...')
-" || echo "[RAG Service] ⚠️  Ingesta falló, continuando..."
+if [ "$HAS_INDEX" = 1 ] && [ -f "$CHUNK_STORE/documents.json" ]; then
+    # Incremental: sólo se procesan PDFs nuevos o modificados; sin cambios no se toca el índice.
+    echo "[RAG Service] ✅ Índice encontrado en $INDEX_DIR, sincronizando PDFs modificados..."
+    python ingest.py --dir docs || echo "[RAG Service] ⚠️  Ingesta incremental falló, se usa el índice existente"
+elif [ "$HAS_INDEX" = 1 ]; then
+    echo "[RAG Service] ✅ Índice encontrado en $INDEX_DIR"
+elif [ -f "$EMBED_CACHE_PATH" ]; then
+    echo "[RAG Service] ✅ Cache de embeddings (formato legado) encontrado en $EMBED_CACHE_PATH"
 else
-    echo "[RAG Service] ✅ Cache de embeddings encontrado en $EMBED_CACHE_PATH"
+    echo "[RAG Service] 📚 Índice no encontrado, ejecutando ingesta..."
+    python ingest.py --dir docs || echo "[RAG Service] ⚠️  Ingesta falló, continuando sin embeddings pre-cargados..."
 fi
 
 # Lanzar servidor FastAPI con Uvicorn
@@ -0,0 +1,124 @@
+"""Pre-filtrado por metadatos (documento, rango de páginas, capítulo).
+
+Al cargar el índice se precalculan las filas de cada documento y capítulo;
+una búsqueda filtrada sólo puntúa las filas seleccionadas.
+"""
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from lexical import fold_accents
+
+_CHAPTER_RE = re.compile(r"cap(?:itulo)?[\s_-]*(\d+)")
+
+
+def _doc_key(name: str) -> str:
+    key = fold_accents(name).lower().strip()
+    return key[:-4] if key.endswith(".pdf") else key
+
+
+def chapter_of(doc_name: str) -> Optional[int]:
+    """Número de capítulo a partir del nombre del PDF ("Capítulo5.pdf" -> 5)."""
+    match = _CHAPTER_RE.search(fold_accents(doc_name).lower())
+    return int(match.group(1)) if match else None
+
+
+def _as_list(data: Dict[str, Any], key: str) -> Sequence[Any]:
+    """Valor de ``data[key]`` como lista; un string o número suelto no se itera carácter a carácter."""
+    value = data.get(key)
+    if value is None:
+        return ()
+    if isinstance(value, (str, int)) and not isinstance(value, bool):
+        return (value,)
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f"{key} debe ser una lista")
+    return value
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    docs: Tuple[str, ...] = ()
+    pages: Tuple[Tuple[int, int], ...] = ()  # rangos inclusivos
+    chapters: Tuple[int, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.docs or self.pages or self.chapters)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["SearchFilters"]:
+        """Construye filtros desde el payload JSON; lanza ValueError si son inválidos.
+
+        ``pages`` acepta ``[[1, 10], 15]`` o ``["1-10", "15"]``. Un valor
+        suelto (``"docs": "Capitulo3.pdf"``, ``"chapters": 2``) equivale a una
+        lista de un elemento.
+        """
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError("filters debe ser un objeto")
+        docs = tuple(str(d) for d in _as_list(data, "docs"))
+        chapters = tuple(int(c) for c in _as_list(data, "chapters"))
+        pages: List[Tuple[int, int]] = []
+        for item in _as_list(data, "pages"):
+            if isinstance(item, str):
+                lo, _, hi = item.partition("-")
+                pages.append((int(lo), int(hi or lo)))
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                pages.append((int(item[0]), int(item[1])))
+            else:
+                pages.append((int(item), int(item)))
+        if any(lo > hi for lo, hi in pages):
+            raise ValueError("rango de páginas inválido")
+        filters = cls(docs=docs, pages=tuple(pages), chapters=chapters)
+        return filters or None
+
+
+class FilterIndex:
+    """Filas por documento y por capítulo, y página por fila."""
+
+    def __init__(self, doc_names: Sequence[str], doc_ids, pages):
+        self.pages = np.asarray(pages)
+        order = np.argsort(doc_ids, kind="stable")
+        bounds = np.zeros(len(doc_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.asarray(doc_ids), minlength=len(doc_names)), out=bounds[1:])
+        self.doc_rows: Dict[str, Any] = {}
+        chapter_parts: Dict[int, List[Any]] = {}
+        for i, name in enumerate(doc_names):
+            rows = np.sort(order[bounds[i]:bounds[i + 1]])
+            self.doc_rows[_doc_key(name)] = rows
+            chapter = chapter_of(name)
+            if chapter is not None:
+                chapter_parts.setdefault(chapter, []).append(rows)
+        self.chapter_rows = {c: np.sort(np.concatenate(parts)) for c, parts in chapter_parts.items()}
+
+    @classmethod
+    def from_chunks(cls, chunks: Sequence[Any]) -> "FilterIndex":
+        names: Dict[str, int] = {}
+        doc_ids = np.fromiter((names.setdefault(c.doc, len(names)) for c in chunks), dtype=np.int64, count=len(chunks))
+        pages = np.fromiter((c.page for c in chunks), dtype=np.int32, count=len(chunks))
+        return cls(list(names), doc_ids, pages)
+
+    def rows(self, filters: SearchFilters):
+        """Filas (ordenadas) que cumplen todos los filtros; documentos desconocidos no aportan filas."""
+        empty = np.zeros(0, dtype=np.int64)
+        selected = None
+        if filters.docs:
+            parts = [self.doc_rows.get(_doc_key(d), empty) for d in filters.docs]
+            selected = np.unique(np.concatenate(parts))
+        if filters.chapters:
+            parts = [self.chapter_rows.get(c, empty) for c in filters.chapters]
+            rows = np.unique(np.concatenate(parts))
+            selected = rows if selected is None else np.intersect1d(selected, rows, assume_unique=True)
+        if filters.pages:
+            pages = self.pages if selected is None else self.pages[selected]
+            mask = np.zeros(pages.shape[0], dtype=bool)
+            for lo, hi in filters.pages:
+                mask |= (pages >= lo) & (pages <= hi)
+            selected = np.flatnonzero(mask) if selected is None else selected[mask]
+        return empty if selected is None else selected.astype(np.int64, copy=False)
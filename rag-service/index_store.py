@@ -0,0 +1,290 @@
+"""Formato de índice en directorio (sin pickle, abierto con mmap).
+
+``RAG_INDEX_DIR`` contiene un archivo ``CURRENT`` con el nombre de la
+versión activa (``v<timestamp>/``). Cada escritura arma una versión nueva
+completa y publica cambiando ``CURRENT`` con ``os.replace`` (atómico): un
+lector siempre ve la versión anterior o la nueva, nunca un directorio a
+medio escribir ni un instante sin índice. Un directorio sin ``CURRENT`` con
+los archivos directamente adentro (formato anterior) se sigue leyendo.
+
+Estructura de cada versión::
+
+    manifest.json     modelo, dimensión, filas, modo de almacenamiento y checksum
+    embeddings.npy    matriz float32 completa (n_rows x dim)
+    compact.npy       matriz float16/int8 (sólo si hay cuantización)
+    scales.npy        escalas por dimensión (sólo int8)
+    docs.json         nombres de documento; doc_ids.npy apunta a esta lista
+    doc_ids.npy       int32 por fila
+    pages.npy         int32 por fila
+    sig_ids.npy       int64 por fila, firma de deduplicado (cluster SimHash si hubo dedup en la ingesta)
+    text_offsets.npy  int64 (n_rows + 1), offsets en texts.bin
+    texts.bin         textos de todos los chunks en un único blob UTF-8
+    ivf.npz           índice ANN opcional
+    lex_*.npy/json    índice léxico BM25 (listas invertidas CSR + vocabulario)
+
+Todos los arrays se abren con ``mmap_mode='r'``: la carga no depende del
+tamaño del corpus y el page cache del SO comparte los vectores entre procesos.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Sequence
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from retrieval import ChunkMeta, _signature_ids
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+_VERSION_PREFIX = "v"
+
+
+class ChunkStore(Sequence):
+    """Vista columnar de los chunks; construye ``ChunkMeta`` sólo al acceder."""
+
+    def __init__(self, doc_names: List[str], doc_ids, pages, offsets, blob):
+        self.doc_names = doc_names
+        self.doc_ids = doc_ids
+        self.pages = pages
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return int(self.pages.shape[0])
+
+    def text(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.blob[start:end]).decode("utf-8")
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        return ChunkMeta(
+            doc=self.doc_names[int(self.doc_ids[row])],
+            page=int(self.pages[row]),
+            text=self.text(row),
+            vector_index=row,
+        )
+
+
+@dataclass
+class LoadedIndex:
+    manifest: Dict[str, Any]
+    matrix: "np.ndarray"  # float32 (mmap)
+    chunks: ChunkStore
+    sig_ids: "np.ndarray"
+    quant: Any = None     # quantization.QuantizedMatrix
+    ann: Any = None       # ann.IVFIndex
+    lexical: Any = None   # lexical.BM25Index
+    filters: Any = None   # filters.FilterIndex
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return "sha256:" + digest.hexdigest()
+
+
+def resolve(directory: str) -> str:
+    """Directorio de la versión activa (``directory`` mismo en el formato anterior)."""
+    try:
+        with open(os.path.join(directory, CURRENT_NAME), encoding="utf-8") as fh:
+            name = fh.read().strip()
+    except FileNotFoundError:
+        return directory
+    return os.path.join(directory, name)
+
+
+def has_index(directory: str) -> bool:
+    return os.path.exists(os.path.join(resolve(directory), MANIFEST_NAME))
+
+
+def _publish(directory: str, name: str):
+    """Apunta ``CURRENT`` a ``name`` con un rename atómico y borra versiones viejas.
+
+    Se conserva la versión anterior: un proceso que acaba de leer ``CURRENT``
+    puede estar todavía abriendo sus archivos. Los mmaps ya abiertos siguen
+    funcionando aunque se borre el directorio (inodos abiertos).
+    """
+    current = os.path.join(directory, CURRENT_NAME)
+    previous = os.path.basename(resolve(directory)) if os.path.exists(current) else None
+    tmp = current + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(name)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, current)
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry in (CURRENT_NAME, name, previous):
+            continue
+        if os.path.isdir(path) and entry.startswith(_VERSION_PREFIX):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.isfile(path):
+            os.remove(path)  # archivos del formato anterior, ya sin lectores nuevos
+
+
+def write_index(directory: str, embeddings, docs: List[Dict[str, Any]], model_name: str,
+                storage_mode: str = "float32", build_ann: bool = True,
+                dedup: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Escribe una versión nueva del índice y la publica de forma atómica (``CURRENT``).
+
+    La versión se arma en ``v<timestamp>.tmp`` y se renombra al terminar,
+    así ``CURRENT`` nunca apunta a una versión incompleta. ``dedup`` describe
+    la eliminación de casi duplicados hecha en la ingesta: cada fila es su
+    propio cluster y las búsquedas ya no deduplican por consulta.
+    """
+    from ann import ANN_MIN_ROWS, build_ivf
+    from lexical import BM25Index
+    from quantization import quantize
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{_VERSION_PREFIX}{time.time_ns()}"
+    tmp = os.path.join(directory, name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    np.save(os.path.join(tmp, "embeddings.npy"), embeddings)
+
+    doc_names = sorted({d["doc"] for d in docs})
+    doc_index = {name: i for i, name in enumerate(doc_names)}
+    with open(os.path.join(tmp, "docs.json"), "w", encoding="utf-8") as fh:
+        json.dump(doc_names, fh, ensure_ascii=False)
+    np.save(os.path.join(tmp, "doc_ids.npy"), np.array([doc_index[d["doc"]] for d in docs], dtype=np.int32))
+    np.save(os.path.join(tmp, "pages.npy"), np.array([d["page"] for d in docs], dtype=np.int32))
+    if dedup is not None:
+        sig_ids = np.arange(len(docs), dtype=np.int64)
+    else:
+        sig_ids = _signature_ids([d["text"] for d in docs])
+    np.save(os.path.join(tmp, "sig_ids.npy"), sig_ids)
+
+    encoded = [d["text"].encode("utf-8") for d in docs]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(tmp, "text_offsets.npy"), offsets)
+    with open(os.path.join(tmp, "texts.bin"), "wb") as fh:
+        fh.write(b"".join(encoded))
+
+    if storage_mode != "float32":
+        quant = quantize(embeddings, storage_mode)
+        np.save(os.path.join(tmp, "compact.npy"), quant.data)
+        if quant.scales is not None:
+            np.save(os.path.join(tmp, "scales.npy"), quant.scales)
+
+    BM25Index.build([d["text"] for d in docs]).save(tmp)
+
+    has_ann = build_ann and embeddings.shape[0] >= ANN_MIN_ROWS
+    if has_ann:
+        build_ivf(embeddings).save(os.path.join(tmp, "ivf.npz"))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "model": model_name,
+        "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        "rows": int(embeddings.shape[0]),
+        "storage_mode": storage_mode,
+        "ann": "ivf" if has_ann else None,
+        "lexical": "bm25",
+        "dedup": dedup,
+        "checksum": _sha256(os.path.join(tmp, "embeddings.npy")),
+        "created_at": int(time.time()),
+    }
+    with open(os.path.join(tmp, MANIFEST_NAME), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2)
+
+    os.rename(tmp, os.path.join(directory, name))
+    _publish(directory, name)
+    return manifest
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(resolve(directory), MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def verify_checksum(directory: str, manifest: Dict[str, Any]) -> bool:
+    return _sha256(os.path.join(resolve(directory), "embeddings.npy")) == manifest.get("checksum")
+
+
+def _open(directory: str, name: str):
+    return np.load(os.path.join(directory, name), mmap_mode="r")
+
+
+def load_index(directory: str, verify: bool = False) -> LoadedIndex:
+    directory = resolve(directory)  # una sola lectura de CURRENT: todo sale de la misma versión
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"Sin {MANIFEST_NAME} en {directory}")
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Formato de índice no soportado: {manifest.get('format')}")
+    if verify and not verify_checksum(directory, manifest):
+        raise ValueError("Checksum de embeddings.npy no coincide con el manifiesto")
+
+    matrix = _open(directory, "embeddings.npy")
+    if matrix.shape[0] != manifest["rows"] or (matrix.shape[0] and matrix.shape[1] != manifest["dim"]):
+        raise ValueError(f"embeddings.npy con forma {matrix.shape} no coincide con el manifiesto")
+
+    with open(os.path.join(directory, "docs.json"), encoding="utf-8") as fh:
+        doc_names = json.load(fh)
+    blob_path = os.path.join(directory, "texts.bin")
+    if os.path.getsize(blob_path):
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+    else:
+        blob = np.zeros(0, dtype=np.uint8)
+    chunks = ChunkStore(
+        doc_names,
+        _open(directory, "doc_ids.npy"),
+        _open(directory, "pages.npy"),
+        _open(directory, "text_offsets.npy"),
+        blob,
+    )
+
+    quant = None
+    mode = manifest.get("storage_mode", "float32")
+    if mode != "float32":
+        from quantization import QuantizedMatrix
+        scales_path = os.path.join(directory, "scales.npy")
+        quant = QuantizedMatrix(
+            mode=mode,
+            data=_open(directory, "compact.npy"),
+            scales=np.load(scales_path) if os.path.exists(scales_path) else None,
+        )
+
+    ann = None
+    if manifest.get("ann") == "ivf":
+        from ann import IVFIndex
+        ann = IVFIndex.load(os.path.join(directory, "ivf.npz"))
+
+    lexical = None
+    if manifest.get("lexical") == "bm25":
+        from lexical import BM25Index
+        lexical = BM25Index.load(directory)
+
+    from filters import FilterIndex
+    return LoadedIndex(
+        manifest=manifest,
+        matrix=matrix,
+        chunks=chunks,
+        sig_ids=_open(directory, "sig_ids.npy"),
+        quant=quant,
+        ann=ann,
+        lexical=lexical,
+        filters=FilterIndex(doc_names, chunks.doc_ids, chunks.pages),
+    )
@@ -1,11 +1,17 @@
 """Ingest utilities para procesar PDFs y generar embeddings.
 
-Proporciona funciones para: leer PDFs, chunkear y generar embeddings,
-guardando un cache en `EMBED_CACHE_PATH`.
+Proporciona funciones para: leer PDFs, chunkear, generar embeddings y
+escribir el índice en directorio (``RAG_INDEX_DIR``). La ingesta es
+incremental: sólo se re-extraen los PDFs nuevos o modificados (sha1 del
+archivo) y cada chunk reutiliza su vector si ya está en el store.
+
+Uso: ``python ingest.py --dir docs`` (ver ``--help``).
 """
 from __future__ import annotations
+import argparse
+import hashlib
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Sequence
 from pathlib import Path
 
 try:
@@ -18,12 +24,18 @@ try:
 except ImportError:  # pragma: no cover
     PdfReader = None  # type: ignore
 
-from retrieval import embed_texts, EMBED_CACHE_PATH, ChunkMeta
+from retrieval import embed_texts, DEFAULT_MODEL, DEFAULT_COLLECTION, INDEX_DIR, collection_dir
+from dedup import INGEST_DEDUP, SIMHASH_DISTANCE, near_duplicate_clusters
+from quantization import STORAGE_MODE
+from index_store import read_manifest, write_index
+from chunk_store import EmbeddingStore, open_store
+
+MIN_CHUNK_CHARS = 50  # Filtrar chunks muy cortos
 
 
 def chunk_text(text: str, max_len: int = 500, overlap: int = 100):
     """Divide texto en chunks con overlap.
-    
+
     Optimizado para mejor precisión:
     - max_len=500: Chunks más pequeños = mayor precisión semántica
     - overlap=100: Mantiene contexto entre chunks
@@ -46,92 +58,224 @@ def chunk_text(text: str, max_len: int = 500, overlap: int = 100):
     return chunks
 
 
-def ingest_documents(docs: List[Dict[str, Any]]):  # pragma: no cover
+def _index_dir(collection: Optional[str]) -> str:
+    if not collection or collection == DEFAULT_COLLECTION:
+        return INDEX_DIR
+    return collection_dir(collection)
+
+
+def ingest_documents(docs: List[Dict[str, Any]], fingerprints: Optional[Dict[str, str]] = None,
+                     collection: Optional[str] = None):  # pragma: no cover
     """Ingesta documentos y genera embeddings.
-    
+
     Args:
         docs: Lista de {'doc': nombre, 'page': página, 'text': contenido}
-        
+
     Returns:
-        Número de documentos procesados
+        Número de chunks en el índice
+
+    Reemplaza el catálogo completo; los chunks ya vistos reutilizan su vector.
+    """
+    store = open_store(DEFAULT_MODEL, collection=collection)
+    store.documents = {}
+    return update_documents(docs, fingerprints=fingerprints, store=store, collection=collection)
+
+
+def update_documents(docs: List[Dict[str, Any]], fingerprints: Optional[Dict[str, str]] = None,
+                     remove: Sequence[str] = (), store: Optional[EmbeddingStore] = None,
+                     collection: Optional[str] = None):  # pragma: no cover
+    """Agrega o reemplaza los documentos de ``docs`` (y quita ``remove``) y reescribe el índice.
+
+    ``fingerprints`` (doc -> sha1 del PDF) se guarda en el catálogo para saltar
+    PDFs sin cambios en la próxima ingesta; un documento presente en
+    ``fingerprints`` sin chunks queda registrado vacío. ``collection`` escribe
+    en ``RAG_COLLECTIONS_DIR/<nombre>`` en vez del índice por defecto.
     """
+    store = store or open_store(DEFAULT_MODEL, collection=collection)
+    fingerprints = fingerprints or {}
+    grouped: Dict[str, List[Dict[str, Any]]] = {name: [] for name in fingerprints}
+    for d in docs:
+        grouped.setdefault(d['doc'], []).append({"page": d['page'], "text": d['text']})
+    for name, chunks in grouped.items():
+        store.documents[name] = {"fingerprint": fingerprints.get(name), "chunks": chunks}
+    for name in remove:
+        store.documents.pop(name, None)
+    return _build_index(store, _index_dir(collection))
+
+
+def remove_documents(names: Sequence[str], collection: Optional[str] = None):  # pragma: no cover
+    return update_documents([], remove=[_doc_name(n) for n in names], collection=collection)
+
+
+def compact_index(collection: Optional[str] = None):  # pragma: no cover
+    """Reescribe el índice desde el catálogo y descarta del store los vectores sin uso."""
+    store = open_store(DEFAULT_MODEL, collection=collection)
+    pruned = store.prune()
+    return _build_index(store, _index_dir(collection)), pruned
+
+
+def _build_index(store: EmbeddingStore, index_dir: str = INDEX_DIR):  # pragma: no cover
     if np is None:
         raise RuntimeError("numpy no disponible para ingest")
-    
+    docs = [
+        {"doc": name, "page": chunk["page"], "text": chunk["text"]}
+        for name in sorted(store.documents)
+        for chunk in store.documents[name]["chunks"]
+    ]
+    if not docs:
+        raise RuntimeError("el catálogo no tiene chunks para indexar")
+    dedup = None
+    if INGEST_DEDUP:
+        # Se descartan antes de generar embeddings: menos encode y un índice más chico.
+        clusters = near_duplicate_clusters([d['text'] for d in docs])
+        keep = np.flatnonzero(clusters == np.arange(len(docs)))
+        dedup = {"method": "simhash", "max_distance": SIMHASH_DISTANCE, "dropped": len(docs) - len(keep)}
+        print(f"[Ingest] 🧹 {dedup['dropped']} chunks duplicados o casi duplicados descartados")
+        docs = [docs[i] for i in keep]
     print(f"[Ingest] 📊 Generando embeddings para {len(docs)} chunks...")
-    embeddings = embed_texts([d['text'] for d in docs])
-    
+    # Generar embeddings (sólo de los chunks que no están en el store)
+    embeddings = store.embed([d['text'] for d in docs], embed_texts)
     if embeddings is None:
         raise RuntimeError("Error generando embeddings")
-    
-    meta_serializable = []
-    for idx, d in enumerate(docs):
-        meta_serializable.append({
-            'doc': d['doc'],
-            'page': d['page'],
-            'text': d['text'],
-            'vector_index': idx,
-        })
-    
-    os.makedirs(os.path.dirname(EMBED_CACHE_PATH), exist_ok=True)
-    np.savez_compressed(EMBED_CACHE_PATH, embeddings=embeddings, meta=meta_serializable)
-    print(f"[Ingest] ✅ Cache guardado en {EMBED_CACHE_PATH}")
+    print(f"[Ingest] ♻️ Embeddings reutilizados: {store.last_stats['reused']}, nuevos: {store.last_stats['embedded']}")
+    store.save()
+    os.makedirs(os.path.dirname(index_dir.rstrip('/')) or '.', exist_ok=True)
+    write_index(index_dir, embeddings, docs, DEFAULT_MODEL, storage_mode=STORAGE_MODE, dedup=dedup)
+    print(f"[Ingest] ✅ Índice guardado en {index_dir}")
     return len(docs)
 
 
-def ingest_pdfs(docs_dir: str, cache_path: str = None):  # pragma: no cover
-    """Procesa todos los PDFs de un directorio y genera embeddings.
-    
+def document_fingerprints(collection: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """doc -> sha1 del PDF registrado en el catálogo (vacío si nunca hubo ingesta incremental)."""
+    store = open_store(DEFAULT_MODEL, collection=collection)
+    return {name: entry.get("fingerprint") for name, entry in store.documents.items()}
+
+
+def _doc_name(name: str) -> str:
+    """Nombre de documento en el índice: el del PDF sin extensión."""
+    return name[:-4] if name.lower().endswith(".pdf") else name
+
+
+def _fingerprint(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pdf_chunks(pdf_path: Path) -> List[Dict[str, Any]]:  # pragma: no cover (IO)
+    reader = PdfReader(str(pdf_path))
+    chunks = []
+    for page_num, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if not text.strip():
+            continue
+        for chunk in chunk_text(text):
+            if len(chunk.strip()) < MIN_CHUNK_CHARS:
+                continue
+            chunks.append({
+                'doc': pdf_path.stem,  # Nombre sin extensión
+                'page': page_num,
+                'text': chunk.strip()
+            })
+    print(f"[Ingest]   ✓ {len(chunks)} chunks de {len(reader.pages)} páginas")
+    return chunks
+
+
+def ingest_pdfs(docs_dir: str, collection: Optional[str] = None, full: bool = False,
+                limit: Optional[int] = None) -> int:  # pragma: no cover
+    """Procesa los PDFs de un directorio y actualiza el índice.
+
     Args:
         docs_dir: Directorio con archivos PDF
-        cache_path: Ruta del archivo de cache (opcional)
+        collection: Colección destino (por defecto el índice de RAG_INDEX_DIR)
+        full: Re-extrae todos los PDFs y reemplaza el catálogo
+        limit: Procesa sólo los primeros N PDFs (no quita documentos)
+
+    Returns:
+        Número de chunks en el índice (sin cambios si los PDFs no cambiaron)
     """
     if PdfReader is None:
         raise RuntimeError("pypdf no instalado")
-    
-    if cache_path:
-        global EMBED_CACHE_PATH
-        EMBED_CACHE_PATH = cache_path
-    
+
     docs_path = Path(docs_dir)
     if not docs_path.exists():
         raise FileNotFoundError(f"Directorio no encontrado: {docs_dir}")
-    
-    pdf_files = list(docs_path.glob("*.pdf"))
+
+    pdf_files = sorted(docs_path.glob("*.pdf"))
     if not pdf_files:
         raise FileNotFoundError(f"No se encontraron archivos PDF en {docs_dir}")
-    
+    if limit:
+        pdf_files = pdf_files[:limit]
+
     print(f"[Ingest] 📚 Encontrados {len(pdf_files)} archivos PDF")
-    
-    all_chunks = []
-    for pdf_path in sorted(pdf_files):
+
+    known = {} if full else document_fingerprints(collection)
+    fingerprints = {p.stem: _fingerprint(p) for p in pdf_files}
+    changed = [p for p in pdf_files if known.get(p.stem) != fingerprints[p.stem]]
+    # Con limit no se sabe si faltan PDFs a propósito: no se quita nada.
+    removed = [] if limit else [name for name in known if name not in fingerprints]
+    manifest = read_manifest(_index_dir(collection))
+    if known and not changed and not removed and manifest is not None:
+        print("[Ingest] ✅ Sin cambios en los PDFs; índice al día")
+        return int(manifest["rows"])
+
+    all_chunks: List[Dict[str, Any]] = []
+    processed: Dict[str, str] = {}
+    for pdf_path in changed:
         try:
             print(f"[Ingest] 📄 Procesando {pdf_path.name}...")
-            reader = PdfReader(str(pdf_path))
-            
-            for page_num, page in enumerate(reader.pages, start=1):
-                text = page.extract_text() or ""
-                if not text.strip():
-                    continue
-                
-                chunks = chunk_text(text)
-                for chunk in chunks:
-                    if len(chunk.strip()) < 50:  # Filtrar chunks muy cortos
-                        continue
-                    all_chunks.append({
-                        'doc': pdf_path.stem,  # Nombre sin extensión
-                        'page': page_num,
-                        'text': chunk.strip()
-                    })
-            
-            print(f"[Ingest]   ✓ {len([c for c in all_chunks if c['doc'] == pdf_path.stem])} chunks de {len(reader.pages)} páginas")
-        
+            all_chunks += _pdf_chunks(pdf_path)
+            processed[pdf_path.stem] = fingerprints[pdf_path.stem]
         except Exception as e:
             print(f"[Ingest]   ✗ Error procesando {pdf_path.name}: {e}")
             continue
-    
-    if not all_chunks:
+
+    if not all_chunks and not known:
         raise RuntimeError("No se generaron chunks válidos de los PDFs")
-    
-    print(f"[Ingest] 📊 Total de chunks generados: {len(all_chunks)}")
-    return ingest_documents(all_chunks)
+
+    print(f"[Ingest] 📊 {len(processed)} PDFs actualizados ({len(all_chunks)} chunks), {len(removed)} quitados")
+    if full:
+        return ingest_documents(all_chunks, fingerprints=processed, collection=collection)
+    return update_documents(all_chunks, fingerprints=processed, remove=removed, collection=collection)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:  # pragma: no cover (IO test manual)
+    parser = argparse.ArgumentParser(
+        description="Ingesta PDFs para el índice RAG. Por defecto es incremental: sólo se re-extraen "
+                    "los PDFs nuevos o modificados y los chunks sin cambios reutilizan su vector."
+    )
+    parser.add_argument("--dir", dest="directory", default=os.environ.get("RAG_PDFS_DIR", "docs"),
+                        help="Directorio que contiene los PDFs a ingestar")
+    parser.add_argument("--limit", type=int, default=None, help="Limitar número de PDFs (para pruebas)")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-extrae todos los PDFs y reemplaza el catálogo (los vectores se siguen reutilizando)")
+    parser.add_argument("--remove", nargs="+", default=None, metavar="PDF",
+                        help="Quita documentos del índice por nombre (p. ej. Capitulo3.pdf)")
+    parser.add_argument("--collection", default=None,
+                        help="Colección destino (RAG_COLLECTIONS_DIR/<nombre>); por defecto el índice de RAG_INDEX_DIR")
+    parser.add_argument("--compact", action="store_true",
+                        help="Reescribe el índice y elimina del store los vectores que ya no usa ningún documento")
+    options = parser.parse_args(argv)
+
+    collection = None if options.collection in (None, "", DEFAULT_COLLECTION) else options.collection
+    try:
+        _index_dir(collection)
+        if options.remove:
+            count = remove_documents(options.remove, collection=collection)
+            print(f"[Ingest] ✅ Documentos quitados. Chunks en el índice: {count}")
+        elif options.compact:
+            count, pruned = compact_index(collection=collection)
+            print(f"[Ingest] ✅ Índice compactado. Chunks: {count}, vectores descartados: {pruned}")
+        else:
+            count = ingest_pdfs(options.directory, collection=collection, full=options.full, limit=options.limit)
+            print(f"[Ingest] ✅ Ingesta completada: {count} chunks")
+    except Exception as e:
+        print(f"[Ingest] ❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
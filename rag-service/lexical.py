@@ -0,0 +1,148 @@
+"""Índice léxico BM25 (listas invertidas en NumPy) y fusión RRF.
+
+Complementa la búsqueda densa en términos exactos ("IAGen", "Bloom",
+"Capítulo 4") donde el modelo de embeddings falla con vocabulario en
+español. Los tokens se normalizan sin tildes y sin stopwords.
+"""
+from __future__ import annotations
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+BM25_K1 = float(os.environ.get("RAG_BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("RAG_BM25_B", "0.75"))
+RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Stopwords en español, ya sin tildes (se comparan tras fold_accents).
+SPANISH_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde donde
+durante e el ella ellas ellos en entre era eran es esa esas ese eso esos esta estan estas este
+esto estos fue fueron ha han hasta hay la las le les lo los mas me mi mis mucho muy nada ni no
+nos o otra otras otro otros para pero poco por porque que quien se ser si sin sobre son su sus
+tambien tan tanto te tiene tienen todo todos tu tus un una unas uno unos y ya yo
+""".split())
+
+
+def fold_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = _TOKEN_RE.findall(fold_accents(text).lower())
+    return [t for t in tokens if t not in SPANISH_STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+class BM25Index:
+    """Listas invertidas en formato CSR: ``offsets[t]:offsets[t+1]`` indexa ``rows``/``tf``."""
+
+    def __init__(self, vocab: Dict[str, int], offsets, rows, tf, doc_len):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doc_len = doc_len
+        self.n_rows = int(doc_len.shape[0])
+        self.avgdl = float(doc_len.mean()) if self.n_rows else 0.0
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        post_rows: List[int] = []
+        post_tf: List[int] = []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                post_rows.append(row)
+                post_tf.append(count)
+        terms = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+        return cls(
+            vocab,
+            offsets,
+            np.array(post_rows, dtype=np.int32)[order],
+            np.array(post_tf, dtype=np.float32)[order],
+            doc_len,
+        )
+
+    def save(self, directory: str) -> None:
+        with open(os.path.join(directory, "lex_vocab.json"), "w", encoding="utf-8") as fh:
+            json.dump(self.vocab, fh, ensure_ascii=False)
+        np.save(os.path.join(directory, "lex_offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "lex_rows.npy"), self.rows)
+        np.save(os.path.join(directory, "lex_tf.npy"), self.tf)
+        np.save(os.path.join(directory, "lex_doclen.npy"), self.doc_len)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        with open(os.path.join(directory, "lex_vocab.json"), encoding="utf-8") as fh:
+            vocab = json.load(fh)
+        return cls(
+            vocab,
+            np.load(os.path.join(directory, "lex_offsets.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "lex_rows.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "lex_tf.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "lex_doclen.npy")),
+        )
+
+    def scores(self, query: str):
+        """Score BM25 de ``query`` para todas las filas (0 donde no hay términos en común)."""
+        acc = np.zeros(self.n_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            start, end = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            rows = self.rows[start:end]
+            tf = self.tf[start:end]
+            df = end - start
+            idf = math.log(1.0 + (self.n_rows - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_len[rows] / max(self.avgdl, 1e-9))
+            acc[rows] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        return acc
+
+    def top(self, query: str, k: int, rows=None) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Filas con score > 0 ordenadas de mayor a menor (máximo ``k``) y sus scores.
+
+        ``rows`` restringe el resultado a un subconjunto de filas (filtros).
+        """
+        acc = self.scores(query)
+        if rows is None:
+            cand = np.flatnonzero(acc > 0)
+        else:
+            cand = rows[acc[rows] > 0]
+        if cand.size > k:
+            cand = cand[np.argpartition(-acc[cand], k - 1)[:k]]
+        cand = cand[np.argsort(-acc[cand], kind="stable")]
+        return cand, acc[cand]
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Reciprocal Rank Fusion: ``sum(1 / (k + rank))`` sobre cada ranking de filas."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    if not fused:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    rows = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
@@ -0,0 +1,79 @@
+"""Executor acotado para inferencia (encode + scoring) fuera de los threads de request.
+
+Los endpoints sólo encolan trabajo y esperan con timeout; si la
+cola está llena se rechaza al instante (429) en vez de acumular latencia.
+"""
+from __future__ import annotations
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+INFER_CONCURRENCY = int(os.environ.get("RAG_INFER_CONCURRENCY", "2"))
+INFER_QUEUE = int(os.environ.get("RAG_INFER_QUEUE", "16"))
+INFER_TIMEOUT = float(os.environ.get("RAG_INFER_TIMEOUT", "30"))  # segundos
+
+_EXECUTOR: Optional["BoundedExecutor"] = None
+_EXECUTOR_PID: Optional[int] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+class QueueFull(Exception):
+    """No hay cupo en el executor (trabajos en curso + en cola)."""
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rag-infer")
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull()
+        with self._lock:
+            self._pending += 1
+        fut = self._pool.submit(fn, *args, **kwargs)
+        fut.add_done_callback(self._release)
+        return fut
+
+    def _release(self, _fut: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": min(self._pending, self.max_workers),
+                "queued": max(0, self._pending - self.max_workers),
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+
+def get_executor() -> BoundedExecutor:
+    """Executor del proceso actual (se recrea tras el fork de cada worker de uvicorn)."""
+    global _EXECUTOR, _EXECUTOR_PID
+    if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+                _EXECUTOR = BoundedExecutor(INFER_CONCURRENCY, INFER_QUEUE)
+                _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+def executor_stats() -> Optional[Dict[str, Any]]:
+    if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+        return None
+    return _EXECUTOR.stats()
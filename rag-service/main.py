@@ -2,16 +2,29 @@
 RAG Service - Servicio de embeddings y búsqueda vectorial
 FastAPI app optimizada para GPU (NVIDIA L4)
 """
+import asyncio
+import hmac
 import os
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 
+import metrics
 import retrieval  # Nuestro módulo de embeddings
+import wire
+from filters import SearchFilters
+from limiter import INFER_TIMEOUT, QueueFull, executor_stats, get_executor
+from rerank import rerank_stats
+
+RAG_BATCH_MAX_QUERIES = int(os.environ.get("RAG_BATCH_MAX_QUERIES", "64"))
+RAG_ADMIN_TOKEN = os.environ.get("RAG_ADMIN_TOKEN", "")
 
 # Configuración de logging
 logging.basicConfig(
@@ -23,13 +36,18 @@ logger = logging.getLogger(__name__)
 # Lifespan para cargar modelo al inicio
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Carga el modelo de embeddings al iniciar el servicio."""
+    """Carga índice y modelo y hace un warm-up antes de aceptar requests.
+    
+    Corre en cada worker de uvicorn; el índice (mmap) se comparte entre
+    workers por el page cache, así que no hay carga previa al fork.
+    """
     logger.info("🚀 Iniciando RAG Service...")
     
     # Pre-cargar modelo y embeddings
     try:
-        retrieval.ensure_ready()
-        logger.info("✅ Modelo y embeddings cargados correctamente")
+        timings = await asyncio.to_thread(retrieval.warm_up)
+        detail = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items())
+        logger.info(f"✅ Modelo y embeddings cargados correctamente ({detail})")
     except Exception as e:
         logger.error(f"❌ Error cargando modelo: {e}")
     
@@ -45,6 +63,12 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Histogramas por endpoint y etapa + header Server-Timing (ver /metrics)
+app.add_middleware(
+    metrics.TimingMiddleware,
+    endpoints={"/search": "search", "/search/batch": "search_batch", "/embed": "embed"},
+)
+
 # CORS para permitir llamadas desde Backend Django
 app.add_middleware(
     CORSMiddleware,
@@ -54,25 +78,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+VALIDATION_400_PATHS = ("/search", "/search/batch")
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    """Payload inválido en /search y /search/batch: 400 con el detalle de pydantic.
+
+    Así un ``top_k`` o ``nprobe`` fuera de rango responde igual que las
+    opciones que rechaza ``SearchOptions``; el resto de endpoints mantiene
+    el 422 de FastAPI.
+    """
+    if request.url.path not in VALIDATION_400_PATHS:
+        return await request_validation_exception_handler(request, exc)
+    errors = [
+        {"loc": list(e.get("loc", ())), "msg": e.get("msg"), "type": e.get("type")}
+        for e in exc.errors()
+    ]
+    return JSONResponse(status_code=400, content={"detail": errors})
+
 # ============= MODELOS PYDANTIC =============
 
-class SearchRequest(BaseModel):
-    query: str = Field(..., min_length=1, max_length=2000, description="Consulta del usuario")
+class SearchOptionsMixin(BaseModel):
     top_k: Optional[int] = Field(5, ge=1, le=20, description="Número de resultados a retornar")
+    nprobe: Optional[int] = Field(None, ge=1, le=retrieval.MAX_NPROBE, description="Listas IVF sondeadas (índice ANN)")
+    exact: bool = Field(False, description="Fuerza búsqueda exacta sobre toda la matriz")
+    mode: Optional[str] = Field(None, description="dense, hybrid (denso + BM25 con RRF) o lexical")
+    rerank: bool = Field(False, description="Reordena los candidatos con un cross-encoder")
+    rerank_budget_ms: Optional[float] = Field(None, ge=0, le=retrieval.MAX_RERANK_BUDGET_MS,
+                                              description="Presupuesto de latencia del re-ranking")
+    filters: Optional[Dict[str, Any]] = Field(None, description="docs, pages y/o chapters")
+    mmr_lambda: Optional[float] = Field(None, description="Diversificación MMR (1 = sólo relevancia)")
+    collection: Optional[str] = Field(None, description="Colección (por defecto el índice principal)")
+
+class SearchRequest(SearchOptionsMixin):
+    query: str = Field(..., min_length=1, max_length=2000, description="Consulta del usuario")
+
+class SearchBatchRequest(SearchOptionsMixin):
+    queries: List[str] = Field(..., min_length=1, max_length=RAG_BATCH_MAX_QUERIES, description="Consultas")
 
 class SearchResult(BaseModel):
     doc: str = Field(..., description="Nombre del documento")
     page: int = Field(..., description="Número de página")
     text: str = Field(..., description="Fragmento de texto relevante")
     score: float = Field(..., ge=0, le=1, description="Score de similitud")
+    rrf: Optional[float] = Field(None, description="Score fusionado (modo hybrid)")
+    bm25: Optional[float] = Field(None, description="Score BM25 crudo (modo lexical)")
+    rerank_score: Optional[float] = Field(None, description="Score del cross-encoder (con rerank)")
 
 class SearchResponse(BaseModel):
     results: List[SearchResult] = Field(default_factory=list)
     total: int = Field(..., description="Número total de resultados")
     query: str = Field(..., description="Query original")
 
+class SearchBatchResponse(BaseModel):
+    results: List[SearchResponse] = Field(default_factory=list)
+
+class ReloadRequest(BaseModel):
+    collection: Optional[str] = Field(None, description="Colección a descartar (por defecto el índice principal)")
+
 class EmbedRequest(BaseModel):
-    texts: List[str] = Field(..., min_items=1, max_items=100, description="Textos a embedear")
+    texts: List[str] = Field(..., min_length=1, max_length=100, description="Textos a embedear")
 
 class EmbedResponse(BaseModel):
     embeddings: List[List[float]] = Field(..., description="Vectores de embeddings")
@@ -85,6 +150,92 @@ class HealthResponse(BaseModel):
     model_loaded: bool
     embeddings_loaded: bool
     model_name: str
+    embedder: Dict[str, Any] = Field(default_factory=dict)
+    index: Dict[str, Any] = Field(default_factory=dict)
+    cache: Dict[str, Any] = Field(default_factory=dict)
+    executor: Optional[Dict[str, Any]] = None
+    rerank: Dict[str, Any] = Field(default_factory=dict)
+    collections: Dict[str, Any] = Field(default_factory=dict)
+
+# ============= INFERENCIA =============
+
+def _search_params(request: SearchOptionsMixin) -> Dict[str, Any]:
+    """Opciones de ``retrieval.search``.
+
+    ``mode``, ``mmr_lambda`` y ``collection`` los valida ``SearchOptions``:
+    su ``ValueError`` llega como 400 desde ``_await_inference``.
+    """
+    try:
+        # Se normaliza aquí para que los filtros lleguen ya validados (y hashables) a retrieval.
+        filters = SearchFilters.from_dict(request.filters)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"filters inválido: {e}")
+    return {
+        "top_k": request.top_k,
+        "nprobe": request.nprobe,
+        "exact": request.exact,
+        "mode": request.mode,
+        "rerank": request.rerank,
+        "rerank_budget_ms": request.rerank_budget_ms,
+        "filters": filters,
+        "mmr_lambda": request.mmr_lambda,
+        "collection": request.collection,
+    }
+
+
+async def _run_inference(fn, *args, **kwargs):
+    """Ejecuta ``fn`` en el executor acotado de inferencia sin bloquear el event loop.
+
+    Responde 429 si la cola está llena, 503 si se supera ``RAG_INFER_TIMEOUT``
+    y 404 si la colección pedida no existe.
+    """
+    return await _await_inference(lambda: get_executor().submit(metrics.run_in_context(fn), *args, **kwargs))
+
+
+async def _await_inference(submit):
+    """Encola con ``submit()`` (que devuelve un ``Future``) y espera el resultado con timeout."""
+    try:
+        fut = submit()
+    except QueueFull:
+        raise HTTPException(status_code=429, detail="RAG saturado, reintenta en unos segundos",
+                            headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Espera total (cola + inferencia): con micro-batching las etapas corren en el thread del lote,
+        # fuera del desglose de esta request.
+        with metrics.stage("inference"):
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=INFER_TIMEOUT)
+    except asyncio.TimeoutError:
+        fut.cancel()
+        raise HTTPException(status_code=503, detail="RAG timeout")
+    except retrieval.UnknownCollection as e:
+        raise HTTPException(status_code=404, detail=f"Colección desconocida: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _search(query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Una búsqueda: directo al micro-batcher si está activo, si no por el executor.
+
+    Con micro-batching la request espera su lote sin ocupar un thread del
+    executor; si pasara por él, el lote nunca superaría ``RAG_INFER_CONCURRENCY``.
+    """
+    def submit():
+        fut = retrieval.submit_search(query, **params)
+        if fut is not None:
+            return fut
+        return get_executor().submit(metrics.run_in_context(retrieval.search), query, **params)
+    return await _await_inference(submit)
+
+
+def _search_response(query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cuerpo de ``SearchResponse`` con los dicts del motor tal cual.
+
+    Sin un ``SearchResult`` por hit: ``wire`` serializa los dicts directo y
+    los modelos pydantic sólo describen el esquema de OpenAPI.
+    """
+    return {"results": results, "total": len(results), "query": query}
 
 # ============= ENDPOINTS =============
 
@@ -98,7 +249,10 @@ async def root():
         "endpoints": {
             "health": "/health",
             "search": "/search",
-            "embed": "/embed"
+            "search_batch": "/search/batch",
+            "embed": "/embed",
+            "reload": "/index/reload",
+            "metrics": "/metrics"
         }
     }
 
@@ -113,65 +267,135 @@ async def health_check():
         gpu_available = False
         gpu_name = "N/A"
     
-    # Verificar si el modelo está cargado
-    model_loaded = retrieval._EMBED_MODEL is not None
-    embeddings_loaded = retrieval._MATRIX is not None
+    # Verificar si el modelo está cargado (no carga nada, sólo reporta)
+    embedder = retrieval.embedder_status()
+    model_loaded = embedder["loaded"]
+    index = retrieval.index_status()
     
     return HealthResponse(
         status="healthy" if model_loaded else "degraded",
         gpu_available=gpu_available,
         model_loaded=model_loaded,
-        embeddings_loaded=embeddings_loaded,
-        model_name=retrieval.DEFAULT_MODEL
+        embeddings_loaded=index["loaded"],
+        model_name=embedder["name"],
+        embedder=embedder,
+        index=index,
+        cache=retrieval.cache_stats(),
+        executor=executor_stats(),
+        rerank=rerank_stats(),
+        collections=retrieval.collections_status(),
     )
 
+def _metric_samples():
+    """Gauges y counters de ``/metrics`` a partir de los mismos stats que ``/health``."""
+    gauges: List[metrics.Sample] = []
+    counters: List[metrics.Sample] = []
+    index = retrieval.index_status()
+    gauges += [
+        ("rag_index_rows", "Chunks en el índice activo.", index["rows"], None),
+        ("rag_index_bytes", "Memoria de vectores del índice activo.", index.get("bytes", 0), None),
+        ("rag_index_load_seconds", "Duración de la última carga del índice.", index.get("load_ms", 0) / 1000, None),
+        ("rag_index_loaded_timestamp_seconds", "Momento de la última carga del índice.", index.get("loaded_at", 0), None),
+    ]
+    collections = retrieval.collections_status()
+    gauges.append(("rag_collections_loaded", "Colecciones cargadas en memoria.", len(collections["loaded"]), None))
+    gauges += [("rag_collection_bytes", "Memoria de vectores por colección cargada.", c["bytes"],
+                {"collection": c["name"]}) for c in collections["loaded"]]
+    executor = executor_stats()
+    if executor is not None:
+        gauges += [
+            ("rag_inference_in_flight", "Trabajos de inferencia en ejecución.", executor["in_flight"], None),
+            ("rag_inference_queue_depth", "Trabajos de inferencia en cola.", executor["queued"], None),
+        ]
+        counters += [
+            ("rag_inference_rejected_total", "Trabajos rechazados por cola llena (429).", executor["rejected"], None),
+            ("rag_inference_completed_total", "Trabajos de inferencia terminados.", executor["completed"], None),
+        ]
+    caches = retrieval.cache_stats()
+    microbatch = caches.pop("microbatch", None)
+    if microbatch is not None:
+        gauges.append(("rag_microbatch_queue_depth", "Búsquedas esperando lote.", microbatch["queued"], None))
+    encode_pool = caches.pop("encode_pool", None)
+    if encode_pool is not None:
+        gauges.append(("rag_encode_pool_workers", "Procesos worker de encode.", encode_pool["workers"], None))
+        counters.append(("rag_encode_pool_texts_total", "Textos codificados en el pool.", encode_pool["texts"], None))
+    rerank = rerank_stats()
+    caches["rerank_scores"] = rerank["score_cache"]
+    counters += [("rag_rerank_total", "Re-rankings por resultado.", rerank[key], {"outcome": key})
+                 for key in ("reranked", "skipped_budget", "skipped_loading")]
+    for name, stats in caches.items():
+        labels = {"cache": name}
+        gauges.append(("rag_cache_hit_ratio", "Proporción de hits por cache.", stats["hit_ratio"], labels))
+        gauges.append(("rag_cache_entries", "Entradas por cache.", stats["size"], labels))
+        counters.append(("rag_cache_hits_total", "Hits por cache.", stats["hits"], labels))
+        counters.append(("rag_cache_misses_total", "Misses por cache.", stats["misses"], labels))
+    return gauges, counters
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas del worker en formato de exposición de Prometheus (no carga nada)."""
+    gauges, counters = _metric_samples()
+    return Response(metrics.render(gauges, counters), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/search", response_model=SearchResponse)
-async def search_documents(request: SearchRequest):
+async def search_documents(request: SearchRequest, http_request: Request):
     """
     Busca documentos relevantes usando búsqueda vectorial.
     
     Args:
         request: Query y parámetros de búsqueda
+        http_request: Request HTTP (``Accept``/``Accept-Encoding`` eligen formato y compresión)
         
     Returns:
-        Resultados ordenados por relevancia
+        Resultados ordenados por relevancia, en JSON o msgpack (``wire``)
     """
+    params = _search_params(request)
     try:
         logger.info(f"🔍 Búsqueda: '{request.query[:100]}...' (top_k={request.top_k})")
         
         # Realizar búsqueda
-        results = retrieval.search(request.query, top_k=request.top_k)
-        
-        # Convertir a formato de respuesta
-        search_results = [
-            SearchResult(
-                doc=r["doc"],
-                page=r["page"],
-                text=r["text"],
-                score=r["score"]
-            )
-            for r in results
-        ]
+        results = await _search(request.query, params)
         
-        logger.info(f"✅ Encontrados {len(search_results)} resultados")
+        logger.info(f"✅ Encontrados {len(results)} resultados")
         
-        return SearchResponse(
-            results=search_results,
-            total=len(search_results),
-            query=request.query
-        )
+        return wire.respond(http_request, _search_response(request.query, results))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error en búsqueda: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error en búsqueda: {str(e)}")
 
+@app.post("/search/batch", response_model=SearchBatchResponse)
+async def search_documents_batch(request: SearchBatchRequest, http_request: Request):
+    """
+    N queries en una llamada: un solo encode y una GEMM sobre el índice.
+    
+    Returns:
+        Un elemento por query, con la misma forma que la respuesta de /search
+    """
+    queries = [q.strip() for q in request.queries]
+    if not all(queries):
+        raise HTTPException(status_code=400, detail="queries no puede contener textos vacíos")
+    params = _search_params(request)
+    try:
+        logger.info(f"🔍 Búsqueda por lote: {len(queries)} queries (top_k={request.top_k})")
+        batch = await _run_inference(retrieval.search_batch, queries, **params)
+        return wire.respond(http_request, {"results": [_search_response(q, r) for q, r in zip(queries, batch)]})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda por lote: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error en búsqueda: {str(e)}")
+
 @app.post("/embed", response_model=EmbedResponse)
-async def generate_embeddings(request: EmbedRequest):
+async def generate_embeddings(request: EmbedRequest, http_request: Request):
     """
     Genera embeddings para una lista de textos.
     
     Args:
         request: Lista de textos a procesar
+        http_request: Request HTTP; con ``Accept`` se pide JSON, msgpack o float32/float16 crudo
         
     Returns:
         Vectores de embeddings normalizados
@@ -180,27 +404,53 @@ async def generate_embeddings(request: EmbedRequest):
         logger.info(f"📊 Generando embeddings para {len(request.texts)} textos")
         
         # Generar embeddings
-        embeddings = retrieval.embed_texts(request.texts)
+        embeddings = await _run_inference(retrieval.embed_texts, request.texts)
         
         if embeddings is None:
             raise HTTPException(status_code=500, detail="Modelo no disponible")
         
-        # Convertir a lista de Python
-        embeddings_list = embeddings.tolist()
-        dimensions = len(embeddings_list[0]) if embeddings_list else 0
+        logger.info(f"✅ Embeddings generados: {embeddings.shape[0]} x {embeddings.shape[-1]}D")
         
-        logger.info(f"✅ Embeddings generados: {len(embeddings_list)} x {dimensions}D")
-        
-        return EmbedResponse(
-            embeddings=embeddings_list,
-            dimensions=dimensions,
-            model=retrieval.DEFAULT_MODEL
-        )
+        # Sin tolist(): wire serializa el array según el formato pedido
+        return wire.respond_embeddings(http_request, embeddings, retrieval.embedder_status()["name"])
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error generando embeddings: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error generando embeddings: {str(e)}")
 
+@app.post("/index/reload", status_code=202)
+async def reload_index(request: Optional[ReloadRequest] = None,
+                       x_rag_admin_token: str = Header("", alias="X-RAG-Admin-Token")):
+    """
+    Recarga el índice en segundo plano y lo intercambia sin cortar búsquedas.
+    
+    Requiere el header ``X-RAG-Admin-Token`` (``RAG_ADMIN_TOKEN``). Con
+    ``{"collection": "<nombre>"}`` descarta esa colección y la próxima
+    búsqueda carga la versión nueva; ``index.version`` en /health confirma el cambio.
+    Sólo recarga el worker que atiende la petición: el resto detecta la
+    versión nueva en disco en su siguiente búsqueda (``RAG_INDEX_CHECK_SECONDS``),
+    lo que ``propagation`` informa en la respuesta.
+    """
+    if not RAG_ADMIN_TOKEN or not hmac.compare_digest(x_rag_admin_token, RAG_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    collection = request.collection if request is not None else None
+    if collection is not None and not retrieval.is_valid_collection(collection):
+        raise HTTPException(status_code=400, detail="collection sólo admite letras, números, '-' y '_'")
+    started = retrieval.reload_index(collection=collection)
+    logger.info(f"🔄 Recarga del índice solicitada (collection={collection}, iniciada={started})")
+    check_seconds = retrieval.INDEX_CHECK_SECONDS
+    return {
+        "reloading": True,
+        "started": started,
+        "index": retrieval.index_status(),
+        "propagation": {
+            "scope": "all_workers" if check_seconds > 0 else "this_worker",
+            "check_seconds": check_seconds,
+        },
+    }
+
 # ============= MAIN =============
 
 if __name__ == "__main__":
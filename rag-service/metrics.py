@@ -0,0 +1,188 @@
+"""Latencia por etapa en formato de exposición de Prometheus y header ``Server-Timing``.
+
+Cada etapa del retrieval (``encode``, ``score``, ``rank``, ...) se mide con
+``stage(nombre)``: alimenta el histograma ``rag_stage_duration_seconds`` del
+proceso y, si corre dentro de una request medida por ``TimingMiddleware``,
+suma su duración al desglose que vuelve en ``Server-Timing``. El desglose
+viaja en un ``ContextVar``; ``run_in_context`` lo propaga a otros threads.
+
+Las métricas son por proceso: con varios workers de uvicorn cada uno
+expone las suyas.
+"""
+from __future__ import annotations
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Límites superiores (segundos) de los buckets de latencia.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Límites superiores de los buckets de tamaño de lote del micro-batcher.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_TIMINGS: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("rag_timings", default=None)
+
+# (nombre, help, valor, labels) -> una muestra de gauge o counter en ``render``
+Sample = Tuple[str, str, float, Optional[Dict[str, str]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Histograma acumulado con un label (p. ej. ``stage``), seguro entre threads."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[float]] = {}  # valor del label -> [counts por bucket..., +Inf, sum]
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, counts in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _labels({self.label: value, "le": _number(bound)})
+                lines.append(f"{self.name}_bucket{labels} {_number(count)}")
+            lines.append(f"{self.name}_bucket{_labels({self.label: value, 'le': '+Inf'})} {_number(counts[-2])}")
+            lines.append(f"{self.name}_sum{_labels({self.label: value})} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{_labels({self.label: value})} {_number(counts[-2])}")
+        return lines
+
+
+STAGES = Histogram("rag_stage_duration_seconds", "Duración de cada etapa del retrieval.", "stage")
+REQUESTS = Histogram("rag_request_duration_seconds", "Duración total por endpoint.", "endpoint")
+MICROBATCH_SIZE = Histogram("rag_microbatch_batch_size", "Búsquedas por lote del micro-batcher.", "batcher",
+                            buckets=BATCH_SIZE_BUCKETS)
+MICROBATCH_WAIT = Histogram("rag_microbatch_queue_wait_seconds",
+                            "Espera de cada búsqueda en la cola del micro-batcher hasta que arranca su lote.", "batcher")
+
+_lock = threading.Lock()
+_IN_FLIGHT: Dict[str, int] = {}
+_RESPONSES: Dict[Tuple[str, int], int] = {}
+
+
+def record(name: str, seconds: float) -> None:
+    STAGES.observe(name, seconds)
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+def run_in_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve ``fn`` para que corra con el contexto actual (desglose de la request incluido)."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+class TimingMiddleware:
+    """Middleware ASGI: histograma por endpoint, requests en curso y header ``Server-Timing``.
+
+    ``endpoints`` mapea la ruta (``/search``) al label del endpoint; las
+    demás rutas (``/health``, ``/metrics``) pasan sin medir. Corre en la
+    misma task que el endpoint, así el ``ContextVar`` del desglose llega a
+    las etapas medidas con ``stage`` (y a otros threads con ``run_in_context``).
+    """
+
+    def __init__(self, app, endpoints: Dict[str, str]):
+        self.app = app
+        self.endpoints = endpoints
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self.endpoints.get(scope.get("path", "")) if scope["type"] == "http" else None
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+        timings: Dict[str, float] = {}
+        token = _TIMINGS.set(timings)
+        with _lock:
+            _IN_FLIGHT[endpoint] = _IN_FLIGHT.get(endpoint, 0) + 1
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings["total"] = time.perf_counter() - t0
+                header = (b"server-timing", server_timing(timings).encode("latin-1"))
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS.observe(endpoint, time.perf_counter() - t0)
+            with _lock:
+                _IN_FLIGHT[endpoint] -= 1
+                key = (endpoint, status)
+                _RESPONSES[key] = _RESPONSES.get(key, 0) + 1
+            _TIMINGS.reset(token)
+
+
+def _render_samples(samples: Iterable[Sample], kind: str) -> List[str]:
+    lines: List[str] = []
+    seen = set()
+    for name, help_text, value, labels in samples:
+        if name not in seen:
+            seen.add(name)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return lines
+
+
+def render(gauges: Iterable[Sample] = (), counters: Iterable[Sample] = ()) -> str:
+    """Texto de exposición de Prometheus con los histogramas, más ``gauges`` y ``counters``."""
+    with _lock:
+        in_flight = sorted(_IN_FLIGHT.items())
+        responses = sorted(_RESPONSES.items())
+    gauges = [("rag_requests_in_flight", "Requests en curso por endpoint.", n, {"endpoint": e})
+              for e, n in in_flight] + list(gauges)
+    counters = [("rag_responses_total", "Respuestas por endpoint y código HTTP.", n, {"endpoint": e, "code": str(c)})
+                for (e, c), n in responses] + list(counters)
+    lines = STAGES.render() + REQUESTS.render() + MICROBATCH_SIZE.render() + MICROBATCH_WAIT.render()
+    # Agrupadas por nombre: el formato exige que las muestras de una métrica sean contiguas.
+    lines += _render_samples(sorted(gauges, key=lambda s: s[0]), "gauge")
+    lines += _render_samples(sorted(counters, key=lambda s: s[0]), "counter")
+    return "\n".join(lines) + "\n"
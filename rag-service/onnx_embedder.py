@@ -0,0 +1,258 @@
+"""Backend de embeddings con ONNX Runtime para instancias sólo CPU.
+
+El modelo de sentence-transformers se exporta una vez a ONNX (``python
+onnx_embedder.py``, opcionalmente cuantizado a int8 dinámico) y se ejecuta
+con ONNX Runtime. ``OnnxEmbedder.encode`` acepta los mismos argumentos que
+``SentenceTransformer.encode``, así el resto de ``retrieval`` no cambia.
+
+Estructura de ``RAG_ONNX_DIR``::
+
+    model.onnx          grafo exportado (salida: last_hidden_state)
+    model.int8.onnx     variante cuantizada (si se exportó con --quantize)
+    embedder.json       modelo fuente, pooling, max_seq_length y dimensión
+    tokenizer*          archivos del tokenizer de Hugging Face
+"""
+from __future__ import annotations
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+from embedders import onnx_model_name
+from retrieval import EMBED_CACHE_PATH, ONNX_QUANTIZED
+
+ONNX_DIR = os.environ.get("RAG_ONNX_DIR", os.path.join(os.path.dirname(EMBED_CACHE_PATH), "onnx"))
+ONNX_THREADS = int(os.environ.get("RAG_ONNX_THREADS", "0"))  # intra-op; 0 = todos los cores
+ONNX_BATCH = int(os.environ.get("RAG_ONNX_BATCH", "32"))
+POOLING_MODES = ("mean", "cls", "lasttoken")
+
+_CONFIG_FILE = "embedder.json"
+
+
+def pool(hidden, mask, mode: str):
+    """Reduce ``hidden`` (batch x seq x dim) a un vector por texto según ``mode``."""
+    if mode == "cls":
+        return hidden[:, 0]
+    if mode == "lasttoken":
+        if bool(mask[:, -1].all()):  # padding a la izquierda: el último token siempre es real
+            return hidden[:, -1]
+        last = mask.sum(axis=1).astype(np.int64) - 1
+        return hidden[np.arange(hidden.shape[0]), last]
+    weights = mask[:, :, None].astype(hidden.dtype)
+    return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+
+def cosine_agreement(reference, candidate) -> Dict[str, float]:
+    """Coseno fila a fila entre dos matrices de embeddings (p. ej. PyTorch vs ONNX)."""
+    a = np.asarray(reference, dtype=np.float32)
+    b = np.asarray(candidate, dtype=np.float32)
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    cos = (a * b).sum(axis=1)
+    return {"min": float(cos.min()), "mean": float(cos.mean()), "p01": float(np.quantile(cos, 0.01))}
+
+
+class OnnxEmbedder:
+    """Embedder compatible con ``SentenceTransformer.encode`` sobre una sesión de ONNX Runtime."""
+
+    def __init__(self, session, tokenizer, pooling: str = "mean", max_seq_length: int = 512,
+                 name: str = "onnx", dim: Optional[int] = None):
+        if pooling not in POOLING_MODES:
+            raise ValueError(f"pooling debe ser uno de {list(POOLING_MODES)}")
+        self.session = session
+        self.tokenizer = tokenizer
+        self.pooling = pooling
+        self.max_seq_length = max_seq_length
+        self.name = name
+        self._dim = dim
+        self._inputs = [i.name for i in session.get_inputs()]
+
+    @property
+    def dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self.encode("dimension").shape[-1])
+        return self._dim
+
+    def encode(self, sentences, normalize_embeddings: bool = False, batch_size: int = ONNX_BATCH,
+               show_progress_bar: bool = False, **kwargs: Any):
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        # Ordenar por largo reduce el padding dentro de cada batch; luego se restaura el orden.
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        parts = []
+        for start in range(0, len(texts), batch_size):
+            parts.append(self._encode_batch([texts[i] for i in order[start:start + batch_size]]))
+        out = np.empty((len(texts), parts[0].shape[1]), dtype=np.float32)
+        out[order] = np.concatenate(parts)
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+    def _encode_batch(self, texts: Sequence[str]):
+        enc = self.tokenizer(
+            list(texts), padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feeds = {name: np.asarray(enc[name], dtype=np.int64) for name in self._inputs if name in enc}
+        hidden = self.session.run(None, feeds)[0]
+        return np.asarray(pool(hidden, np.asarray(enc["attention_mask"]), self.pooling), dtype=np.float32)
+
+
+def _model_path(directory: str, quantized: bool) -> str:
+    """Grafo a cargar; sin ``model.int8.onnx`` no se cae a float32 (el nombre del embedder lo promete)."""
+    path = os.path.join(directory, "model.int8.onnx" if quantized else "model.onnx")
+    if not os.path.exists(path):
+        hint = " (exporta sin --sin-int8 o usa RAG_ONNX_QUANTIZED=0)" if quantized else ""
+        raise FileNotFoundError(f"no existe {path}{hint}")
+    return path
+
+
+def read_config(directory: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    path = os.path.join(directory or ONNX_DIR, _CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def load_embedder(directory: Optional[str] = None, quantized: bool = ONNX_QUANTIZED,
+                  threads: int = ONNX_THREADS) -> OnnxEmbedder:  # pragma: no cover (IO heavy)
+    import onnxruntime as ort  # type: ignore
+    from transformers import AutoTokenizer  # type: ignore
+
+    directory = directory or ONNX_DIR
+    config = read_config(directory)
+    if config is None:
+        raise FileNotFoundError(f"no hay modelo ONNX exportado en {directory} (ejecuta python onnx_embedder.py)")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    path = _model_path(directory, quantized)
+    session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    tokenizer = AutoTokenizer.from_pretrained(directory)
+    print(f"[RAG] ✅ Modelo ONNX cargado: {config['model']} ({os.path.basename(path)}, pooling {config['pooling']})")
+    return OnnxEmbedder(session, tokenizer, pooling=config["pooling"], max_seq_length=config["max_seq_length"],
+                        name=onnx_model_name(config["model"], quantized), dim=config.get("dim"))
+
+
+def export_model(model_name: str, directory: Optional[str] = None, quantize: bool = True,
+                 opset: int = 17) -> Dict[str, Any]:  # pragma: no cover (IO heavy)
+    """Exporta el transformer de ``model_name`` a ONNX (y su variante int8) en ``directory``."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    directory = directory or ONNX_DIR
+    os.makedirs(directory, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu", trust_remote_code=True)
+    transformer = st[0]
+    pooling = "mean"
+    if len(st) > 1 and hasattr(st[1], "get_pooling_mode_str"):
+        pooling = st[1].get_pooling_mode_str()
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"pooling '{pooling}' no soportado por el backend ONNX")
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.eval()
+    sample = tokenizer(["texto de ejemplo para exportar"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+
+    class _Hidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(names, args))).last_hidden_state
+
+    path = os.path.join(directory, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _Hidden(auto_model), tuple(sample[n] for n in names), path,
+            input_names=names, output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=opset,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+        quantize_dynamic(path, os.path.join(directory, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(directory)
+    config = {
+        "model": model_name,
+        "pooling": pooling,
+        "max_seq_length": int(st.max_seq_length or 512),
+        "dim": int(st.get_sentence_embedding_dimension()),
+        "opset": opset,
+        "quantized": quantize,
+    }
+    with open(os.path.join(directory, _CONFIG_FILE), "w", encoding="utf-8") as fh:
+        json.dump(config, fh, indent=2)
+    return config
+
+
+_MUESTRA = [
+    "¿Cómo introducir fracciones en cuarto básico?",
+    "La taxonomía de Bloom organiza los objetivos de aprendizaje en niveles cognitivos.",
+    "Uso ético de la inteligencia artificial generativa en la evaluación.",
+    "Alfabetización digital docente",
+]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:  # pragma: no cover (IO test manual)
+    """Exporta el modelo a ONNX (float32 + int8) y valida el coseno frente a PyTorch."""
+    import argparse
+    import time
+    from sentence_transformers import SentenceTransformer
+
+    from chunk_store import open_store
+    from retrieval import SENTENCE_MODEL
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--dir", dest="directory", default=None, help="Destino (por defecto RAG_ONNX_DIR)")
+    parser.add_argument("--sin-int8", action="store_true", help="No generar la variante cuantizada int8")
+    parser.add_argument("--solo-validar", action="store_true", help="No exportar; sólo comparar con PyTorch")
+    parser.add_argument("--textos", type=int, default=200, help="Nº de chunks del store usados en la validación")
+    parser.add_argument("--min-coseno", type=float, default=0.99,
+                        help="Coseno mínimo aceptado por texto; por debajo termina con error")
+    options = parser.parse_args(argv)
+
+    directory = options.directory or ONNX_DIR
+    if not options.solo_validar:
+        print(f"Exportando {SENTENCE_MODEL} a {directory}...")
+        config = export_model(SENTENCE_MODEL, directory, quantize=not options.sin_int8)
+        print(f"Exportado (pooling {config['pooling']}, dim {config['dim']})")
+
+    texts = list(open_store(SENTENCE_MODEL).texts())[: options.textos] or _MUESTRA
+    reference_model = SentenceTransformer(SENTENCE_MODEL, device="cpu", trust_remote_code=True)
+    t0 = time.perf_counter()
+    reference = reference_model.encode(texts, normalize_embeddings=True, batch_size=8)
+    torch_ms = (time.perf_counter() - t0) * 1000
+
+    failed = False
+    variants = [("float32", False)] if options.sin_int8 else [("float32", False), ("int8", True)]
+    print(f"{len(texts)} textos | PyTorch: {torch_ms:.0f} ms")
+    print(f"{'variante':>10} {'ms':>8} {'coseno min':>11} {'p01':>8} {'medio':>8}")
+    for label, quantized in variants:
+        embedder = load_embedder(directory, quantized=quantized)
+        t0 = time.perf_counter()
+        candidate = embedder.encode(texts, normalize_embeddings=True)
+        ms = (time.perf_counter() - t0) * 1000
+        report = cosine_agreement(reference, candidate)
+        print(f"{label:>10} {ms:>8.0f} {report['min']:>11.4f} {report['p01']:>8.4f} {report['mean']:>8.4f}")
+        failed |= report["min"] < options.min_coseno
+    if failed:
+        print(f"Coseno por debajo de {options.min_coseno}: no usar en producción")
+        return 1
+    print("Validación OK: RAG_EMBED_BACKEND=onnx es seguro con este modelo")
+    if not options.sin_int8:
+        # int8 firma con otro nombre: usa su propio índice y chunk store.
+        print(f"Con int8 (RAG_ONNX_QUANTIZED=1) reingesta: el índice se firma como {onnx_model_name(SENTENCE_MODEL, True)}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
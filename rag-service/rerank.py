@@ -0,0 +1,130 @@
+"""Re-ranking opcional con cross-encoder, acotado por un presupuesto de latencia.
+
+Se puntúan los top-N candidatos del retrieval (denso o híbrido). Antes de
+cada lote se proyecta su duración con el costo medido por par; si no
+entra en lo que queda del presupuesto (o el modelo aún no está cargado)
+se devuelve el orden original sin bloquear la request.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from cache import TTLCache, normalize_query
+
+RERANK_MODEL = os.environ.get("RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", "30"))
+RERANK_BUDGET_MS = float(os.environ.get("RAG_RERANK_BUDGET_MS", "300"))
+RERANK_BATCH = int(os.environ.get("RAG_RERANK_BATCH", "8"))
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+_MODEL_LOADING = False
+# (query normalizada, hash del texto, modelo) -> score del cross-encoder
+_SCORE_CACHE = TTLCache(
+    int(os.environ.get("RAG_RERANK_CACHE_SIZE", "8192")),
+    float(os.environ.get("RAG_RERANK_CACHE_TTL", "86400")),
+)
+_stats_lock = threading.Lock()
+_STATS = {"reranked": 0, "skipped_budget": 0, "skipped_loading": 0}
+_PAIR_SECONDS: Optional[float] = None  # costo por par (query, chunk), media móvil exponencial
+_PAIR_EWMA = 0.2
+
+
+def _load_model():  # pragma: no cover (IO heavy)
+    global _MODEL, _MODEL_LOADING
+    try:
+        from sentence_transformers import CrossEncoder
+        _MODEL = CrossEncoder(RERANK_MODEL, max_length=512)
+        print(f"[RAG] ✅ Cross-encoder cargado: {RERANK_MODEL}")
+    except Exception as e:
+        print(f"[RAG] ❌ Error cargando cross-encoder: {e}")
+    finally:
+        _MODEL_LOADING = False
+
+
+def _model_or_warm():
+    """Devuelve el modelo si ya está listo; si no, lanza su carga en background."""
+    global _MODEL_LOADING
+    if _MODEL is not None:
+        return _MODEL
+    with _MODEL_LOCK:
+        if _MODEL is None and not _MODEL_LOADING:
+            _MODEL_LOADING = True
+            threading.Thread(target=_load_model, name="rag-rerank-warmup", daemon=True).start()
+    return None
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _STATS[key] += 1
+
+
+def _observe(pairs: int, seconds: float) -> None:
+    global _PAIR_SECONDS
+    per_pair = seconds / max(pairs, 1)
+    with _stats_lock:
+        _PAIR_SECONDS = per_pair if _PAIR_SECONDS is None else (
+            (1 - _PAIR_EWMA) * _PAIR_SECONDS + _PAIR_EWMA * per_pair)
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def rerank(query: str, candidates: Sequence[Dict[str, Any]], top_k: int,
+           budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Reordena ``candidates`` por score del cross-encoder y devuelve ``top_k``.
+
+    Los scores ya vistos para (query, chunk) salen del cache y no consumen
+    presupuesto. Un lote sólo se lanza si su duración proyectada entra en
+    el presupuesto restante; si no, se devuelve el orden original (los scores
+    ya calculados quedan en cache para la próxima vez).
+    """
+    candidates = list(candidates)
+    if len(candidates) <= 1:
+        return candidates[:top_k]
+    model = _model_or_warm()
+    if model is None:
+        _count("skipped_loading")
+        return candidates[:top_k]
+
+    budget = (RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+    t0 = time.perf_counter()
+    qkey = normalize_query(query)
+    keys = [(qkey, _text_key(c["text"]), RERANK_MODEL) for c in candidates]
+    scores: List[Optional[float]] = [_SCORE_CACHE.get(k) for k in keys]
+    missing = [i for i, s in enumerate(scores) if s is None]
+    for start in range(0, len(missing), RERANK_BATCH):
+        batch = missing[start:start + RERANK_BATCH]
+        projected = (_PAIR_SECONDS or 0.0) * len(batch)
+        if time.perf_counter() - t0 + projected > budget:
+            _count("skipped_budget")
+            return candidates[:top_k]
+        t_batch = time.perf_counter()
+        predicted = model.predict([(query, candidates[i]["text"]) for i in batch], show_progress_bar=False)
+        _observe(len(batch), time.perf_counter() - t_batch)
+        for i, score in zip(batch, predicted):
+            scores[i] = float(score)
+            _SCORE_CACHE.set(keys[i], scores[i])
+
+    _count("reranked")
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:top_k]
+    results = []
+    for i in order:
+        item = dict(candidates[i])
+        item["rerank_score"] = scores[i]
+        results.append(item)
+    return results
+
+
+def rerank_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_STATS)
+    stats["model"] = RERANK_MODEL
+    stats["loaded"] = _MODEL is not None
+    stats["pair_ms"] = None if _PAIR_SECONDS is None else round(_PAIR_SECONDS * 1000, 3)
+    stats["score_cache"] = _SCORE_CACHE.stats()
+    return stats
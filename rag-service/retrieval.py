@@ -4,33 +4,113 @@ Esta capa está diseñada para poder reemplazarse fácilmente en el futuro
 por Azure AI Search u otro vector store. Mantén la interfaz estable.
 """
 from __future__ import annotations
+import atexit
 import os
+import re
 import threading
 import time
-from dataclasses import dataclass
-from typing import List, Sequence, Optional, Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import List, Sequence, Optional, Dict, Any, Tuple
 
 try:
     import numpy as np  # type: ignore
 except ImportError:  # pragma: no cover
     np = None  # type: ignore
 
+from cache import TTLCache, normalize_query
+from embedders import Embedder, HashingEmbedder, SentenceTransformerEmbedder, hashing_model_name, onnx_model_name
+from filters import FilterIndex, SearchFilters
+from limiter import INFER_TIMEOUT
+from metrics import stage
+
 _EMBED_LOCK = threading.Lock()
-_EMBED_MODEL = None  # lazy loaded embedding model (sentence-transformers or FlagEmbedding)
-_MATRIX = None       # numpy matrix (n_chunks x dim)
-_CHUNKS: List["ChunkMeta"] = []
+_MODEL_LOCK = threading.Lock()
+_MODEL_WARMING = False  # carga del modelo en background ya lanzada (modo híbrido)
+_EMBED_MODEL: Optional[Embedder] = None  # embedder del backend RAG_EMBED_BACKEND, cargado en el primer uso
+_SNAPSHOT: Optional["IndexSnapshot"] = None  # índice activo; se reemplaza entero, nunca se muta
+_RELOAD_LOCK = threading.Lock()  # serializa recargas; las búsquedas no toman locks
+_RELOADING = False
+_COLLECTIONS: "OrderedDict[str, IndexSnapshot]" = OrderedDict()  # colecciones cargadas, de menos a más usada
+_COLLECTION_CHECKED_AT: Dict[str, float] = {}  # colección -> monotonic del último chequeo de su versión en disco
+_COLLECTIONS_LOCK = threading.Lock()
+_INDEX_CHECKED_AT = 0.0  # monotonic del último chequeo de la versión en disco (por proceso)
+_ATTEMPTED_VERSION: Optional[str] = None  # última versión de disco que se intentó cargar
+_BATCHER = None      # batching.MicroBatcher del proceso actual (se crea tras el fork)
+_BATCHER_PID: Optional[int] = None
+_ENCODE_POOL = None  # encode_pool.EncodePool hospedado aquí o PoolClient hacia el host (se crea tras el fork)
+_ENCODE_POOL_PID: Optional[int] = None
 
 # Modelo de embeddings: bge-large-en-v1.5 (63.7% MTEB, optimizado para GPU L4)
-DEFAULT_MODEL = os.environ.get("RAG_MODEL_SENTENCE", "BAAI/bge-large-en-v1.5")
+SENTENCE_MODEL = os.environ.get("RAG_MODEL_SENTENCE", "BAAI/bge-large-en-v1.5")  # modelo de Hugging Face a cargar
+DEFAULT_MODEL = SENTENCE_MODEL  # nombre que firma índice, chunk store y caches
 USE_GPU = os.environ.get("RAG_USE_GPU", "1") == "1"  # Auto-detecta GPU si está disponible
+EMBED_BACKEND = os.environ.get("RAG_EMBED_BACKEND", "torch").lower()  # 'torch' | 'onnx' (sólo CPU) | 'hashing'
+ONNX_QUANTIZED = os.environ.get("RAG_ONNX_QUANTIZED", "1") == "1"  # backend onnx: model.int8.onnx
+if EMBED_BACKEND == "hashing":
+    # Nombre propio: índice, chunk store y caches no se mezclan con los del modelo real.
+    DEFAULT_MODEL = hashing_model_name()
+elif EMBED_BACKEND == "onnx":
+    # Igual para los vectores int8: no comparten claves con los float32 de PyTorch.
+    DEFAULT_MODEL = onnx_model_name(SENTENCE_MODEL, ONNX_QUANTIZED)
 EMBED_CACHE_PATH = os.environ.get("RAG_EMBED_CACHE", "/app/rag_cache/embeddings.npz")
+INDEX_DIR = os.environ.get("RAG_INDEX_DIR", os.path.join(os.path.dirname(EMBED_CACHE_PATH), "index"))
+COLLECTIONS_DIR = os.environ.get(
+    "RAG_COLLECTIONS_DIR", os.path.join(os.path.dirname(INDEX_DIR.rstrip("/")), "collections")
+)
+COLLECTIONS_MEMORY_MB = float(os.environ.get("RAG_COLLECTIONS_MEMORY_MB", "2048"))  # presupuesto de vectores cargados
+DEFAULT_COLLECTION = "default"  # el índice de RAG_INDEX_DIR; siempre cargado, nunca se descarga
+INDEX_VERIFY = os.environ.get("RAG_INDEX_VERIFY", "0") == "1"  # valida checksum al cargar (lee todo el archivo)
+WARMUP = os.environ.get("RAG_WARMUP", "1") == "1"  # índice + modelo + un encode y un scoring al arrancar
 TOP_K_DEFAULT = int(os.environ.get("RAG_TOP_K", "5"))  # Balanceado para respuestas concisas
 MIN_SCORE = float(os.environ.get("RAG_MIN_SCORE", "0.45"))  # Umbral alto con bge-large
 BACKEND_KIND = os.environ.get("RAG_BACKEND", "local").lower()  # 'local' | 'azure'
+INDEX_CHECK_SECONDS = float(os.environ.get("RAG_INDEX_CHECK_SECONDS", "2"))  # cada cuánto una búsqueda mira la versión en disco; 0 = nunca
+DEDUP_PREFIX = int(os.environ.get("RAG_DEDUP_PREFIX", "100"))  # chars usados como firma de duplicado
+DEDUP_OVERSAMPLE = 4  # candidatos extra por cada top_k para compensar duplicados
+LENGTH_BOOST_CHARS = 400  # chunks más largos son más informativos: orden por score * min(largo / 400, 1.1)
+LENGTH_BOOST_MAX = 1.1
+QUERY_CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", "1024"))  # 0 desactiva
+QUERY_CACHE_TTL = float(os.environ.get("RAG_QUERY_CACHE_TTL", "86400"))  # segundos
+RESULT_CACHE_SIZE = int(os.environ.get("RAG_RESULT_CACHE_SIZE", "512"))  # 0 desactiva
+RESULT_CACHE_TTL = float(os.environ.get("RAG_RESULT_CACHE_TTL", "3600"))  # segundos
+SEARCH_MODE = os.environ.get("RAG_SEARCH_MODE", "dense").lower()  # 'dense' | 'hybrid' | 'lexical'
+HYBRID_DEPTH = int(os.environ.get("RAG_HYBRID_DEPTH", "10"))  # candidatos por lista = top_k * depth
+MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.7"))  # diversificación por defecto; 1 = sólo relevancia
+MMR_CANDIDATES = int(os.environ.get("RAG_MMR_CANDIDATES", "50"))  # pool sobre el que se diversifica
+MICROBATCH_MS = float(os.environ.get("RAG_MICROBATCH_MS", "0"))  # ventana de coalescencia; 0 desactiva
+MICROBATCH_MAX = int(os.environ.get("RAG_MICROBATCH_MAX", "32"))
+MICROBATCH_QUEUE = int(os.environ.get("RAG_MICROBATCH_QUEUE", "256"))  # búsquedas esperando lote antes de 429
+# Tokens (filas x largo con padding) por lote de encode en embed_texts; 0 = lotes de tamaño fijo
+GPU_TOKEN_BUDGET = 16384
+CPU_TOKEN_BUDGET = 4096
+_TOKEN_BUDGET_ENV = os.environ.get("RAG_EMBED_TOKEN_BUDGET")
+EMBED_TOKEN_BUDGET: Optional[int] = int(_TOKEN_BUDGET_ENV) if _TOKEN_BUDGET_ENV else None  # None = según el dispositivo; 0 desactiva
+EMBED_MAX_BATCH = int(os.environ.get("RAG_EMBED_MAX_BATCH", "128"))
+ENCODE_WORKERS = int(os.environ.get("RAG_ENCODE_WORKERS", "0"))  # réplicas del modelo en procesos (CPU); 0 = en proceso
+ENCODE_POOL_MIN = int(os.environ.get("RAG_ENCODE_POOL_MIN", "64"))  # textos mínimos para repartir entre workers
 AZURE_SEARCH_ENDPOINT = os.environ.get("AZURE_SEARCH_ENDPOINT")
 AZURE_SEARCH_KEY = os.environ.get("AZURE_SEARCH_KEY")
 AZURE_SEARCH_INDEX = os.environ.get("AZURE_SEARCH_INDEX", "educacion-docs")
 
+_QUERY_CACHE = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)  # (query normalizada, modelo) -> q_vec
+_RESULT_CACHE = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)  # (query, top_k, params, versión) -> resultados
+
+
+SEARCH_MODES = ("dense", "hybrid", "lexical")
+MAX_TOP_K = 100
+MAX_NPROBE = 4096
+MAX_RERANK_BUDGET_MS = 10_000.0
+_COLLECTION_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class UnknownCollection(LookupError):
+    """No existe un índice para la colección pedida."""
+
+
+def is_valid_collection(name: Any) -> bool:
+    return isinstance(name, str) and bool(_COLLECTION_RE.match(name))
+
 
 @dataclass
 class ChunkMeta:
@@ -40,16 +120,119 @@ class ChunkMeta:
     vector_index: int
 
 
+@dataclass(frozen=True, eq=False)
+class IndexSnapshot:
+    """Índice cargado, inmutable.
+
+    Cada búsqueda toma la referencia al snapshot activo una sola vez y
+    termina sobre él aunque mientras tanto se instale otro (recarga).
+    """
+    matrix: Any                  # numpy (n_chunks x dim) float32; mmap en el formato en directorio
+    chunks: Sequence[ChunkMeta]
+    sig_ids: Any                 # ids enteros de firma (text[:DEDUP_PREFIX]) por fila, para dedup vectorizado
+    version: str                 # checksum del manifiesto o mtime del .npz legado
+    backing: str = "private"     # 'mmap' (page cache del SO) | 'private' (copia en este proceso)
+    file_id: Optional[Tuple[int, int]] = None  # (st_dev, st_ino) del archivo de vectores mapeado
+    quant: Any = None            # quantization.QuantizedMatrix para preselección
+    ann: Any = None              # ann.IVFIndex sobre ``matrix``
+    lexical: Any = None          # lexical.BM25Index alineado con ``matrix``
+    filters: Optional[FilterIndex] = None  # filas por documento/capítulo y página por fila
+    deduped: bool = False        # dedup SimHash en la ingesta: no hace falta dedup por consulta
+    length_boost: Any = None     # factor por longitud de cada fila; sólo ordena, el score sigue siendo el coseno
+    loaded_at: float = 0.0
+    load_seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return int(self.matrix.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        """Tamaño de los vectores (lo que domina la memoria del índice)."""
+        total = int(self.matrix.nbytes)
+        if self.quant is not None:
+            total += int(self.quant.nbytes)
+        return total
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """Parámetros de una búsqueda; hashable para usarse en claves de cache y lotes."""
+    top_k: int
+    nprobe: Optional[int] = None
+    exact: bool = False
+    mode: str = "dense"
+    rerank: bool = False
+    rerank_budget_ms: Optional[float] = None
+    filters: Optional[SearchFilters] = None
+    mmr_lambda: Optional[float] = None  # 1 = sólo relevancia, 0 = sólo diversidad
+    collection: Optional[str] = None   # None = colección por defecto (RAG_INDEX_DIR)
+
+    def __post_init__(self):
+        if not _is_int(self.top_k) or not 1 <= self.top_k <= MAX_TOP_K:
+            raise ValueError(f"top_k debe ser un entero entre 1 y {MAX_TOP_K}")
+        if self.nprobe is not None and (not _is_int(self.nprobe) or not 1 <= self.nprobe <= MAX_NPROBE):
+            raise ValueError(f"nprobe debe ser un entero entre 1 y {MAX_NPROBE}")
+        if self.rerank_budget_ms is not None and not 0 <= self.rerank_budget_ms <= MAX_RERANK_BUDGET_MS:
+            raise ValueError(f"rerank_budget_ms debe estar entre 0 y {MAX_RERANK_BUDGET_MS:.0f}")
+        if self.mode not in SEARCH_MODES:
+            raise ValueError(f"mode debe ser uno de {SEARCH_MODES}")
+        if self.mmr_lambda is not None and not 0.0 <= self.mmr_lambda <= 1.0:
+            raise ValueError("mmr_lambda debe estar entre 0 y 1")
+        if self.collection is not None and not _COLLECTION_RE.match(self.collection):
+            raise ValueError("collection sólo admite letras, números, '-' y '_'")
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, (int, np.integer) if np is not None else int) and not isinstance(value, bool)
+
+
+def _make_options(top_k: Optional[int], **options: Any) -> SearchOptions:
+    options.setdefault("mode", SEARCH_MODE)
+    if options.get("collection") == DEFAULT_COLLECTION:
+        options["collection"] = None
+    if options["mode"] is None:
+        options["mode"] = SEARCH_MODE
+    if options.get("mmr_lambda") is None:
+        options["mmr_lambda"] = MMR_LAMBDA
+    if isinstance(options.get("filters"), dict):
+        options["filters"] = SearchFilters.from_dict(options["filters"])
+    return SearchOptions(top_k=top_k or TOP_K_DEFAULT, **options)
+
+
 def _lazy_load_model():  # pragma: no cover (IO heavy)
     """Carga el modelo de embeddings optimizado para GPU o CPU."""
     global _EMBED_MODEL
     if _EMBED_MODEL is not None:
         return _EMBED_MODEL
-    
+    with _MODEL_LOCK:
+        if _EMBED_MODEL is not None:
+            return _EMBED_MODEL
+        return _load_model()
+
+
+def _load_model():  # pragma: no cover (IO heavy)
+    global _EMBED_MODEL
+    if EMBED_BACKEND == "hashing":
+        _EMBED_MODEL = HashingEmbedder()
+        print(f"[RAG] 🧪 Embedder determinista {_EMBED_MODEL.name} (sin modelo, no apto para producción)")
+        return _EMBED_MODEL
+    if EMBED_BACKEND == "onnx":
+        try:
+            from onnx_embedder import load_embedder, read_config
+            config = read_config() or {}
+            if config.get("model") not in (None, SENTENCE_MODEL):
+                print(f"[RAG] ⚠️ Modelo ONNX exportado desde {config['model']}, modelo actual {SENTENCE_MODEL}")
+            _EMBED_MODEL = load_embedder()
+            return _EMBED_MODEL
+        except Exception as e:
+            # Sin volver a PyTorch: sus vectores quedarían firmados como los de ONNX.
+            print(f"[RAG] ❌ Error cargando modelo ONNX {DEFAULT_MODEL}: {e}")
+            return None
     # Detectar si hay GPU disponible
     import torch
     device = "cuda" if USE_GPU and torch.cuda.is_available() else "cpu"
-    print(f"[RAG] 🚀 Inicializando modelo {DEFAULT_MODEL} en {device.upper()}")
+    print(f"[RAG] 🚀 Inicializando modelo {SENTENCE_MODEL} en {device.upper()}")
     
     if USE_GPU and torch.cuda.is_available():
         print(f"[RAG] 🎮 GPU detectada: {torch.cuda.get_device_name(0)}")
@@ -57,19 +240,15 @@ def _lazy_load_model():  # pragma: no cover (IO heavy)
     
     # Intentar cargar con sentence-transformers (compatible con gte-Qwen2-7B)
     try:
-        from sentence_transformers import SentenceTransformer
-        _EMBED_MODEL = SentenceTransformer(
-            DEFAULT_MODEL,
-            device=device,
-            trust_remote_code=True  # Necesario para gte-Qwen2-7B
-        )
+        from embedders import load_sentence_transformer
+        _EMBED_MODEL = load_sentence_transformer(SENTENCE_MODEL, device)
         
         # Configurar para máximo rendimiento en GPU
         if device == "cuda":
             _EMBED_MODEL.max_seq_length = 8192  # gte-Qwen2-7B soporta 32k, usamos 8k para balance
             print(f"[RAG] ⚡ Configuración GPU: max_seq_length={_EMBED_MODEL.max_seq_length}")
         
-        print(f"[RAG] ✅ Modelo cargado: {DEFAULT_MODEL} ({device.upper()})")
+        print(f"[RAG] ✅ Modelo cargado: {SENTENCE_MODEL} ({device.upper()})")
         return _EMBED_MODEL
     except ImportError:
         print("[RAG] ❌ sentence-transformers no instalado.")
@@ -81,148 +260,839 @@ def _lazy_load_model():  # pragma: no cover (IO heavy)
         return None
 
 
-def _load_embeddings_if_available():  # pragma: no cover
-    global _MATRIX, _CHUNKS
-    if _MATRIX is not None:
-        return
+def _signature_ids(texts: Sequence[str]):
+    """Asigna un id entero por firma de texto (los primeros DEDUP_PREFIX chars).
+
+    Se calcula una sola vez al cargar el índice; así la deduplicación por
+    consulta se resuelve con arrays y no con un ``set`` de strings.
+    """
+    ids: Dict[str, int] = {}
+    return np.fromiter(
+        (ids.setdefault(t[:DEDUP_PREFIX], len(ids)) for t in texts),
+        dtype=np.int64,
+        count=len(texts),
+    )
+
+
+def _length_boost(lengths):
+    """``min(largo / LENGTH_BOOST_CHARS, LENGTH_BOOST_MAX)`` por fila, calculado una vez al cargar."""
+    lengths = np.asarray(lengths, dtype=np.float32)
+    return np.minimum(lengths / LENGTH_BOOST_CHARS, LENGTH_BOOST_MAX)
+
+
+def _load_snapshot() -> Optional[IndexSnapshot]:  # pragma: no cover
+    """Carga el índice de disco (directorio o ``.npz`` legado) sin tocar el activo."""
     if np is None:
-        return
+        return None
+    from index_store import has_index
+    if has_index(INDEX_DIR):
+        return _load_index_dir()
     if not os.path.exists(EMBED_CACHE_PATH):
-        print(f"[RAG] ⚠️  Cache de embeddings no encontrado: {EMBED_CACHE_PATH}")
-        return
+        return None
+    # Formato legado: .npz comprimido con metadatos pickle.
+    t0 = time.time()
     try:
         data = np.load(EMBED_CACHE_PATH, allow_pickle=True)
-        _MATRIX = data["embeddings"]
         meta_list = data["meta"].tolist()
-        _CHUNKS = [ChunkMeta(**m) for m in meta_list]
-        print(f"[RAG] ✅ Cargados {len(_CHUNKS)} chunks desde cache")
+        chunks = [ChunkMeta(**m) for m in meta_list]
+        return IndexSnapshot(
+            matrix=data["embeddings"],
+            chunks=chunks,
+            sig_ids=_signature_ids([c.text for c in chunks]),
+            version=_npz_version(),
+            filters=FilterIndex.from_chunks(chunks),
+            length_boost=_length_boost([len(c.text) for c in chunks]),
+            loaded_at=time.time(),
+            load_seconds=time.time() - t0,
+        )
     except Exception as e:  # pragma: no cover
-        print(f"[RAG] ❌ Error cargando cache de embeddings: {e}")
+        print(f"[RAG] No se pudo cargar cache de embeddings: {e}")
+        return None
+
+
+def _npz_version() -> str:
+    return f"npz:{os.path.getmtime(EMBED_CACHE_PATH):.0f}"
+
+
+def _load_index_dir(directory: Optional[str] = None) -> Optional[IndexSnapshot]:  # pragma: no cover
+    from index_store import load_index
+    directory = directory or INDEX_DIR
+    t0 = time.time()
+    try:
+        index = load_index(directory, verify=INDEX_VERIFY)
+    except Exception as e:
+        print(f"[RAG] No se pudo cargar índice {directory}: {e}")
+        return None
+    manifest = index.manifest
+    if manifest.get("model") != DEFAULT_MODEL:
+        print(f"[RAG] ⚠️ Índice generado con {manifest.get('model')}, modelo actual {DEFAULT_MODEL}")
+    print(
+        f"[RAG] 📂 Índice cargado ({directory}): {manifest['rows']} chunks, dim {manifest['dim']}, "
+        f"modo {manifest.get('storage_mode')}, ANN {manifest.get('ann') or 'no'} "
+        f"({(time.time() - t0) * 1000:.0f} ms)"
+    )
+    return IndexSnapshot(
+        matrix=index.matrix,
+        chunks=index.chunks,
+        sig_ids=index.sig_ids,
+        version=manifest["checksum"],
+        backing="mmap",
+        file_id=_file_id(index.matrix),
+        quant=index.quant,
+        ann=index.ann,
+        lexical=index.lexical,
+        filters=index.filters,
+        deduped=bool(manifest.get("dedup")),
+        length_boost=_length_boost(np.diff(np.asarray(index.chunks.offsets))),  # bytes UTF-8 ≈ chars
+        loaded_at=time.time(),
+        load_seconds=time.time() - t0,
+    )
+
+
+def _file_id(matrix) -> Optional[Tuple[int, int]]:
+    """(dispositivo, inode) del archivo detrás de un ``np.memmap``; None si no hay archivo."""
+    filename = getattr(matrix, "filename", None)
+    if not filename:
+        return None
+    st = os.stat(filename)
+    return st.st_dev, st.st_ino
+
+
+def _install(snapshot: IndexSnapshot):
+    """Publica ``snapshot`` como índice activo.
+
+    Es una sola asignación (atómica para los lectores); los resultados
+    cacheados quedan asociados a la versión anterior y se descartan.
+    """
+    global _SNAPSHOT
+    _SNAPSHOT = snapshot
+    _RESULT_CACHE.clear()
 
 
 def ensure_ready():  # pragma: no cover
+    if _SNAPSHOT is not None:
+        return
     with _EMBED_LOCK:
-        if _MATRIX is None:
-            _load_embeddings_if_available()
+        if _SNAPSHOT is None:
+            snapshot = _load_snapshot()
+            if snapshot is not None:
+                _install(snapshot)
+
+
+def warm_up() -> Dict[str, float]:
+    """Deja el worker listo antes de aceptar requests (lifespan de uvicorn).
+
+    Abre el índice, carga el modelo y corre un encode y un scoring de prueba
+    (inicialización perezosa de torch/CUDA y páginas del mmap en el page
+    cache), así la primera búsqueda no paga el arranque. Cada worker de
+    uvicorn tiene su propio modelo; los vectores del índice se abren con mmap
+    y el page cache del SO los comparte entre workers, por eso no hace falta
+    cargar nada en un proceso padre antes del fork. Devuelve la duración (s)
+    de cada etapa.
+    """
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    ensure_ready()
+    timings["index"] = time.perf_counter() - t0
+    if not WARMUP or BACKEND_KIND == "azure":
+        return timings
+    t0 = time.perf_counter()
+    model = _lazy_load_model()
+    timings["model"] = time.perf_counter() - t0
+    if model is None or np is None:
+        return timings
+    t0 = time.perf_counter()
+    # Directo al modelo: no se ensucian el cache de queries ni sus estadísticas.
+    q_vec = np.asarray(model.encode(["warm-up"], normalize_embeddings=True), dtype=np.float32)[0]
+    timings["encode"] = time.perf_counter() - t0
+    snap = _SNAPSHOT
+    if snap is not None and snap.rows and snap.matrix.shape[1] == q_vec.shape[0]:
+        t0 = time.perf_counter()
+        _score_rows(snap, q_vec)
+        timings["score"] = time.perf_counter() - t0
+    return timings
+
+
+def current_snapshot() -> Optional[IndexSnapshot]:
+    """Snapshot activo (carga el índice si aún no se cargó); None si no hay índice."""
+    ensure_ready()
+    return _SNAPSHOT
+
+
+def collection_dir(name: str) -> str:
+    """Directorio del índice de la colección ``name`` (``RAG_COLLECTIONS_DIR/<name>/index``)."""
+    if not _COLLECTION_RE.match(name):
+        raise ValueError("collection sólo admite letras, números, '-' y '_'")
+    return os.path.join(COLLECTIONS_DIR, name, "index")
+
+
+def _snapshot_for(collection: Optional[str]) -> Optional[IndexSnapshot]:
+    """Snapshot de ``collection``; las colecciones con nombre se cargan en el primer uso.
+
+    Una colección cargada se valida contra su versión en disco (``CURRENT``
+    de su directorio) como el índice principal: si otra ingesta u otro
+    worker publicó una versión nueva, se reemplaza en esta búsqueda. Tras
+    cada carga se descargan las colecciones menos usadas hasta volver al
+    presupuesto ``RAG_COLLECTIONS_MEMORY_MB``.
+    """
+    if not collection:
+        ensure_ready()
+        _check_disk_version()
+        return _SNAPSHOT
+    with _COLLECTIONS_LOCK:
+        cached = _COLLECTIONS.get(collection)
+        if cached is not None and not _collection_changed(collection, cached):
+            _COLLECTIONS.move_to_end(collection)
+            return cached
+        from index_store import has_index
+        directory = collection_dir(collection)
+        if cached is None and not has_index(directory):
+            raise UnknownCollection(collection)
+        # Con el formato en directorio la carga es sólo abrir mmaps: se hace con el lock tomado.
+        snapshot = _load_index_dir(directory)
+        if snapshot is None:
+            if cached is None:
+                raise UnknownCollection(collection)
+            snapshot = cached  # versión nueva ilegible: se sigue sirviendo la cargada
+        elif cached is not None:
+            print(f"[RAG] 🔄 Colección '{collection}' recargada ({snapshot.version[:19]})")
+        _COLLECTIONS[collection] = snapshot
+        _COLLECTIONS.move_to_end(collection)
+        _COLLECTION_CHECKED_AT[collection] = time.monotonic()
+        _evict_collections(keep=collection)
+        return snapshot
+
+
+def _collection_changed(name: str, snapshot: IndexSnapshot) -> bool:
+    """True si la versión en disco de ``name`` ya no es la cargada (a lo sumo cada ``RAG_INDEX_CHECK_SECONDS``)."""
+    if INDEX_CHECK_SECONDS <= 0:
+        return False
+    now = time.monotonic()
+    if now - _COLLECTION_CHECKED_AT.get(name, 0.0) < INDEX_CHECK_SECONDS:
+        return False
+    _COLLECTION_CHECKED_AT[name] = now
+    version = _disk_version(collection_dir(name))
+    return version is not None and version != snapshot.version
+
+
+def _evict_collections(keep: str):
+    """Descarga colecciones por LRU mientras se supere el presupuesto (llamar con el lock tomado)."""
+    budget = COLLECTIONS_MEMORY_MB * 1024 * 1024
+    used = sum(s.nbytes for s in _COLLECTIONS.values()) + (_SNAPSHOT.nbytes if _SNAPSHOT is not None else 0)
+    for name in list(_COLLECTIONS):
+        if used <= budget:
+            break
+        if name == keep:
+            continue
+        # Las búsquedas en curso conservan su referencia; el mmap se libera al terminar.
+        used -= _COLLECTIONS.pop(name).nbytes
+        print(f"[RAG] ♻️ Colección '{name}' descargada (presupuesto {COLLECTIONS_MEMORY_MB:.0f} MB)")
+
+
+def collections_status() -> Dict[str, Any]:
+    with _COLLECTIONS_LOCK:
+        loaded = [
+            {"name": name, "rows": s.rows, "bytes": s.nbytes, "version": s.version}
+            for name, s in _COLLECTIONS.items()
+        ]
+    from index_store import has_index
+    available: List[str] = []
+    if os.path.isdir(COLLECTIONS_DIR):
+        available = sorted(
+            name for name in os.listdir(COLLECTIONS_DIR)
+            if has_index(os.path.join(COLLECTIONS_DIR, name, "index"))
+        )
+    return {"budget_mb": COLLECTIONS_MEMORY_MB, "loaded": loaded, "available": available}
+
+
+def reload_index(wait: bool = False, collection: Optional[str] = None) -> bool:
+    """Vuelve a cargar el índice de disco y lo instala al terminar.
+
+    La carga corre en un thread aparte (o en el llamador con ``wait=True``);
+    las búsquedas en curso terminan sobre el snapshot anterior. Devuelve
+    False si ya había una recarga en curso. Sólo recarga el proceso actual;
+    los demás workers ven la versión nueva en disco con ``_check_disk_version``.
+    Para una colección con nombre se descarta la versión cargada y la
+    próxima búsqueda carga la nueva; en los demás workers lo hace
+    ``_collection_changed``.
+    """
+    global _RELOADING
+    if collection and collection != DEFAULT_COLLECTION:
+        with _COLLECTIONS_LOCK:
+            _COLLECTIONS.pop(collection, None)
+        return True
+    with _RELOAD_LOCK:
+        if _RELOADING:
+            return False
+        _RELOADING = True
+    if wait:
+        _do_reload()
+    else:
+        threading.Thread(target=_do_reload, name="rag-index-reload", daemon=True).start()
+    return True
+
+
+def _do_reload():  # pragma: no cover
+    global _RELOADING
+    try:
+        t0 = time.time()
+        snapshot = _load_snapshot()
+        if snapshot is None:
+            print("[RAG] ⚠️ Recarga sin índice válido en disco; se mantiene el actual")
+            return
+        _install(snapshot)
+        print(f"[RAG] 🔄 Índice recargado: {snapshot.rows} chunks ({(time.time() - t0) * 1000:.0f} ms)")
+    finally:
+        _RELOADING = False
+
+
+def _disk_version(directory: Optional[str] = None) -> Optional[str]:
+    """Versión del índice en disco, leyendo sólo el manifiesto (o el mtime del .npz del índice principal)."""
+    from index_store import read_manifest
+    try:
+        manifest = read_manifest(directory or INDEX_DIR)
+        if manifest is not None:
+            return manifest.get("checksum")
+        if directory is None and os.path.exists(EMBED_CACHE_PATH):
+            return _npz_version()
+    except (OSError, ValueError):
+        pass  # escritura en curso: se reintenta en el próximo ciclo
+    return None
+
+
+def _check_disk_version():
+    """Recarga en segundo plano si el índice en disco cambió (a lo sumo cada ``RAG_INDEX_CHECK_SECONDS``).
+
+    Se llama en cada búsqueda de cada worker, así una ingesta nueva o un
+    ``POST /index/reload`` atendido por otro worker llega a todos sin
+    coordinación entre procesos. La búsqueda que detecta el cambio todavía
+    se responde con el snapshot anterior.
+    """
+    global _INDEX_CHECKED_AT, _ATTEMPTED_VERSION
+    if INDEX_CHECK_SECONDS <= 0:
+        return
+    now = time.monotonic()
+    if now - _INDEX_CHECKED_AT < INDEX_CHECK_SECONDS:
+        return
+    _INDEX_CHECKED_AT = now
+    version = _disk_version()
+    snapshot = _SNAPSHOT
+    if version is None or version == _ATTEMPTED_VERSION or (snapshot is not None and version == snapshot.version):
+        return
+    if reload_index():
+        # Si la carga falla no se reintenta hasta que cambie el índice; si había otra
+        # recarga en curso no se marca y se vuelve a mirar en el próximo chequeo.
+        _ATTEMPTED_VERSION = version
+        print(f"[RAG] 👀 Nuevo índice detectado en disco ({version[:19]}), recargando")
+
+
+def embedder_status() -> Dict[str, Any]:
+    """Backend, nombre y dimensión del embedder cargado (interfaz ``Embedder``); no carga nada."""
+    model = _EMBED_MODEL
+    if model is None:
+        return {"backend": EMBED_BACKEND, "loaded": False, "name": DEFAULT_MODEL, "dimension": None}
+    return {"backend": EMBED_BACKEND, "loaded": True, "name": model.name, "dimension": int(model.dimension)}
+
+
+def index_status() -> Dict[str, Any]:
+    """Estado del índice en este proceso.
+
+    Cada worker abre su propio índice. Con ``backing='mmap'`` los vectores
+    son páginas del page cache del SO y ``shared`` es True: los workers que
+    reportan el mismo ``device``/``inode`` leen las mismas páginas físicas.
+    El ``.npz`` legado es una copia privada en cada worker.
+    """
+    pid = os.getpid()
+    snapshot = _SNAPSHOT
+    if snapshot is None:
+        return {"loaded": False, "rows": 0, "backing": "none", "pid": pid, "shared": False,
+                "device": None, "inode": None, "version": None, "reloading": _RELOADING}
+    device, inode = snapshot.file_id or (None, None)
+    return {
+        "loaded": True,
+        "rows": snapshot.rows,
+        "backing": snapshot.backing,
+        "pid": pid,
+        "shared": snapshot.backing == "mmap",
+        "device": device,
+        "inode": inode,
+        "version": snapshot.version,
+        "loaded_at": snapshot.loaded_at,
+        "load_ms": round(snapshot.load_seconds * 1000, 1),
+        "bytes": snapshot.nbytes,
+        "reloading": _RELOADING,
+    }
+
+
+def _token_lengths(model, texts: Sequence[str]) -> List[int]:
+    """Largo en tokens de cada texto (truncado a ``max_seq_length``); sin tokenizer, chars / 4."""
+    limit = int(getattr(model, "max_seq_length", None) or 512)
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            ids = tokenizer(list(texts), add_special_tokens=True, truncation=True, max_length=limit)["input_ids"]
+            return [len(x) for x in ids]
+        except Exception:
+            pass
+    return [min(limit, len(t) // 4 + 2) for t in texts]
+
+
+def _token_budget(cuda: bool) -> int:
+    """``RAG_EMBED_TOKEN_BUDGET`` o, sin configurar, el del dispositivo donde corre el encode.
+
+    Se decide con ``torch.cuda.is_available()`` y no con ``RAG_USE_GPU``:
+    con la variable en 1 (el valor por defecto) en una instancia sin GPU,
+    16384 tokens por lote en CPU sólo agrega latencia y memoria.
+    """
+    if EMBED_TOKEN_BUDGET is not None:
+        return EMBED_TOKEN_BUDGET
+    return GPU_TOKEN_BUDGET if cuda else CPU_TOKEN_BUDGET
+
+
+def _encode_bucketed(model, texts: Sequence[str], encode_batch, token_budget: int = CPU_TOKEN_BUDGET,
+                     max_batch: int = EMBED_MAX_BATCH):
+    """Codifica ``texts`` en lotes de largo parecido acotados por ``token_budget``.
+
+    ``encode_batch(textos, batch_size)`` codifica un lote completo; el
+    resultado vuelve en el orden original de ``texts``.
+    """
+    from batching import length_buckets
+    texts = list(texts)
+    out = None
+    for rows in length_buckets(_token_lengths(model, texts), token_budget, max_batch):
+        vecs = np.asarray(encode_batch([texts[i] for i in rows], len(rows)), dtype=np.float32)
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+        out[rows] = vecs
+    return out if out is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def _get_encode_pool():  # pragma: no cover (IO heavy)
+    """Pool de encode de la máquina: un worker de uvicorn lo hospeda y el resto se conecta (``shared_pool``)."""
+    global _ENCODE_POOL, _ENCODE_POOL_PID
+    if _ENCODE_POOL is None or _ENCODE_POOL_PID != os.getpid():
+        with _EMBED_LOCK:
+            if _ENCODE_POOL is None or _ENCODE_POOL_PID != os.getpid():
+                from encode_pool import ENCODE_POOL_SOCKET, EncodePool, shared_pool
+                # None: cada worker del pool usa el presupuesto de CPU (ver _token_budget)
+                _ENCODE_POOL = shared_pool(ENCODE_WORKERS, token_budget=EMBED_TOKEN_BUDGET)
+                _ENCODE_POOL_PID = os.getpid()
+                atexit.register(_ENCODE_POOL.shutdown)
+                if isinstance(_ENCODE_POOL, EncodePool):
+                    print(f"[RAG] 🧵 Pool de encode: {ENCODE_WORKERS} workers x {_ENCODE_POOL.threads} hilos "
+                          f"(compartido en {ENCODE_POOL_SOCKET})")
+                else:
+                    print("[RAG] 🧵 Pool de encode hospedado por otro proceso; se usa vía socket")
+    return _ENCODE_POOL
 
 
 def embed_texts(texts: Sequence[str]):  # pragma: no cover
-    """Genera embeddings con configuración optimizada para GPU."""
+    """Genera embeddings con configuración optimizada para GPU.
+
+    Con ``RAG_EMBED_TOKEN_BUDGET`` los textos se agrupan por largo en tokens
+    (menos padding en ingestas y en ``/embed`` grandes) y se devuelven en el
+    orden original. Con ``RAG_ENCODE_WORKERS`` los lotes de al menos
+    ``RAG_ENCODE_POOL_MIN`` textos se reparten entre réplicas del modelo en
+    procesos worker (``encode_pool``), compartidos por todos los workers de uvicorn.
+    """
+    global _ENCODE_POOL
+    texts = list(texts)
+    if ENCODE_WORKERS > 0 and len(texts) >= ENCODE_POOL_MIN:
+        try:
+            with stage("encode_pool"):
+                return _get_encode_pool().encode(texts)
+        except Exception as e:
+            print(f"[RAG] ❌ Error en el pool de encode ({e}); se codifica en el proceso")
+            from encode_pool import PoolClient
+            if isinstance(_ENCODE_POOL, PoolClient):
+                _ENCODE_POOL = None  # el host pudo morir: el próximo lote vuelve a elegir host
+    return _embed_local(texts)
+
+
+def _embed_local(texts: Sequence[str]):  # pragma: no cover
     model = _lazy_load_model()
     if model is None:
         return None
-    
-    # Batch size optimizado para GPU L4 (16GB VRAM)
+    texts = list(texts)
+
+    def encode_batch(batch: Sequence[str], batch_size: Optional[int] = None):
+        kwargs = {"batch_size": batch_size} if batch_size else {}
+        with stage("encode"):
+            return model.encode(list(batch), normalize_embeddings=True, show_progress_bar=False, **kwargs)
+
+    if not isinstance(model, SentenceTransformerEmbedder):
+        # ONNX o hashing: sin torch, no aplica autocast ni el batch de GPU; cada uno usa su batch por defecto.
+        budget = _token_budget(cuda=False)
+        if budget <= 0:
+            return encode_batch(texts)
+        return _encode_bucketed(model, texts, encode_batch, token_budget=budget)
+
+    # Batch size optimizado para GPU L4 (16GB VRAM) cuando no hay presupuesto de tokens
     batch_size = 32 if USE_GPU else 8
-    
+
     import torch
-    if USE_GPU and torch.cuda.is_available():
-        # Usar precisión mixta para mayor velocidad en GPU
-        with torch.cuda.amp.autocast():
-            return model.encode(
-                list(texts), 
-                normalize_embeddings=True,
-                batch_size=batch_size,
-                show_progress_bar=False
-            )
-    else:
-        return model.encode(
-            list(texts), 
-            normalize_embeddings=True,
-            batch_size=batch_size,
-            show_progress_bar=False
-        )
+    use_amp = USE_GPU and torch.cuda.is_available()
+    # Usar precisión mixta para mayor velocidad en GPU
+    budget = _token_budget(cuda=use_amp)
+    with torch.cuda.amp.autocast(enabled=use_amp):
+        if budget <= 0 or len(texts) <= 1:
+            return encode_batch(texts, batch_size)
+        return _encode_bucketed(model, texts, encode_batch, token_budget=budget)
 
 
-def _search_local(query: str, top_k: Optional[int]) -> List[Dict[str, Any]]:
+def _search_local(query: str, opts: SearchOptions) -> List[Dict[str, Any]]:
     """Búsqueda semántica local con re-ranking.
-    
+
     Mejoras implementadas:
-    1. Query normalization
-    2. Multi-query search (expandir consulta)
-    3. Score boosting por longitud y calidad
-    4. Deduplicación inteligente
+    1. Query normalization (cache de embeddings y resultados)
+    2. Multi-query search (promedio de variaciones de la query)
+    3. Score boosting por longitud (sólo en el orden; ``score`` es el coseno)
+    4. Top-k vectorizado con deduplicación por firma
+    5. Diversificación MMR (``RAG_MMR_LAMBDA``, por defecto 0.7)
     """
-    ensure_ready()
-    if np is None or _MATRIX is None or not _CHUNKS:
+    return _search_reranked([query], opts)[0]
+
+
+def _search_reranked(queries: Sequence[str], opts: SearchOptions) -> List[List[Dict[str, Any]]]:
+    """Retrieval + re-ranking opcional con cross-encoder.
+
+    El re-ranking queda fuera del cache de resultados: depende del presupuesto
+    de latencia, así que sólo se cachean los candidatos y los scores por chunk.
+    """
+    if not opts.rerank:
+        return _search_local_batch(queries, opts)
+    from rerank import RERANK_CANDIDATES, rerank
+    base = replace(opts, top_k=max(RERANK_CANDIDATES, opts.top_k), rerank=False, rerank_budget_ms=None)
+    candidates = _search_local_batch(queries, base)
+    with stage("rerank"):
+        return [rerank(q, c, opts.top_k, opts.rerank_budget_ms) for q, c in zip(queries, candidates)]
+
+
+def _search_local_batch(queries: Sequence[str], opts: SearchOptions) -> List[List[Dict[str, Any]]]:
+    snap = _snapshot_for(opts.collection)  # el lote entero usa el mismo índice aunque haya recarga
+    if np is None or snap is None or not snap.chunks:
+        return [[] for _ in queries]
+    mode = opts.mode
+    if mode != "dense" and snap.lexical is None:
+        mode = "dense"  # índice sin BM25 (p. ej. .npz legado)
+    if mode == "hybrid" and _EMBED_MODEL is None:
+        # Mientras el modelo carga se responde sólo con BM25, mucho más barato que encode.
+        _warm_model_async()
+        mode = "lexical"
+    top_k = opts.top_k
+    allowed = _allowed_rows(snap, opts.filters)
+    if allowed is not None and allowed.size == 0:
+        return [[] for _ in queries]
+    out: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+    # El resultado es determinista para un índice dado: un hit evita encode y scoring.
+    # También se cachean resultados vacíos (nada supera MIN_SCORE).
+    keys = [(normalize_query(q), opts, mode, snap.version) for q in queries]
+    pending = []
+    with stage("cache"):
+        for i, key in enumerate(keys):
+            cached = _RESULT_CACHE.get(key)
+            if cached is not None:
+                out[i] = [dict(r) for r in cached]
+            else:
+                pending.append(i)
+    if not pending:
+        return out  # type: ignore[return-value]
+
+    if mode == "lexical":
+        with stage("lexical"):
+            for i in pending:
+                out[i] = _lexical_results(snap, queries[i], top_k, allowed)
+                _RESULT_CACHE.set(keys[i], tuple(dict(r) for r in out[i]))
+        return out  # type: ignore[return-value]
+
+    q_mat = _encode_queries([queries[i] for i in pending])
+    if q_mat is None:
+        return [r if r is not None else [] for r in out]
+    with stage("score"):
+        if opts.exact or (snap.quant is None and (snap.ann is None or allowed is not None)):
+            # Exacta, o sin ANN ni cuantización: una sola GEMM float32 para todas las
+            # queries del lote (``exact`` nunca pasa por la matriz compacta).
+            # Con filtros sólo se multiplica la submatriz de filas seleccionadas.
+            if allowed is None:
+                sims_all = q_mat @ snap.matrix.T
+            else:
+                sims_all = q_mat @ np.asarray(snap.matrix[allowed], dtype=np.float32).T
+            scored = [(allowed, sims_all[j]) for j in range(len(pending))]
+        else:
+            scored = []
+            for q_vec in q_mat:
+                cand = allowed
+                if cand is None and snap.ann is not None and not opts.exact:
+                    # Sólo se puntúan las filas de las listas IVF sondeadas.
+                    cand = snap.ann.candidate_rows(q_vec, opts.nprobe)
+                scored.append(_score_rows(snap, q_vec, cand))
+
+    # Top-k, dedup, MMR y fusión con BM25 (modo híbrido)
+    with stage("rank"):
+        for j, (i, (rows, sims)) in enumerate(zip(pending, scored)):
+            if mode == "hybrid":
+                results = _hybrid_results(snap, queries[i], q_mat[j], rows, sims, top_k, allowed, opts.mmr_lambda)
+            else:
+                results = _dense_results(snap, rows, sims, top_k, opts.mmr_lambda)
+            _RESULT_CACHE.set(keys[i], tuple(dict(r) for r in results))
+            out[i] = results
+    return out  # type: ignore[return-value]
+
+
+def _allowed_rows(snap: IndexSnapshot, filters: Optional[SearchFilters]):
+    """Filas que cumplen ``filters`` (None = sin filtro: se puntúa toda la matriz)."""
+    if not filters:
+        return None
+    if snap.filters is None:
+        return np.zeros(0, dtype=np.int64)
+    return snap.filters.rows(filters)
+
+
+def _dense_results(snap: IndexSnapshot, rows, sims, top_k: int,
+                   mmr_lambda: Optional[float] = None) -> List[Dict[str, Any]]:
+    mmr = _uses_mmr(mmr_lambda)
+    width = max(top_k, MMR_CANDIDATES) if mmr else top_k
+    if snap.deduped:
+        sig_ids = None
+    else:
+        sig_ids = snap.sig_ids if rows is None else snap.sig_ids[rows]
+    order = _boosted(snap, rows, sims)
+    picked = _rank_rows(sims, width, sig_ids, order=order)
+    matrix_rows = picked if rows is None else rows[picked]
+    if mmr:
+        keep = _mmr_order(_row_vectors(snap, matrix_rows), order[picked], top_k, mmr_lambda)
+        picked, matrix_rows = picked[keep], matrix_rows[keep]
+    # El boost sólo ordena: el score es el coseno, acotado a 1 por el redondeo de float32.
+    return [_result(snap, int(row), min(float(sims[j]), 1.0)) for row, j in zip(matrix_rows, picked)]
+
+
+def _boosted(snap: IndexSnapshot, rows, sims):
+    """Clave de orden del ranking denso: ``sims`` por el boost de longitud precalculado."""
+    if snap.length_boost is None:
+        return sims
+    return sims * (snap.length_boost if rows is None else snap.length_boost[rows])
+
+
+def _uses_mmr(mmr_lambda: Optional[float]) -> bool:
+    """Con ``lambda = 1`` MMR es el orden por relevancia: se evita el recorrido."""
+    return mmr_lambda is not None and mmr_lambda < 1.0
+
+
+def _row_vectors(snap: IndexSnapshot, rows):
+    """Vectores float32 de ``rows`` (en ese orden), leídos en orden de fila sobre el mmap."""
+    order = np.argsort(rows, kind="stable")
+    vecs = np.empty((rows.shape[0], snap.matrix.shape[1]), dtype=np.float32)
+    vecs[order] = snap.matrix[rows[order]]
+    return vecs
+
+
+def _mmr_order(vecs, relevance, top_k: int, lam: float):
+    """Posiciones de los candidatos elegidos por Maximal Marginal Relevance, en orden de selección.
+
+    Cada paso es vectorizado sobre el pool de candidatos:
+    ``lam * relevancia - (1 - lam) * similitud máxima con lo ya elegido``,
+    O(top_k * candidatos) en total, sin recorrer resultados en Python.
+    """
+    n = int(relevance.shape[0])
+    k = min(top_k, n)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    chosen = np.empty(k, dtype=np.int64)
+    max_sim = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for step in range(k):
+        gain = lam * relevance - (1.0 - lam) * max_sim
+        gain[~available] = -np.inf
+        j = int(np.argmax(gain))
+        chosen[step] = j
+        available[j] = False
+        np.maximum(max_sim, vecs @ vecs[j], out=max_sim)
+    return chosen
+
+
+def _dedup_order(snap: IndexSnapshot, rows):
+    """Posiciones de la primera aparición de cada firma en ``rows`` (que ya viene ordenado)."""
+    if snap.deduped:
+        return np.arange(rows.shape[0])
+    _, first = np.unique(snap.sig_ids[rows], return_index=True)
+    return np.sort(first)
+
+
+def _hybrid_results(snap: IndexSnapshot, query: str, q_vec, rows, sims, top_k: int, allowed=None,
+                    mmr_lambda: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Fusiona el ranking denso (sobre MIN_SCORE) y el BM25 con Reciprocal Rank Fusion.
+
+    ``score`` sigue siendo el coseno con la query, acotado a [0, 1]: un hit
+    que sólo encontró BM25 puede tener coseno negativo. ``rrf`` es el score
+    fusionado que define el orden.
+    """
+    from lexical import rrf_fuse
+    depth = top_k * HYBRID_DEPTH
+    picked = _rank_rows(sims, depth, None)
+    dense_rows = picked if rows is None else rows[picked]
+    lex_rows, _ = snap.lexical.top(query, depth, allowed)
+    fused_rows, fused = rrf_fuse([dense_rows, lex_rows])
+    if fused_rows.size == 0:
         return []
-    
-    top_k = top_k or TOP_K_DEFAULT
-    model = _lazy_load_model()
-    if model is None:
+    mmr = _uses_mmr(mmr_lambda)
+    width = max(top_k, MMR_CANDIDATES) if mmr else top_k
+    keep = _dedup_order(snap, fused_rows)[:width]
+    fused_rows, fused = fused_rows[keep], fused[keep]
+    vecs = _row_vectors(snap, fused_rows)
+    cos = vecs @ q_vec
+    if mmr:
+        # La relevancia para MMR es el coseno; el pool es el de la fusión RRF.
+        keep = _mmr_order(vecs, cos, top_k, mmr_lambda)
+        fused_rows, fused, cos = fused_rows[keep], fused[keep], cos[keep]
+    results = []
+    for row, score, rrf in zip(fused_rows, cos, fused):
+        item = _result(snap, int(row), min(max(float(score), 0.0), 1.0))
+        item["rrf"] = float(rrf)
+        results.append(item)
+    return results
+
+
+def _lexical_results(snap: IndexSnapshot, query: str, top_k: int, allowed=None) -> List[Dict[str, Any]]:
+    """Sólo BM25: ``score`` es el BM25 normalizado al mejor resultado (0-1], ``bm25`` el crudo."""
+    rows, scores = snap.lexical.top(query, top_k * DEDUP_OVERSAMPLE, allowed)
+    if rows.size == 0:
         return []
-    
-    # Generar embeddings para query principal y variaciones
-    queries = [query]
-    
-    # Query expansion simple (agregar variaciones de la pregunta)
+    keep = _dedup_order(snap, rows)[:top_k]
+    rows, scores = rows[keep], scores[keep]
+    results = []
+    for row, raw in zip(rows, scores):
+        item = _result(snap, int(row), float(raw / scores[0]))
+        item["bm25"] = float(raw)
+        results.append(item)
+    return results
+
+
+def _warm_model_async():
+    global _MODEL_WARMING
+    with _MODEL_LOCK:
+        if _MODEL_WARMING or _EMBED_MODEL is not None:
+            return
+        _MODEL_WARMING = True
+    threading.Thread(target=_lazy_load_model, name="rag-model-warmup", daemon=True).start()
+
+
+def _query_variants(query: str) -> List[str]:
+    """Query expansion simple: la query y sus variaciones, cuyos embeddings se promedian."""
+    variants = [query]
     if len(query.split()) > 3:  # Solo para queries complejas
         # Agregar versión sin signos de interrogación
         query_clean = query.replace('?', '').replace('¿', '').strip()
         if query_clean != query:
-            queries.append(query_clean)
-    
-    # Embeddings para todas las variaciones
-    q_vecs = model.encode(queries, normalize_embeddings=True)
-    
-    # Promedio de embeddings para query final (mejor cobertura)
-    if len(q_vecs) > 1:
-        q_vec = np.mean(q_vecs, axis=0)
-        # Re-normalizar después del promedio
-        q_vec = q_vec / np.linalg.norm(q_vec)
+            variants.append(query_clean)
+    return variants
+
+
+def _encode_queries(queries: Sequence[str]):
+    """Embeddings normalizados (n x dim) de las queries.
+
+    Cada query se representa por el promedio re-normalizado de los embeddings
+    de sus variaciones (mejor cobertura). Usa un cache LRU/TTL por texto
+    normalizado y modelo; sólo se codifican los misses.
+    """
+    keys = [(normalize_query(q), DEFAULT_MODEL) for q in queries]
+    vecs: List[Any] = [_QUERY_CACHE.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        model = _lazy_load_model()
+        if model is None:
+            return None
+        # Las variaciones de todas las queries pendientes van en un solo encode.
+        variants = [_query_variants(queries[i]) for i in missing]
+        starts = np.cumsum([0] + [len(v) for v in variants[:-1]])
+        with stage("encode"):
+            flat = model.encode([t for v in variants for t in v], normalize_embeddings=True)
+        flat = np.asarray(flat, dtype=np.float32)
+        counts = np.array([len(v) for v in variants], dtype=np.float32)
+        means = np.add.reduceat(flat, starts, axis=0) / counts[:, None]
+        means /= np.linalg.norm(means, axis=1, keepdims=True)  # Re-normalizar después del promedio
+        for i, q_vec in zip(missing, means):
+            q_vec = q_vec.copy()
+            q_vec.flags.writeable = False  # compartido entre requests vía cache
+            _QUERY_CACHE.set(keys[i], q_vec)
+            vecs[i] = q_vec
+    return np.stack(vecs)
+
+
+def _encode_query(query: str):
+    q_mat = _encode_queries([query])
+    return None if q_mat is None else q_mat[0]
+
+
+def cache_stats() -> Dict[str, Any]:
+    stats = {"query_embeddings": _QUERY_CACHE.stats(), "results": _RESULT_CACHE.stats()}
+    if _BATCHER is not None and _BATCHER_PID == os.getpid():
+        stats["microbatch"] = _BATCHER.stats()
+    if _ENCODE_POOL is not None and _ENCODE_POOL_PID == os.getpid():
+        stats["encode_pool"] = _ENCODE_POOL.stats()
+    return stats
+
+
+def _score_rows(snap: IndexSnapshot, q_vec, cand=None):
+    """Similitud exacta de ``q_vec`` contra ``cand`` (o todas las filas si es None).
+
+    Devuelve ``(filas, sims)``; ``filas`` es None cuando ``sims`` cubre toda
+    la matriz. Con almacenamiento cuantizado se preselecciona sobre la matriz
+    compacta y sólo los ``RESCORE_K`` mejores se re-puntúan en float32.
+    """
+    if snap.quant is None:
+        if cand is None:
+            return None, snap.matrix @ q_vec
+        return cand, snap.matrix[cand] @ q_vec
+    from quantization import RESCORE_K
+    approx = snap.quant.scores(q_vec, cand)
+    if approx.shape[0] > RESCORE_K:
+        top = np.argpartition(-approx, RESCORE_K - 1)[:RESCORE_K]
     else:
-        q_vec = q_vecs[0]
-    
-    # Calcular similitudes
-    sims = (_MATRIX @ q_vec).tolist()
-    
-    scored = []
-    seen_texts = set()  # Para deduplicación
-    
-    for chunk, score in zip(_CHUNKS, sims):
-        if score < MIN_SCORE:
-            continue
-        
-        # Deduplicación: si el texto es muy similar a uno ya agregado, saltar
-        text_sig = chunk.text[:100]  # Firma del texto (primeros 100 chars)
-        if text_sig in seen_texts:
-            continue
-        seen_texts.add(text_sig)
-        
-        # Score boosting por longitud (chunks más largos son más informativos)
-        length_boost = min(len(chunk.text) / 400, 1.1)  # Boost hasta 10%
-        adjusted_score = score * length_boost
-        
-        scored.append({
-            "score": float(adjusted_score),
-            "original_score": float(score),
-            "doc": chunk.doc,
-            "page": chunk.page,
-            "text": chunk.text,
-        })
-    
-    scored.sort(key=lambda x: x["score"], reverse=True)
-    
-    # Retornar top_k * 1.5 y filtrar después (permite mejor diversidad)
-    extended_top_k = min(int(top_k * 1.5), len(scored))
-    results = scored[:extended_top_k]
-    
-    # Diversificación: asegurar que haya resultados de diferentes documentos
-    docs_seen = set()
-    diverse_results = []
-    other_results = []
-    
-    for r in results:
-        if r["doc"] not in docs_seen or len(docs_seen) >= 3:  # Max 3 docs diferentes
-            diverse_results.append(r)
-            docs_seen.add(r["doc"])
+        top = np.arange(approx.shape[0])
+    rows = top if cand is None else cand[top]
+    rows = np.sort(rows)  # lectura ordenada sobre el mmap
+    return rows, np.asarray(snap.matrix[rows], dtype=np.float32) @ q_vec
+
+
+def _rank_rows(sims, top_k: int, sig_ids=None, min_score: Optional[float] = None, order=None):
+    """Devuelve los índices de fila del top-k ordenados por score descendente.
+
+    Todo el trabajo es vectorizado: máscara booleana para el umbral,
+    ``argpartition`` para acotar candidatos y ``np.unique`` sobre los ids
+    de firma para quedarse con la primera aparición de cada duplicado.
+    ``order`` (mismo largo que ``sims``) define el orden si no es el score;
+    el umbral siempre se aplica sobre ``sims``.
+    """
+    min_score = MIN_SCORE if min_score is None else min_score
+    cand = np.flatnonzero(sims >= min_score)
+    key = sims if order is None else order
+    if cand.size == 0 or top_k <= 0:
+        return cand[:0]
+    width = top_k if sig_ids is None else top_k * DEDUP_OVERSAMPLE
+    while True:
+        if cand.size > width:
+            part = np.argpartition(-key[cand], width - 1)[:width]
+            pool = cand[part]
         else:
-            other_results.append(r)
-    
-    # Combinar: primero diversidad, luego por score
-    final_results = diverse_results + other_results
-    
-    return final_results[:top_k]
+            pool = cand
+        pool = pool[np.argsort(-key[pool], kind="stable")]
+        if sig_ids is None:
+            return pool[:top_k]
+        _, first = np.unique(sig_ids[pool], return_index=True)
+        keep = pool[np.sort(first)]
+        # Si los duplicados dejaron menos de top_k y quedan candidatos, ampliar.
+        if keep.size >= top_k or pool.size == cand.size:
+            return keep[:top_k]
+        width *= 2
+
+
+def _result(snap: IndexSnapshot, row: int, score: float) -> Dict[str, Any]:
+    chunk = snap.chunks[row]
+    return {
+        "score": score,
+        "doc": chunk.doc,
+        "page": chunk.page,
+        "text": chunk.text,
+    }
 
 
 def _search_azure(query: str) -> List[Dict[str, Any]]:  # pragma: no cover
@@ -240,10 +1110,72 @@ def _search_azure(query: str) -> List[Dict[str, Any]]:  # pragma: no cover
     return []
 
 
-def search(query: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+def search(query: str, top_k: Optional[int] = None, **options: Any) -> List[Dict[str, Any]]:
+    """Busca los chunks más similares a ``query``.
+
+    Opciones (ver ``SearchOptions``): ``nprobe`` ajusta recall/latencia del
+    índice ANN (si existe), ``exact=True`` fuerza la búsqueda exacta sobre
+    toda la matriz, ``mode`` elige 'dense', 'hybrid' (denso + BM25 con RRF)
+    o 'lexical' (sólo BM25, sin modelo) y ``rerank=True`` reordena los
+    candidatos con un cross-encoder dentro de ``rerank_budget_ms``.
+    ``filters`` (``SearchFilters`` o dict con ``docs``, ``pages``, ``chapters``)
+    limita la búsqueda a esas filas: sólo se puntúa la submatriz seleccionada.
+    ``mmr_lambda`` diversifica el top-k con MMR (modos 'dense' e 'hybrid').
+    ``collection`` busca en otra colección (``RAG_COLLECTIONS_DIR/<nombre>/index``);
+    lanza ``UnknownCollection`` si no tiene índice.
+    """
     if BACKEND_KIND == "azure":
         return _search_azure(query)
-    return _search_local(query, top_k)
+    opts = _make_options(top_k, **options)
+    if MICROBATCH_MS > 0:
+        # Se agrupa con otras búsquedas concurrentes que compartan parámetros.
+        # Las etapas del lote corren en el thread del batcher: aquí se mide espera + lote.
+        with stage("microbatch"):
+            fut = _get_batcher().submit(opts, query)
+            try:
+                return fut.result(timeout=INFER_TIMEOUT)
+            except TimeoutError:
+                fut.cancel()
+                raise
+    return _search_local(query, opts)
+
+
+def submit_search(query: str, top_k: Optional[int] = None, **options: Any):
+    """Encola ``query`` en el micro-batcher y devuelve su ``Future``; None si no hay micro-batching.
+
+    Para llamadores asíncronos: no ocupan un thread mientras esperan el lote,
+    así el tamaño del lote no queda acotado por la concurrencia del executor.
+    Lanza ``ValueError`` si las opciones son inválidas y ``QueueFull`` si
+    hay ``RAG_MICROBATCH_QUEUE`` búsquedas esperando.
+    """
+    if MICROBATCH_MS <= 0 or BACKEND_KIND == "azure":
+        return None
+    return _get_batcher().submit(_make_options(top_k, **options), query)
+
+
+def _get_batcher():
+    """MicroBatcher del proceso; el thread se crea en cada worker, tras el fork."""
+    global _BATCHER, _BATCHER_PID
+    if _BATCHER is None or _BATCHER_PID != os.getpid():
+        with _EMBED_LOCK:
+            if _BATCHER is None or _BATCHER_PID != os.getpid():
+                from batching import MicroBatcher
+                _BATCHER = MicroBatcher(
+                    lambda opts, queries: _search_reranked(queries, opts),
+                    window_ms=MICROBATCH_MS,
+                    max_batch=MICROBATCH_MAX,
+                    max_queue=MICROBATCH_QUEUE,
+                )
+                _BATCHER_PID = os.getpid()
+    return _BATCHER
+
+
+def search_batch(queries: Sequence[str], top_k: Optional[int] = None,
+                 **options: Any) -> List[List[Dict[str, Any]]]:
+    """Como ``search`` para N queries: un solo ``encode`` y una GEMM sobre la matriz."""
+    if BACKEND_KIND == "azure":
+        return [_search_azure(q) for q in queries]
+    return _search_reranked(list(queries), _make_options(top_k, **options))
 
 
 def format_context(chunks: List[Dict[str, Any]]) -> str:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del servicio son planos (``import retrieval``), como en la imagen.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,17 @@
+import unittest
+
+
+class TestAnn(unittest.TestCase):
+    def test_ivf_full_probe_matches_exact_search(self):
+        import numpy as np
+        from ann import build_ivf, recall_report
+
+        rng = np.random.default_rng(1)
+        matrix = rng.normal(size=(500, 16)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = build_ivf(matrix, nlist=8)
+        self.assertEqual(sorted(index.list_rows.tolist()), list(range(500)))
+
+        report = recall_report(matrix, index, matrix[:20], k=5, nprobes=(2, 8))
+        self.assertEqual(report[-1]["nprobe"], 8)
+        self.assertAlmostEqual(report[-1]["recall"], 1.0)
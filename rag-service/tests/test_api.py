@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import Mock, patch
+
+from fastapi.testclient import TestClient
+
+import main
+from limiter import QueueFull
+
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        # Sin ``with``: no corre el lifespan, así que no se carga modelo ni índice.
+        self.client = TestClient(main.app)
+
+    def test_health_reports_index_and_executor(self):
+        r = self.client.get('/health')
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        self.assertIn('version', body['index'])
+        self.assertIn('query_embeddings', body['cache'])
+
+    @patch('retrieval.search_batch')
+    def test_search_batch_returns_one_response_per_query(self, mock_batch):
+        mock_batch.return_value = [[{'doc': 'Capitulo2.pdf', 'page': 1, 'score': 0.8, 'text': 'x'}], []]
+        r = self.client.post('/search/batch', json={'queries': ['Bloom', 'IAGen'], 'top_k': 3})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([item['query'] for item in r.json()['results']], ['Bloom', 'IAGen'])
+        self.assertEqual(mock_batch.call_args[1]['top_k'], 3)
+
+    def test_search_returns_429_when_inference_queue_is_full(self):
+        executor = Mock()
+        executor.submit.side_effect = QueueFull()
+        with patch('main.get_executor', return_value=executor):
+            r = self.client.post('/search', json={'query': 'Bloom'})
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(r.headers['Retry-After'], '1')
+
+    def test_search_rejects_invalid_mode_and_filters(self):
+        r = self.client.post('/search', json={'query': 'Bloom', 'mode': 'sparse'})
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post('/search', json={'query': 'Bloom', 'filters': {'pages': [[5, 1]]}})
+        self.assertEqual(r.status_code, 400)
+        for bad in ({'mmr_lambda': 1.5}, {'collection': '../etc'}):
+            r = self.client.post('/search', json={'query': 'Bloom', **bad})
+            self.assertEqual(r.status_code, 400, bad)
+
+    def test_validation_400_is_scoped_to_search_endpoints(self):
+        self.assertEqual(self.client.post('/search/batch', json={'queries': []}).status_code, 400)
+        self.assertEqual(self.client.post('/embed', json={'texts': []}).status_code, 422)
+
+    @patch('main.RAG_ADMIN_TOKEN', 'secreto')
+    @patch('retrieval.reload_index', return_value=True)
+    def test_index_reload_requires_admin(self, mock_reload):
+        r = self.client.post('/index/reload')
+        self.assertEqual(r.status_code, 403)
+        r = self.client.post('/index/reload', headers={'X-RAG-Admin-Token': 'secreto'})
+        self.assertEqual(r.status_code, 202)
+        mock_reload.assert_called_once_with(collection=None)
+        self.assertEqual(r.json()['propagation']['scope'], 'all_workers')
+
+    @patch('retrieval.search', return_value=[])
+    def test_search_coerces_numeric_strings_and_rejects_out_of_range(self, mock_search):
+        r = self.client.post('/search', json={'query': 'Bloom', 'top_k': '3', 'nprobe': '4'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((mock_search.call_args[1]['top_k'], mock_search.call_args[1]['nprobe']), (3, 4))
+        for bad in ({'top_k': 0}, {'top_k': 'muchos'}, {'top_k': 2.5}, {'nprobe': -1},
+                    {'rerank_budget_ms': -5}, {'rerank_budget_ms': 1e9}):
+            r = self.client.post('/search', json={'query': 'Bloom', **bad})
+            self.assertEqual(r.status_code, 400, bad)
+            self.assertEqual(r.json()['detail'][0]['loc'][-1], next(iter(bad)))
+        mock_search.assert_called_once()
+
+    @patch('retrieval.search', return_value=[])
+    def test_search_wraps_single_doc_filter_and_rejects_objects(self, mock_search):
+        r = self.client.post('/search', json={'query': 'Bloom', 'filters': {'docs': 'Capitulo3.pdf'}})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(mock_search.call_args[1]['filters'].docs, ('Capitulo3.pdf',))
+        r = self.client.post('/search', json={'query': 'Bloom', 'filters': {'docs': {'a': 1}}})
+        self.assertEqual(r.status_code, 400)
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestBatching(unittest.TestCase):
+    def test_microbatcher_coalesces_concurrent_requests(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from batching import MicroBatcher
+
+        calls = []
+
+        def fn(group, items):
+            calls.append((group, list(items)))
+            return [f"{group}:{item}" for item in items]
+
+        batcher = MicroBatcher(fn, window_ms=50, max_batch=8)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(lambda i=i: batcher.submit("k5", i).result(timeout=5)) for i in range(4)]
+            self.assertEqual(sorted(f.result() for f in futures), ["k5:0", "k5:1", "k5:2", "k5:3"])
+        stats = batcher.stats()
+        self.assertEqual(stats["items"], 4)
+        self.assertLess(stats["batches"], 4)
+
+    def test_length_buckets_respect_token_budget_and_restore_order(self):
+        import numpy as np
+        import retrieval
+        from batching import length_buckets
+
+        lengths = [50, 5, 300, 6, 48, 7]
+        buckets = length_buckets(lengths, token_budget=120, max_batch=8)
+        self.assertEqual(buckets, [[1, 3, 5], [4, 0], [2]])
+        self.assertEqual(length_buckets(lengths, token_budget=10_000, max_batch=2), [[1, 3], [5, 4], [0, 2]])
+
+        model = Mock(spec=["max_seq_length"], max_seq_length=512)
+        texts = ["x" * (4 * n) for n in lengths]
+        encode = Mock(side_effect=lambda batch, size: np.array([[len(t), size] for t in batch], dtype=np.float32))
+        out = retrieval._encode_bucketed(model, texts, encode, token_budget=120, max_batch=8)
+        self.assertEqual(out[:, 0].tolist(), [len(t) for t in texts])
+        self.assertEqual(encode.call_count, 3)
+
+    def test_default_token_budget_follows_the_encode_device(self):
+        import retrieval
+
+        with patch.object(retrieval, "EMBED_TOKEN_BUDGET", None), patch.object(retrieval, "USE_GPU", True):
+            self.assertEqual(retrieval._token_budget(cuda=False), retrieval.CPU_TOKEN_BUDGET)
+            self.assertEqual(retrieval._token_budget(cuda=True), retrieval.GPU_TOKEN_BUDGET)
+        with patch.object(retrieval, "EMBED_TOKEN_BUDGET", 512):
+            self.assertEqual(retrieval._token_budget(cuda=True), 512)
+
+    def test_concurrent_searches_beyond_executor_concurrency_share_one_encode(self):
+        import asyncio
+        import json
+        import numpy as np
+        from starlette.requests import Request
+        import main
+        import retrieval
+        from cache import TTLCache
+        from limiter import BoundedExecutor
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        matrix = np.eye(4, dtype=np.float32)
+        chunks = [ChunkMeta(doc="Capitulo2.pdf", page=i, text=f"texto {i}", vector_index=i) for i in range(4)]
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(4), version="v1")
+        encode = Mock(side_effect=lambda qs: matrix[[i % 4 for i in range(len(qs))]])
+
+        async def burst(n):
+            requests = [main.SearchRequest(query=f"pregunta {i}", top_k=2) for i in range(n)]
+            http = Request({"type": "http", "headers": []})
+            return await asyncio.gather(*(main.search_documents(r, http) for r in requests))
+
+        executor = BoundedExecutor(max_workers=2, max_queue=0)
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60), _BATCHER=None,
+                            _encode_queries=encode, ensure_ready=Mock(), MICROBATCH_MS=200.0), \
+                patch.object(main, "get_executor", return_value=executor):
+            responses = asyncio.run(burst(8))
+            stats = retrieval._get_batcher().stats()
+        self.assertEqual([json.loads(r.body)["query"] for r in responses], [f"pregunta {i}" for i in range(8)])
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(len(encode.call_args[0][0]), 8)
+        self.assertEqual((stats["batches"], stats["items"]), (1, 8))
+        self.assertEqual(executor.stats()["completed"], 0)
@@ -0,0 +1,42 @@
+import unittest
+
+
+class TestBench(unittest.TestCase):
+    def test_bench_reports_latency_and_recall_per_mode(self):
+        import numpy as np
+        import bench, retrieval
+        from ann import sample_queries
+
+        matrix = bench.synthetic_corpus(600, dim=32, seed=3)
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_array_equal(matrix, bench.synthetic_corpus(600, dim=32, seed=3))
+        queries = sample_queries(matrix, 20, seed=4)
+        truth = bench.exact_top_k(matrix, queries, 5)
+        self.assertEqual(truth[0, 0], int(np.argmax(matrix @ queries[0])))
+
+        snapshot_before = retrieval._SNAPSHOT
+        brute = bench.run_mode(matrix, queries, "brute", k=5, truth=truth)
+        ann = bench.run_mode(matrix, queries, "ann", k=5, nprobe=1, truth=truth)
+        self.assertIs(retrieval._SNAPSHOT, snapshot_before)
+        self.assertEqual(brute["recall_at_k"], 1.0)
+        self.assertLessEqual(ann["recall_at_k"], 1.0)
+        self.assertLessEqual(brute["p50_ms"], brute["p99_ms"])
+
+        previous = {"results": [dict(brute, qps=brute["qps"] / 2)]}
+        diff = bench.compare({"results": [brute, ann]}, previous)
+        self.assertEqual([(d["mode"], d["qps_pct"]) for d in diff], [("brute", 100.0)])
+
+    def test_http_bench_measures_a_running_service(self):
+        from unittest.mock import patch
+        from fastapi.testclient import TestClient
+        import bench, main
+
+        results = [{"doc": "Capitulo2.pdf", "page": 1, "score": 0.8, "text": "x"}]
+        with patch("retrieval.search", return_value=results) as search:
+            row = bench.run_http(TestClient(main.app), n_queries=6, k=3, warmup=2)
+        self.assertEqual(search.call_count, 8)
+        self.assertEqual(len({c.args[0] for c in search.call_args_list}), 8)  # sin hits del cache de resultados
+        self.assertEqual((row["mode"], row["concurrency"]), ("http", 1))
+        self.assertLessEqual(row["p50_ms"], row["p99_ms"])
+        self.assertIn("server_p50_ms", row)
+        self.assertEqual(bench._server_total_ms("score;dur=1.50, total;dur=4.25"), 4.25)
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestCaches(unittest.TestCase):
+    def test_query_embedding_cache_hits_skip_encode(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+
+        model = Mock()
+        model.encode.return_value = np.ones((1, 4), dtype=np.float32)
+        with patch.object(retrieval, '_QUERY_CACHE', TTLCache(8, 60)), \
+                patch.object(retrieval, '_lazy_load_model', return_value=model):
+            retrieval._encode_query("¿Qué es la  alfabetización digital?")
+            retrieval._encode_query("¿qué es la alfabetización digital? ")
+            self.assertEqual(model.encode.call_count, 1)
+            stats = retrieval.cache_stats()["query_embeddings"]
+            self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_query_variants_are_encoded_in_one_call(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from embedders import HashingEmbedder
+
+        embedder = HashingEmbedder(dim=32)
+        model = Mock(wraps=embedder)
+        queries = ["¿Qué es la taxonomía de Bloom?", "IAGen", "¿Cómo evaluar con rúbricas analíticas?"]
+        with patch.object(retrieval, '_QUERY_CACHE', TTLCache(8, 60)), \
+                patch.object(retrieval, '_lazy_load_model', return_value=model):
+            out = retrieval._encode_queries(queries)
+        self.assertEqual(model.encode.call_count, 1)
+        self.assertEqual(len(model.encode.call_args[0][0]), 5)  # 2 + 1 + 2 variaciones
+        for q, vec in zip(queries, out):
+            expected = embedder.encode(retrieval._query_variants(q), normalize_embeddings=True).mean(axis=0)
+            np.testing.assert_allclose(vec, expected / np.linalg.norm(expected), rtol=1e-5, atol=1e-6)
+
+    def test_result_cache_keyed_on_index_version(self):
+        from dataclasses import replace
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        matrix = np.eye(3, dtype=np.float32)
+        chunks = [ChunkMeta(doc="Capitulo2.pdf", page=i, text=f"texto {i}", vector_index=i) for i in range(3)]
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(3), version="v1")
+        encode = Mock(side_effect=lambda qs: matrix[[1] * len(qs)])
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60),
+                            _encode_queries=encode, ensure_ready=Mock()):
+            first = retrieval.search("Bloom", top_k=2)
+            self.assertEqual(retrieval.search("bloom ", top_k=2), first)
+            self.assertEqual(encode.call_count, 1)
+            self.assertEqual(first[0]["page"], 1)
+
+            retrieval._install(replace(snapshot, version="v2"))
+            retrieval.search("Bloom", top_k=2)
+            self.assertEqual(encode.call_count, 2)
+
+            batch = retrieval.search_batch(["Bloom", "IAGen", "Capítulo 4"], top_k=2)
+            self.assertEqual(len(batch), 3)
+            self.assertEqual(batch[0], first)
+            self.assertEqual(encode.call_count, 3)
+            self.assertEqual(encode.call_args[0][0], ["IAGen", "Capítulo 4"])
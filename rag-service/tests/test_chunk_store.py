@@ -0,0 +1,30 @@
+import unittest
+from unittest.mock import Mock
+
+
+class TestChunkStore(unittest.TestCase):
+    def test_embedding_store_reuses_vectors_by_content(self):
+        import tempfile
+        import numpy as np
+        from chunk_store import EmbeddingStore
+
+        def fake_embed(texts):
+            return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+        encode = Mock(side_effect=fake_embed)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EmbeddingStore(tmp, "modelo-prueba")
+            store.embed(["Capítulo 2: Bloom", "IAGen en el aula"], encode)
+            store.documents = {"Capitulo2.pdf": {"fingerprint": "x", "chunks": [{"page": 1, "text": "IAGen en el aula"}]}}
+            store.save()
+
+            store = EmbeddingStore(tmp, "modelo-prueba")
+            vectors = store.embed(["IAGen  en el aula", "Evaluación auténtica"], encode)
+            self.assertEqual(encode.call_args[0][0], ["Evaluación auténtica"])
+            self.assertEqual(store.last_stats, {"reused": 1, "embedded": 1})
+            self.assertEqual(vectors[:, 0].tolist(), [16.0, 20.0])
+            self.assertEqual(store.prune(), 2)
+            self.assertEqual(len(store), 1)
+
+            EmbeddingStore(tmp, "otro-modelo").embed(["IAGen en el aula"], encode)
+            self.assertEqual(encode.call_count, 3)
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestCollections(unittest.TestCase):
+    def test_collections_load_lazily_and_evict_lru(self):
+        import os
+        import tempfile
+        import numpy as np
+        from collections import OrderedDict
+        import retrieval
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        def fake_load(directory):
+            name = os.path.basename(os.path.dirname(directory))
+            matrix = np.full((256, 1024), 1.0 / 32, dtype=np.float32)  # 1 MB
+            chunks = [ChunkMeta(doc=f"{name}.pdf", page=i, text="x", vector_index=i) for i in range(256)]
+            return IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(256), version=name)
+
+        load = Mock(side_effect=fake_load)
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("a", "b", "c"):
+                os.makedirs(os.path.join(tmp, name, "index"))
+                open(os.path.join(tmp, name, "index", "manifest.json"), "w").close()
+            with patch.multiple(retrieval, COLLECTIONS_DIR=tmp, COLLECTIONS_MEMORY_MB=2.5, _SNAPSHOT=None,
+                                _COLLECTIONS=OrderedDict(), _COLLECTION_CHECKED_AT={}, _load_index_dir=load):
+                self.assertEqual(retrieval._snapshot_for("a").version, "a")
+                retrieval._snapshot_for("b")
+                retrieval._snapshot_for("a")  # "b" pasa a ser la menos usada
+                self.assertEqual(load.call_count, 2)
+                retrieval._snapshot_for("c")
+                self.assertEqual(list(retrieval._COLLECTIONS), ["a", "c"])
+                status = retrieval.collections_status()
+                self.assertEqual(status["available"], ["a", "b", "c"])
+                with self.assertRaises(retrieval.UnknownCollection):
+                    retrieval._snapshot_for("nada")
+                with self.assertRaises(ValueError):
+                    retrieval.SearchOptions(top_k=3, collection="../a")
+
+    def test_collection_is_replaced_when_its_disk_version_changes(self):
+        import tempfile
+        import numpy as np
+        from collections import OrderedDict
+        import retrieval
+        from index_store import write_index
+
+        docs = [{"doc": "Capitulo2.pdf", "page": 1, "text": "Bloom"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = f"{tmp}/cursos/index"
+            first = write_index(directory, np.ones((1, 4)), docs, "modelo-prueba")
+            with patch.multiple(retrieval, COLLECTIONS_DIR=tmp, _SNAPSHOT=None, _COLLECTIONS=OrderedDict(),
+                                _COLLECTION_CHECKED_AT={}, INDEX_CHECK_SECONDS=60.0), \
+                    patch("retrieval.time.monotonic", side_effect=[100.0, 110.0, 200.0, 200.0]):
+                self.assertEqual(retrieval._snapshot_for("cursos").version, first["checksum"])
+                # Otro worker (o una ingesta) publica una versión nueva de la colección.
+                second = write_index(directory, np.full((1, 4), 2.0), docs, "modelo-prueba")
+                self.assertEqual(retrieval._snapshot_for("cursos").version, first["checksum"])  # dentro del intervalo
+                self.assertEqual(retrieval._snapshot_for("cursos").version, second["checksum"])
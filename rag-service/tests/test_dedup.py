@@ -0,0 +1,31 @@
+import unittest
+from unittest.mock import patch
+
+
+class TestDedup(unittest.TestCase):
+    def test_simhash_clusters_near_duplicates(self):
+        from dedup import near_duplicate_clusters, simhash
+
+        base = ("La alfabetización digital en la universidad requiere que los docentes diseñen actividades "
+                "con inteligencia artificial generativa, evalúen críticamente sus resultados y promuevan "
+                "un uso ético y responsable de estas herramientas en cada etapa del proceso formativo. "
+                "Este capítulo propone una ruta de trabajo para incorporar la IAGen en la planificación "
+                "de cursos, considerando la taxonomía de Bloom y la evaluación auténtica. Página 12")
+        texts = [
+            base,
+            "Taxonomía de Bloom aplicada a la evaluación de aprendizajes con IAGen.",
+            base.replace("Página 12", "Página 13"),
+            "  " + base.upper() + "  ",
+            "Taxonomía de Bloom aplicada al diseño de rúbricas en cursos de ingeniería.",
+        ]
+        self.assertLessEqual((simhash(texts[0]) ^ simhash(texts[2])).bit_count(), 3)
+        self.assertEqual(near_duplicate_clusters(texts).tolist(), [0, 1, 0, 0, 4])
+        self.assertEqual(near_duplicate_clusters(texts, max_distance=0).tolist(), [0, 1, 2, 0, 4])
+
+    def test_clusters_do_not_chain_through_intermediate_chunks(self):
+        import dedup
+
+        # A~B y B~C a 3 bits, pero A y C a 6: C no debe heredar el cluster de A.
+        fake = {"A": 0, "B": 0b111, "C": 0b111111, "D": 0b1}
+        with patch.object(dedup, "simhash", side_effect=fake.__getitem__):
+            self.assertEqual(dedup.near_duplicate_clusters(["A", "B", "C", "D"], max_distance=3).tolist(), [0, 0, 2, 0])
@@ -0,0 +1,124 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestEmbedders(unittest.TestCase):
+    def test_onnx_embedder_pools_batches_and_keeps_order(self):
+        import numpy as np
+        from onnx_embedder import OnnxEmbedder, cosine_agreement
+
+        def tokenizer(texts, **kwargs):
+            width = max(len(t.split()) for t in texts)
+            ids = np.array([[len(w) for w in t.split()] + [0] * (width - len(t.split())) for t in texts])
+            return {"input_ids": ids, "attention_mask": (ids > 0).astype(np.int64)}
+
+        session = Mock()
+        session.get_inputs.return_value = [Mock(), Mock()]
+        session.get_inputs.return_value[0].name = "input_ids"
+        session.get_inputs.return_value[1].name = "attention_mask"
+        # hidden = (id, 1) por token: mean pooling da (largo medio de palabra, 1)
+        def run(_, feeds):
+            ids = feeds["input_ids"]
+            return [np.stack([ids, np.ones_like(ids)], axis=-1).astype(np.float32)]
+
+        session.run.side_effect = run
+
+        texts = ["ab", "abcd ef gh", "a bcd"]
+        embedder = OnnxEmbedder(session, tokenizer, pooling="mean")
+        out = embedder.encode(texts, batch_size=2)
+        self.assertEqual(session.run.call_count, 2)
+        np.testing.assert_allclose(out[:, 0], [2.0, 8 / 3, 2.0], rtol=1e-6)
+        last = OnnxEmbedder(session, tokenizer, pooling="lasttoken").encode(texts)
+        self.assertEqual(last[:, 0].tolist(), [2.0, 2.0, 3.0])
+        normalized = embedder.encode("abcd ef gh", normalize_embeddings=True)
+        self.assertAlmostEqual(float(np.linalg.norm(normalized)), 1.0, places=5)
+        report = cosine_agreement(out, out * 3)
+        self.assertAlmostEqual(report["min"], 1.0, places=5)
+        self.assertEqual(embedder.encode([]).shape, (0, 2))  # la dimensión sale de un encode de prueba
+        self.assertEqual(OnnxEmbedder(session, tokenizer, dim=2).encode([]).shape, (0, 2))
+
+    def test_onnx_export_matches_pytorch(self):
+        import importlib.util
+        import os
+        import onnx_embedder
+
+        config = onnx_embedder.read_config()
+        if config is None or importlib.util.find_spec("onnxruntime") is None \
+                or importlib.util.find_spec("sentence_transformers") is None:
+            self.skipTest(f"sin modelo ONNX exportado en {onnx_embedder.ONNX_DIR} o sin onnxruntime")
+        from sentence_transformers import SentenceTransformer
+
+        texts = onnx_embedder._MUESTRA
+        reference = SentenceTransformer(config["model"], device="cpu", trust_remote_code=True).encode(
+            texts, normalize_embeddings=True)
+        int8 = os.path.exists(os.path.join(onnx_embedder.ONNX_DIR, "model.int8.onnx"))
+        for quantized in (False, True) if int8 else (False,):
+            candidate = onnx_embedder.load_embedder(quantized=quantized).encode(texts, normalize_embeddings=True)
+            self.assertEqual(candidate.shape, reference.shape)
+            self.assertGreaterEqual(onnx_embedder.cosine_agreement(reference, candidate)["min"], 0.99)
+
+    def test_hashing_embedder_is_deterministic_and_normalized(self):
+        import numpy as np
+        import retrieval
+        from embedders import Embedder, HashingEmbedder
+
+        embedder = HashingEmbedder(dim=64)
+        self.assertIsInstance(embedder, Embedder)
+        self.assertEqual((embedder.name, embedder.dimension), ("hashing-64", 64))
+        texts = ["Evaluación formativa en matemáticas", "evaluacion formativa", "Taxonomía de Bloom", "de la"]
+        out = embedder.encode(texts, normalize_embeddings=True)
+        self.assertEqual(out.shape, (4, 64))
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(out, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_array_equal(out, HashingEmbedder(dim=64).encode(texts, normalize_embeddings=True))
+        np.testing.assert_array_equal(embedder.encode(texts[1], normalize_embeddings=True), out[1])
+        self.assertGreater(out[0] @ out[1], out[0] @ out[2])
+        self.assertEqual(embedder.encode([]).shape, (0, 64))
+
+        with patch.object(retrieval, "_lazy_load_model", return_value=embedder):
+            embedded = retrieval.embed_texts(texts)
+        np.testing.assert_allclose(embedded, out, rtol=1e-6)
+
+    def test_service_reports_the_loaded_embedder_through_the_interface(self):
+        import numpy as np
+        from fastapi.testclient import TestClient
+        import main
+        import retrieval
+        from embedders import HashingEmbedder
+
+        client = TestClient(main.app)
+        with patch.object(retrieval, "_EMBED_MODEL", None):
+            self.assertEqual(client.get("/health").json()["embedder"]["loaded"], False)
+        embedder = HashingEmbedder(dim=64)
+        with patch.object(retrieval, "_EMBED_MODEL", embedder), patch.object(retrieval, "EMBED_BACKEND", "hashing"), \
+                patch.object(retrieval, "embed_texts", side_effect=lambda texts: embedder.encode(texts)):
+            health = client.get("/health").json()
+            body = client.post("/embed", json={"texts": ["Bloom"]}).json()
+        self.assertEqual(health["embedder"], {"backend": "hashing", "loaded": True, "name": "hashing-64", "dimension": 64})
+        self.assertEqual(health["model_name"], "hashing-64")
+        self.assertEqual((body["model"], body["dimensions"]), ("hashing-64", 64))
+        self.assertEqual(np.asarray(body["embeddings"]).shape, (1, 64))
+
+    def test_onnx_int8_signs_index_store_and_caches_with_its_own_name(self):
+        import os
+        import subprocess
+        import sys
+        import tempfile
+        import onnx_embedder
+
+        service = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        names = {}
+        for quantized in ("1", "0"):
+            env = dict(os.environ, RAG_EMBED_BACKEND="onnx", RAG_ONNX_QUANTIZED=quantized,
+                       RAG_MODEL_SENTENCE="BAAI/bge-large-en-v1.5")
+            # DEFAULT_MODEL se fija al importar retrieval: un intérprete nuevo por configuración.
+            names[quantized] = subprocess.run(
+                [sys.executable, "-c", "import retrieval; print(retrieval.DEFAULT_MODEL)"],
+                cwd=service, env=env, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        self.assertEqual(names, {"1": "BAAI/bge-large-en-v1.5+onnx-int8", "0": "BAAI/bge-large-en-v1.5"})
+        with tempfile.TemporaryDirectory() as tmp:
+            open(os.path.join(tmp, "model.onnx"), "w").close()
+            self.assertEqual(onnx_embedder._model_path(tmp, quantized=False), os.path.join(tmp, "model.onnx"))
+            with self.assertRaises(FileNotFoundError):
+                onnx_embedder._model_path(tmp, quantized=True)  # no se sirve float32 con el nombre int8
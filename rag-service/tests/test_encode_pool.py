@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+
+
+class TestEncodePool(unittest.TestCase):
+    def test_encode_pool_shards_by_length_and_fills_shared_buffer(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        import numpy as np
+        import retrieval
+        from batching import shard_rows
+        from embedders import HashingEmbedder
+        from encode_pool import EncodePool
+
+        lengths = [100, 10, 90, 20, 80, 30]
+        shards = shard_rows(lengths, 2)
+        self.assertEqual(sorted(i for s in shards for i in s), list(range(6)))
+        self.assertEqual([sum(lengths[i] for i in s) for s in shards], [160, 170])
+        self.assertEqual(shard_rows([5, 5], 8), [[0], [1]])
+
+        embedder = HashingEmbedder(dim=32)
+        texts = [f"capítulo {i} " + "evaluación " * (i % 7) for i in range(50)]
+        with ThreadPoolExecutor(max_workers=3) as executor, \
+                patch.object(retrieval, "_lazy_load_model", return_value=embedder):
+            pool = EncodePool(3, threads=1, shard_rows_max=8, executor=executor)
+            out = pool.encode(texts)
+            self.assertEqual(pool.encode([]).shape, (0, 32))
+        np.testing.assert_allclose(out, embedder.encode(texts, normalize_embeddings=True), rtol=1e-6)
+        stats = pool.stats()
+        self.assertEqual((stats["jobs"], stats["texts"], stats["shards"]), (1, 50, 7))
+
+    def test_one_process_hosts_the_pool_and_others_share_it(self):
+        import os
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+
+        import numpy as np
+        import retrieval
+        from embedders import HashingEmbedder
+        from encode_pool import EncodePool, PoolClient, shared_pool
+
+        embedder = HashingEmbedder(dim=16)
+        texts = [f"evaluación {i} " * (1 + i % 4) for i in range(20)]
+        with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=2) as executor, \
+                patch.object(retrieval, "_lazy_load_model", return_value=embedder):
+            address = os.path.join(tmp, "pool.sock")
+            host = shared_pool(2, address=address, executor=executor)
+            other = shared_pool(2, address=address, executor=executor)  # otro worker: el lock ya está tomado
+            self.assertIsInstance(host, EncodePool)
+            self.assertIsInstance(other, PoolClient)
+            self.assertEqual(os.stat(address + ".key").st_mode & 0o777, 0o600)
+            self.assertEqual(other.dimension, 16)
+            out = other.encode(texts)
+            self.assertEqual(other.encode([]).shape, (0, 16))
+            stats = other.stats()
+            host.shutdown()
+        np.testing.assert_allclose(out, embedder.encode(texts, normalize_embeddings=True), rtol=1e-6)
+        self.assertEqual((stats["jobs"], stats["texts"], stats["host_pid"]), (1, 20, os.getpid()))
+
+    def test_client_in_another_process_leaves_no_tracker_registrations_in_the_host(self):
+        import json
+        import os
+        import subprocess
+        import sys
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from multiprocessing import resource_tracker
+
+        import numpy as np
+        import retrieval
+        from embedders import HashingEmbedder
+        from encode_pool import shared_pool
+
+        embedder = HashingEmbedder(dim=16)
+        texts = [f"evaluación {i} " * (1 + i % 4) for i in range(12)]
+        registered = []
+        register, unregister = resource_tracker.register, resource_tracker.unregister
+
+        def track(name, rtype):
+            registered.append(name)
+            register(name, rtype)
+
+        def untrack(name, rtype):
+            registered.remove(name)
+            unregister(name, rtype)
+
+        service = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        client = ("import sys, json, numpy as np\n"
+                  "from encode_pool import PoolClient\n"
+                  "np.save(sys.argv[2], PoolClient(sys.argv[1]).encode(json.loads(sys.argv[3])))\n")
+        with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=2) as executor, \
+                patch.object(retrieval, "_lazy_load_model", return_value=embedder), \
+                patch.object(resource_tracker, "register", side_effect=track), \
+                patch.object(resource_tracker, "unregister", side_effect=untrack):
+            address = os.path.join(tmp, "pool.sock")
+            host = shared_pool(2, address=address, executor=executor)
+            out_path = os.path.join(tmp, "out.npy")
+            subprocess.run([sys.executable, "-c", client, address, out_path, json.dumps(texts)],
+                           cwd=service, check=True, timeout=60)
+            out = np.load(out_path)
+            host.shutdown()
+        np.testing.assert_allclose(out, embedder.encode(texts, normalize_embeddings=True), rtol=1e-6)
+        self.assertEqual(host.stats()["texts"], len(texts))
+        self.assertEqual(registered, [])  # los segmentos del cliente no quedan en el tracker del host
@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestFilters(unittest.TestCase):
+    def test_filters_select_rows_and_only_score_subset(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from filters import FilterIndex, SearchFilters, chapter_of
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        self.assertEqual(chapter_of("Cápitulo4.pdf"), 4)
+        self.assertIsNone(chapter_of("Etapa_ciclo_alfabetizacion_digital.pdf"))
+        docs = ["Capitulo2.pdf", "Capitulo3.pdf", "Capitulo2.pdf", "Anexo.pdf", "Capitulo3.pdf"]
+        chunks = [ChunkMeta(doc=d, page=i + 1, text=f"texto {i}", vector_index=i) for i, d in enumerate(docs)]
+        index = FilterIndex.from_chunks(chunks)
+        self.assertEqual(index.rows(SearchFilters(chapters=(2,))).tolist(), [0, 2])
+        self.assertEqual(index.rows(SearchFilters(docs=("capitulo3",), pages=((1, 4),))).tolist(), [1])
+        self.assertEqual(index.rows(SearchFilters.from_dict({"pages": ["3-4"]})).tolist(), [2, 3])
+        with self.assertRaises(ValueError):
+            SearchFilters.from_dict({"pages": [[5, 1]]})
+
+        matrix = np.eye(5, dtype=np.float32)
+        encode = Mock(side_effect=lambda qs: matrix[[1] * len(qs)])
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(5), version="v1", filters=index)
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60),
+                            _encode_queries=encode, ensure_ready=Mock(), MIN_SCORE=-1.0):
+            self.assertEqual(retrieval.search("Bloom", top_k=3)[0]["doc"], "Capitulo3.pdf")
+            results = retrieval.search("Bloom", top_k=3, filters={"chapters": [2]})
+            self.assertEqual([r["page"] for r in results], [1, 3])
+            self.assertEqual(retrieval.search("Bloom", top_k=3, filters={"docs": ["Nada.pdf"]}), [])
+
+    def test_single_values_are_not_split_into_characters(self):
+        from filters import SearchFilters
+
+        filters = SearchFilters.from_dict({"docs": "Capitulo3.pdf", "chapters": 2, "pages": "10-12"})
+        self.assertEqual(filters, SearchFilters(docs=("Capitulo3.pdf",), pages=((10, 12),), chapters=(2,)))
+        self.assertEqual(SearchFilters.from_dict({"docs": ["a.pdf", "b.pdf"]}).docs, ("a.pdf", "b.pdf"))
+        for bad in ({"docs": {"nombre": "a.pdf"}}, {"chapters": True}, {"pages": 1.5}):
+            with self.assertRaises(ValueError, msg=bad):
+                SearchFilters.from_dict(bad)
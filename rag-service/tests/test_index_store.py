@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import patch
+
+
+class TestIndexStore(unittest.TestCase):
+    def test_index_dir_round_trip_without_pickle(self):
+        import tempfile
+        import numpy as np
+        from index_store import load_index, verify_checksum, write_index
+
+        rng = np.random.default_rng(3)
+        emb = rng.normal(size=(4, 8)).astype(np.float32)
+        docs = [
+            {"doc": "Capitulo2.pdf", "page": 1, "text": "alfabetización digital"},
+            {"doc": "Capitulo3.pdf", "page": 2, "text": "taxonomía de Bloom"},
+            {"doc": "Capitulo2.pdf", "page": 3, "text": ""},
+            {"doc": "Capitulo3.pdf", "page": 4, "text": "evaluación ñandú"},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = f"{tmp}/index"
+            write_index(directory, emb, docs, "modelo-prueba", storage_mode="int8")
+            index = load_index(directory)
+            self.assertIsInstance(index.matrix, np.memmap)
+            self.assertTrue(np.allclose(index.matrix, emb))
+            self.assertEqual(index.manifest["dim"], 8)
+            self.assertTrue(verify_checksum(directory, index.manifest))
+            self.assertEqual([c.text for c in index.chunks], [d["text"] for d in docs])
+            self.assertEqual(index.chunks[3].doc, "Capitulo3.pdf")
+            self.assertEqual(index.quant.mode, "int8")
+
+    def test_publication_swaps_current_and_keeps_previous_version(self):
+        import os
+        import tempfile
+        import numpy as np
+        from index_store import CURRENT_NAME, has_index, load_index, read_manifest, resolve, write_index
+
+        docs = [{"doc": "Capitulo2.pdf", "page": 1, "text": "Bloom"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = f"{tmp}/index"
+            # Formato anterior: archivos sueltos en el directorio, sin CURRENT.
+            legacy = write_index(f"{tmp}/legado", np.ones((1, 4)), docs, "modelo-prueba")
+            os.rename(resolve(f"{tmp}/legado"), directory)
+            self.assertEqual(read_manifest(directory)["checksum"], legacy["checksum"])
+
+            first = write_index(directory, np.full((1, 4), 2.0), docs, "modelo-prueba")
+            v1 = resolve(directory)
+            self.assertFalse(os.path.exists(os.path.join(directory, "manifest.json")))
+            second = write_index(directory, np.full((1, 4), 3.0), docs, "modelo-prueba")
+            v2 = resolve(directory)
+            self.assertNotEqual(v1, v2)
+            self.assertTrue(os.path.isdir(v1))  # la anterior sigue legible por quien ya la resolvió
+            self.assertEqual(load_index(v1).manifest["checksum"], first["checksum"])
+            self.assertEqual(load_index(directory).manifest["checksum"], second["checksum"])
+
+            write_index(directory, np.full((1, 4), 4.0), docs, "modelo-prueba")
+            self.assertFalse(os.path.exists(v1))
+            self.assertTrue(has_index(directory))
+            self.assertEqual(sorted(e for e in os.listdir(directory) if e != CURRENT_NAME),
+                             sorted([os.path.basename(v2), os.path.basename(resolve(directory))]))
+
+    def test_searches_reload_when_another_process_publishes_a_version(self):
+        import tempfile
+        import numpy as np
+        import retrieval
+        from retrieval import IndexSnapshot
+        from index_store import write_index
+
+        docs = [{"doc": "Capitulo2.pdf", "page": 1, "text": "Bloom"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            first = write_index(tmp, np.ones((1, 4)), docs, "modelo-prueba")
+            loaded = IndexSnapshot(matrix=np.ones((1, 4)), chunks=[], sig_ids=np.zeros(1), version=first["checksum"])
+            with patch.multiple(retrieval, INDEX_DIR=tmp, EMBED_CACHE_PATH=f"{tmp}/no.npz", _SNAPSHOT=loaded,
+                                INDEX_CHECK_SECONDS=60.0, _INDEX_CHECKED_AT=0.0, _ATTEMPTED_VERSION=None), \
+                    patch("retrieval.reload_index") as reload, \
+                    patch("retrieval.time.monotonic", side_effect=[100.0, 110.0, 200.0, 210.0]):
+                retrieval._snapshot_for(None)
+                write_index(tmp, np.full((1, 4), 2.0), docs, "modelo-prueba")  # ingesta desde otro proceso
+                retrieval._snapshot_for(None)  # dentro del intervalo: no mira el disco
+                reload.assert_not_called()
+                retrieval._snapshot_for(None)
+                retrieval._snapshot_for(None)
+                reload.assert_called_once_with()
+
+    def test_version_is_retried_when_a_reload_was_already_running(self):
+        import tempfile
+        import numpy as np
+        import retrieval
+        from retrieval import IndexSnapshot
+        from index_store import write_index
+
+        docs = [{"doc": "Capitulo2.pdf", "page": 1, "text": "Bloom"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            write_index(tmp, np.ones((1, 4)), docs, "modelo-prueba")
+            stale = IndexSnapshot(matrix=np.ones((1, 4)), chunks=[], sig_ids=np.zeros(1), version="anterior")
+            with patch.multiple(retrieval, INDEX_DIR=tmp, EMBED_CACHE_PATH=f"{tmp}/no.npz", _SNAPSHOT=stale,
+                                INDEX_CHECK_SECONDS=1.0, _INDEX_CHECKED_AT=0.0, _ATTEMPTED_VERSION=None), \
+                    patch("retrieval.reload_index", side_effect=[False, True]) as reload, \
+                    patch("retrieval.time.monotonic", side_effect=[100.0, 200.0, 300.0]):
+                retrieval._check_disk_version()  # otra recarga en curso: no se marca la versión
+                self.assertIsNone(retrieval._ATTEMPTED_VERSION)
+                retrieval._check_disk_version()
+                retrieval._check_disk_version()  # ya iniciada: no se repite
+                self.assertEqual(reload.call_count, 2)
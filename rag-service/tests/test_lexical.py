@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestLexical(unittest.TestCase):
+    def test_bm25_folds_accents_and_rrf_fuses_rankings(self):
+        from lexical import BM25Index, rrf_fuse, tokenize
+
+        self.assertEqual(tokenize("¿Qué es la Alfabetización en el Capítulo 4?"), ["alfabetizacion", "capitulo", "4"])
+        index = BM25Index.build([
+            "La taxonomía de Bloom ordena objetivos.",
+            "IAGen en el aula universitaria.",
+            "Capitulo 4: evaluación con IAGen y Bloom.",
+        ])
+        rows, scores = index.top("iagen", 5)
+        self.assertEqual(sorted(rows.tolist()), [1, 2])
+        self.assertTrue((scores > 0).all())
+
+        fused_rows, _ = rrf_fuse([[2, 0, 1], [1, 2]])
+        self.assertEqual(fused_rows.tolist(), [2, 1, 0])
+
+    def test_hybrid_lexical_only_hit_with_negative_cosine_is_served(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from fastapi.testclient import TestClient
+        from lexical import BM25Index
+        from retrieval import ChunkMeta, IndexSnapshot
+        import main
+
+        texts = ["Bloom y objetivos de aprendizaje", "IAGen en el aula"]
+        chunks = [ChunkMeta(doc=f"Capitulo{i}.pdf", page=1, text=t, vector_index=i) for i, t in enumerate(texts)]
+        # La fila 1 sólo la encuentra BM25: su coseno con la query es negativo.
+        snapshot = IndexSnapshot(matrix=np.array([[1.0, 0.0], [-0.6, 0.8]], dtype=np.float32), chunks=chunks,
+                                 sig_ids=np.arange(2), version="v1", lexical=BM25Index.build(texts))
+        encode = Mock(side_effect=lambda qs: np.array([[1.0, 0.0]] * len(qs), dtype=np.float32))
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60), _EMBED_MODEL=Mock(),
+                            _encode_queries=encode, ensure_ready=Mock(), MIN_SCORE=0.45, MMR_LAMBDA=1.0):
+            r = TestClient(main.app).post('/search', json={'query': 'Bloom IAGen', 'mode': 'hybrid'})
+        self.assertEqual(r.status_code, 200)
+        scores = {hit['doc']: hit['score'] for hit in r.json()['results']}
+        self.assertEqual(scores, {'Capitulo0.pdf': 1.0, 'Capitulo1.pdf': 0.0})
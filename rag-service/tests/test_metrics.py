@@ -0,0 +1,70 @@
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    def test_stage_metrics_render_prometheus_histograms(self):
+        import metrics
+
+        hist = metrics.Histogram("rag_test_seconds", "Prueba.", "stage", buckets=(0.01, 0.1))
+        hist.observe("encode", 0.05)
+        hist.observe("encode", 0.5)
+        lines = hist.render()
+        self.assertIn('rag_test_seconds_bucket{stage="encode",le="0.01"} 0', lines)
+        self.assertIn('rag_test_seconds_bucket{stage="encode",le="0.1"} 1', lines)
+        self.assertIn('rag_test_seconds_bucket{stage="encode",le="+Inf"} 2', lines)
+        self.assertIn('rag_test_seconds_count{stage="encode"} 2', lines)
+
+        token = metrics._TIMINGS.set({})
+        try:
+            with metrics.stage("score"):
+                pass
+            metrics.run_in_context(metrics.record)("score", 0.002)
+            timings = metrics._TIMINGS.get()
+        finally:
+            metrics._TIMINGS.reset(token)
+        self.assertEqual(list(timings), ["score"])
+        self.assertGreaterEqual(timings["score"], 0.002)
+        self.assertRegex(metrics.server_timing({"encode": 0.0123}), r"^encode;dur=12\.30$")
+
+    def test_search_reports_server_timing_and_metrics_endpoint(self):
+        from unittest.mock import patch
+        from fastapi.testclient import TestClient
+        import main
+        import metrics
+
+        def fake_search(query, **params):
+            with metrics.stage("score"):  # corre en el executor: el desglose llega vía run_in_context
+                return [{"doc": "Capitulo2.pdf", "page": 1, "score": 0.8, "text": "x"}]
+
+        client = TestClient(main.app)
+        with patch("retrieval.search", side_effect=fake_search):
+            r = client.post("/search", json={"query": "Bloom"})
+        self.assertEqual(r.status_code, 200)
+        timing = r.headers["server-timing"]
+        for name in ("score", "inference", "serialize", "total"):
+            self.assertRegex(timing, rf"(^|, ){name};dur=\d+\.\d\d")
+        self.assertNotIn("server-timing", client.get("/health").headers)
+
+        r = client.get("/metrics")
+        self.assertEqual(r.headers["content-type"], metrics.CONTENT_TYPE)
+        self.assertIn('rag_request_duration_seconds_count{endpoint="search"}', r.text)
+        self.assertIn('rag_responses_total{endpoint="search",code="200"}', r.text)
+        self.assertIn('rag_stage_duration_seconds_count{stage="score"}', r.text)
+        self.assertIn("# TYPE rag_index_rows gauge", r.text)
+
+    def test_metrics_export_microbatch_size_and_queue_wait_histograms(self):
+        from unittest.mock import patch
+        from fastapi.testclient import TestClient
+        import main
+        import retrieval
+
+        client = TestClient(main.app)
+        hit = [{"doc": "Capitulo2.pdf", "page": 1, "score": 0.8, "text": "x"}]
+        with patch.multiple(retrieval, MICROBATCH_MS=1.0, _BATCHER=None, _BATCHER_PID=None), \
+                patch("retrieval._search_reranked", side_effect=lambda queries, opts: [hit for _ in queries]):
+            self.assertEqual(client.post("/search", json={"query": "Bloom"}).status_code, 200)
+            text = client.get("/metrics").text
+        self.assertIn("# TYPE rag_microbatch_batch_size histogram", text)
+        self.assertRegex(text, r'rag_microbatch_batch_size_bucket\{batcher="rag-microbatch",le="1"\} [1-9]')
+        self.assertRegex(text, r'rag_microbatch_queue_wait_seconds_count\{batcher="rag-microbatch"\} [1-9]')
+        self.assertIn("rag_microbatch_queue_depth", text)
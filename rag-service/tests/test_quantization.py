@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestQuantization(unittest.TestCase):
+    def test_quantized_scores_track_float32(self):
+        import numpy as np
+        from quantization import quantize
+
+        rng = np.random.default_rng(2)
+        matrix = rng.normal(size=(300, 32)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        q = matrix[7]
+        exact = matrix @ q
+        for mode, tol in (("float16", 1e-3), ("int8", 5e-2)):
+            approx = quantize(matrix, mode).scores(q)
+            self.assertLess(float(np.abs(approx - exact).max()), tol)
+            self.assertEqual(int(np.argmax(approx)), 7)
+
+    def test_exact_search_skips_compact_matrix(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from quantization import quantize
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        rng = np.random.default_rng(5)
+        matrix = rng.normal(size=(50, 16)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        chunks = [ChunkMeta(doc="Capitulo2.pdf", page=i, text=f"texto {i}", vector_index=i) for i in range(50)]
+        quant = quantize(matrix, "int8")
+        quant.scores = Mock(side_effect=quant.scores)
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(50), version="v1", quant=quant)
+        encode = Mock(side_effect=lambda qs: matrix[[3] * len(qs)])
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60),
+                            _encode_queries=encode, ensure_ready=Mock(), MIN_SCORE=-1.0):
+            results = retrieval.search("Bloom", top_k=5, exact=True, mmr_lambda=1.0)
+            quant.scores.assert_not_called()
+            expected = np.sort(matrix @ matrix[3])[::-1][:5]
+            np.testing.assert_allclose([r["score"] for r in results], expected, rtol=1e-6)
+            retrieval.search("Bloom", top_k=5)
+            quant.scores.assert_called_once()
@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestRanking(unittest.TestCase):
+    def test_rank_rows_threshold_topk_and_dedup(self):
+        import numpy as np
+        import retrieval
+
+        sims = np.array([0.9, 0.2, 0.8, 0.85, 0.5, 0.7], dtype=np.float32)
+        sig_ids = np.array([0, 1, 2, 0, 3, 4])  # fila 3 duplica a la fila 0
+        rows = retrieval._rank_rows(sims, 3, sig_ids, min_score=0.45)
+        self.assertEqual(rows.tolist(), [0, 2, 5])
+
+        rows = retrieval._rank_rows(sims, 10, None, min_score=0.45)
+        self.assertEqual(rows.tolist(), [0, 3, 2, 5, 4])
+
+    def test_length_boost_orders_dense_results_but_score_is_raw_cosine(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        matrix = np.array([[0.6, 0.8], [0.95, 0.3122499], [1.0, 0.0]], dtype=np.float32)
+        texts = ["corto", "x" * 2000, "y" * 360]
+        chunks = [ChunkMeta(doc=f"Capitulo{i}.pdf", page=1, text=t, vector_index=i) for i, t in enumerate(texts)]
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(3), version="v1",
+                                 length_boost=retrieval._length_boost([len(t) for t in texts]))
+        encode = Mock(side_effect=lambda qs: np.array([[1.0000001, 0.0]] * len(qs), dtype=np.float32))
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60),
+                            _encode_queries=encode, ensure_ready=Mock(), MIN_SCORE=0.0):
+            results = retrieval.search("Bloom", top_k=3, mmr_lambda=1.0)
+        # Orden por coseno * boost (1.045 > 0.9 > 0.0075); score = coseno acotado a 1.
+        self.assertEqual([r["doc"] for r in results], ["Capitulo1.pdf", "Capitulo2.pdf", "Capitulo0.pdf"])
+        np.testing.assert_allclose([r["score"] for r in results], [0.95, 1.0, 0.6], rtol=1e-5)
+        self.assertLessEqual(max(r["score"] for r in results), 1.0)
+
+    def test_mmr_prefers_diverse_candidates(self):
+        import numpy as np
+        import retrieval
+
+        vecs = np.array([[1.0, 0.0], [0.99, 0.141], [0.6, 0.8]], dtype=np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        relevance = np.array([0.95, 0.94, 0.7], dtype=np.float32)
+        self.assertEqual(retrieval._mmr_order(vecs, relevance, 2, 1.0).tolist(), [0, 1])
+        self.assertEqual(retrieval._mmr_order(vecs, relevance, 2, 0.5).tolist(), [0, 2])
+        self.assertEqual(retrieval._mmr_order(vecs, relevance, 5, 0.5).shape[0], 3)
+        with self.assertRaises(ValueError):
+            retrieval.SearchOptions(top_k=3, mmr_lambda=1.5)
+
+    def test_search_options_validate_bounds(self):
+        import retrieval
+
+        for bad in ({"top_k": 0}, {"top_k": 3.5}, {"top_k": True}, {"top_k": 3, "nprobe": 0},
+                    {"top_k": 3, "rerank_budget_ms": -1}):
+            with self.assertRaises(ValueError, msg=bad):
+                retrieval.SearchOptions(**bad)
+        self.assertEqual(retrieval.SearchOptions(top_k=3, nprobe=8).nprobe, 8)
+
+    def test_default_search_diversifies_with_mmr(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        def unit(degrees):
+            return [np.cos(np.radians(degrees)), np.sin(np.radians(degrees))]
+
+        # Las filas 0 y 1 son el mismo vector (coseno 0.95 con la query); la 2 es algo menos
+        # relevante (0.85) pero aporta información distinta.
+        matrix = np.array([unit(0), unit(0), unit(50)], dtype=np.float32)
+        chunks = [ChunkMeta(doc="Capitulo2.pdf", page=i, text=f"texto {i}", vector_index=i) for i in range(3)]
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(3), version="v1")
+        encode = Mock(side_effect=lambda qs: np.array([unit(18.2)] * len(qs), dtype=np.float32))
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _RESULT_CACHE=TTLCache(8, 60),
+                            _encode_queries=encode, ensure_ready=Mock(), MIN_SCORE=0.0, MMR_LAMBDA=0.7):
+            self.assertEqual([r["page"] for r in retrieval.search("Bloom", top_k=2)], [0, 2])
+            self.assertEqual([r["page"] for r in retrieval.search("Bloom", top_k=2, mmr_lambda=1.0)], [0, 1])
@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestRerank(unittest.TestCase):
+    def test_rerank_reorders_and_respects_budget(self):
+        import rerank
+        from cache import TTLCache
+
+        cands = [{"doc": "a", "page": 1, "score": 0.9, "text": "uno"},
+                 {"doc": "b", "page": 2, "score": 0.8, "text": "dos"},
+                 {"doc": "c", "page": 3, "score": 0.7, "text": "tres"}]
+        model = Mock()
+        model.predict.side_effect = lambda pairs, **kw: [len(t) for _, t in pairs]
+        with patch.object(rerank, '_MODEL', model), patch.object(rerank, '_SCORE_CACHE', TTLCache(16, 60)), \
+                patch.object(rerank, '_PAIR_SECONDS', None):
+            self.assertEqual(rerank.rerank("q", cands, 2, budget_ms=0), cands[:2])
+            out = rerank.rerank("q", cands, 2, budget_ms=1000)
+            self.assertEqual([c["doc"] for c in out], ["c", "a"])
+            rerank.rerank("q", cands, 2, budget_ms=1000)
+            self.assertEqual(model.predict.call_count, 1)  # segundo llamado sale del cache
+
+    def test_rerank_skips_batches_projected_past_the_budget(self):
+        import rerank
+        from cache import TTLCache
+
+        cands = [{"doc": d, "page": 1, "score": 0.9, "text": d * 3} for d in "abcdefghij"]
+        clock = [0.0]
+
+        def predict(pairs, **kw):
+            clock[0] += 0.05 * len(pairs)  # 50 ms por par
+            return [1.0] * len(pairs)
+
+        model = Mock()
+        model.predict.side_effect = predict
+        with patch.object(rerank, '_MODEL', model), patch.object(rerank, '_SCORE_CACHE', TTLCache(64, 60)), \
+                patch.object(rerank, '_PAIR_SECONDS', None), patch.object(rerank, 'RERANK_BATCH', 4), \
+                patch.object(rerank.time, 'perf_counter', side_effect=lambda: clock[0]):
+            # Sin costo medido se lanza el primer lote; después se proyecta: 4 x 50 ms no entran en 300 ms.
+            self.assertEqual(rerank.rerank("q", cands, 3, budget_ms=300), cands[:3])
+            self.assertEqual(model.predict.call_count, 1)
+            self.assertAlmostEqual(rerank._PAIR_SECONDS, 0.05)
+            self.assertEqual(clock[0], 0.2)  # no se pasó del presupuesto
+            # Quedan 6 pares sin score (2 lotes, 300 ms proyectados): entran en 310 ms.
+            out = rerank.rerank("q", cands, 3, budget_ms=310)
+            self.assertEqual(model.predict.call_count, 3)
+            self.assertIn("rerank_score", out[0])
+
+    def test_search_response_carries_rerank_score(self):
+        import rerank
+        import retrieval
+        from cache import TTLCache
+        from fastapi.testclient import TestClient
+        import main
+
+        cands = [{"doc": "a", "page": 1, "score": 0.9, "text": "uno"},
+                 {"doc": "b", "page": 2, "score": 0.8, "text": "dos largo"}]
+        model = Mock()
+        model.predict.side_effect = lambda pairs, **kw: [len(t) / 10 for _, t in pairs]
+        with patch.object(rerank, '_MODEL', model), patch.object(rerank, '_SCORE_CACHE', TTLCache(16, 60)), \
+                patch.object(retrieval, '_search_local_batch', return_value=[cands]):
+            r = TestClient(main.app).post('/search', json={'query': 'Bloom', 'rerank': True,
+                                                           'rerank_budget_ms': 1000})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([(hit['doc'], hit['rerank_score']) for hit in r.json()['results']], [('b', 0.9), ('a', 0.3)])
+        schema = main.app.openapi()['components']['schemas']['SearchResult']['properties']
+        self.assertIn('rerank_score', schema)
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import Mock, patch
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_warm_up_loads_model_and_scores_without_touching_caches(self):
+        import numpy as np
+        import retrieval
+        from cache import TTLCache
+        from embedders import HashingEmbedder
+        from retrieval import ChunkMeta, IndexSnapshot
+
+        embedder = HashingEmbedder(dim=16)
+        matrix = embedder.encode(["Bloom", "IAGen"], normalize_embeddings=True)
+        chunks = [ChunkMeta(doc="Capitulo2.pdf", page=i, text=t, vector_index=i) for i, t in enumerate(["Bloom", "IAGen"])]
+        snapshot = IndexSnapshot(matrix=matrix, chunks=chunks, sig_ids=np.arange(2), version="v1")
+        query_cache = TTLCache(8, 60)
+        with patch.multiple(retrieval, _SNAPSHOT=snapshot, _QUERY_CACHE=query_cache, ensure_ready=Mock(),
+                            WARMUP=True, BACKEND_KIND="local"), \
+                patch.object(retrieval, "_lazy_load_model", return_value=embedder) as load:
+            timings = retrieval.warm_up()
+        load.assert_called_once()
+        self.assertEqual(list(timings), ["index", "model", "encode", "score"])
+        self.assertEqual(query_cache.stats()["size"], 0)
+
+    def test_index_status_reports_page_cache_sharing_by_inode(self):
+        import os
+        import tempfile
+        import numpy as np
+        import retrieval
+        from index_store import resolve, write_index
+
+        docs = [{"doc": "Capitulo2.pdf", "page": 1, "text": "Bloom"}]
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = write_index(tmp, np.ones((1, 4)), docs, retrieval.DEFAULT_MODEL)
+            # Dos cargas del mismo directorio, como dos workers de uvicorn.
+            first, second = retrieval._load_index_dir(tmp), retrieval._load_index_dir(tmp)
+            st = os.stat(os.path.join(resolve(tmp), "embeddings.npy"))
+            for snapshot in (first, second):
+                with patch.object(retrieval, "_SNAPSHOT", snapshot):
+                    status = retrieval.index_status()
+                self.assertEqual((status["backing"], status["shared"]), ("mmap", True))
+                self.assertEqual((status["device"], status["inode"]), (st.st_dev, st.st_ino))
+                self.assertEqual(status["version"], manifest["checksum"])
+        private = retrieval.IndexSnapshot(matrix=np.ones((1, 4)), chunks=[], sig_ids=np.zeros(1), version="npz:1")
+        with patch.object(retrieval, "_SNAPSHOT", private):
+            self.assertEqual({k: retrieval.index_status()[k] for k in ("backing", "shared", "inode")},
+                             {"backing": "private", "shared": False, "inode": None})
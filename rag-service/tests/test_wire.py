@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+class TestWire(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def test_negotiate_honours_q_values_and_falls_back_to_json(self):
+        import wire
+
+        self.assertEqual(wire.negotiate("application/octet-stream; dtype=float16, application/json;q=0.5",
+                                        (wire.JSON, wire.RAW)), (wire.RAW, {"dtype": "float16"}))
+        self.assertEqual(wire.negotiate("text/html, */*;q=0.1", (wire.JSON, wire.RAW))[0], wire.JSON)
+        self.assertEqual(wire.negotiate("application/*", (wire.RAW, wire.JSON))[0], wire.RAW)
+        with patch.object(wire, "msgpack", None):
+            self.assertEqual(wire.negotiate("application/x-msgpack", (wire.JSON, wire.MSGPACK))[0], wire.JSON)
+
+    @patch('main.SearchResult', side_effect=AssertionError("sin pydantic por hit"))
+    @patch('retrieval.search_batch')
+    def test_search_results_are_serialized_without_pydantic_models(self, mock_batch, _):
+        hit = {'doc': 'Capitulo2.pdf', 'page': 1, 'score': 0.8, 'text': 'x', 'rrf': 0.03}
+        mock_batch.return_value = [[hit], []]
+        r = self.client.post('/search/batch', json={'queries': ['Bloom', 'IAGen']})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['results'], [{'results': [hit], 'total': 1, 'query': 'Bloom'},
+                                               {'results': [], 'total': 0, 'query': 'IAGen'}])
+
+    @patch('retrieval.search')
+    def test_search_response_is_compressed_when_accepted(self, mock_search):
+        mock_search.return_value = [{'doc': 'Capitulo2.pdf', 'page': i, 'score': 0.8, 'text': 'Bloom ' * 100}
+                                    for i in range(5)]
+        r = self.client.post('/search', json={'query': 'Bloom'}, headers={'Accept-Encoding': 'br;q=0, gzip'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['content-encoding'], 'gzip')
+        self.assertEqual(r.headers['vary'], 'Accept, Accept-Encoding')
+        body = r.json()  # httpx descomprime de forma transparente
+        self.assertEqual((body['total'], body['results'][0]['page']), (5, 0))
+
+    @patch('retrieval.embed_texts')
+    def test_embed_negotiates_raw_float16_and_keeps_json_shape(self, mock_embed):
+        import numpy as np
+
+        vecs = np.array([[0.5, -0.25, 1.0], [0.0, 0.125, -1.0]], dtype=np.float32)
+        mock_embed.return_value = vecs
+        r = self.client.post('/embed', json={'texts': ['a', 'b']},
+                             headers={'Accept': 'application/octet-stream; dtype=float16'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.headers['x-rag-shape'], r.headers['x-rag-dtype']), ('2,3', 'float16'))
+        np.testing.assert_array_equal(np.frombuffer(r.content, dtype='<f2').reshape(2, 3), vecs)
+
+        body = self.client.post('/embed', json={'texts': ['a', 'b']}).json()
+        self.assertEqual(body['dimensions'], 3)
+        self.assertEqual(body['embeddings'], vecs.tolist())
+
+    @patch('retrieval.search')
+    def test_search_answers_msgpack_when_installed(self, mock_search):
+        import wire
+        if wire.msgpack is None:
+            self.skipTest("msgpack no instalado")
+        mock_search.return_value = [{'doc': 'Capitulo2.pdf', 'page': 1, 'score': 0.8, 'text': 'x'}]
+        r = self.client.post('/search', json={'query': 'Bloom'},
+                             headers={'Accept': 'application/msgpack, application/json;q=0.5'})
+        self.assertEqual(r.headers['content-type'], wire.MSGPACK)
+        self.assertEqual(wire.msgpack.unpackb(r.content, raw=False)['results'][0]['doc'], 'Capitulo2.pdf')
@@ -0,0 +1,159 @@
+"""Formatos de respuesta negociados para ``/search``, ``/search/batch`` y ``/embed``.
+
+Según ``Accept`` se responde:
+
+- ``application/json`` (por defecto): con ``orjson`` si está instalado, que
+  serializa los arrays de numpy sin pasar por ``tolist()``.
+- ``application/msgpack``: requiere ``msgpack``; los embeddings viajan como
+  bytes crudos dentro del mapa.
+- ``application/octet-stream`` (sólo ``/embed``): float32 little-endian
+  crudo, o float16 con ``Accept: application/octet-stream; dtype=float16``.
+  La forma va en los headers ``X-RAG-Shape`` (``filas,dim``) y ``X-RAG-Dtype``.
+
+Las respuestas de texto se comprimen con br (si ``brotli`` está instalado)
+o gzip según ``Accept-Encoding``.
+"""
+from __future__ import annotations
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from metrics import stage
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None  # type: ignore
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+RAW = "application/octet-stream"
+_ALIASES = {"application/x-msgpack": MSGPACK}
+_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+COMPRESS_MIN_BYTES = int(os.environ.get("RAG_WIRE_COMPRESS_MIN_BYTES", "1024"))  # 0 = nunca comprimir
+
+
+def parse_accept(header: str) -> List[Tuple[str, Dict[str, str], float]]:
+    """``Accept`` -> [(media type, parámetros, q)] de mayor a menor q (estable)."""
+    entries = []
+    for part in (header or "").split(","):
+        media, *raw_params = [p.strip() for p in part.split(";")]
+        if not media:
+            continue
+        params: Dict[str, str] = {}
+        for raw in raw_params:
+            key, _, value = raw.partition("=")
+            params[key.strip().lower()] = value.strip().strip('"')
+        try:
+            q = float(params.pop("q", "1"))
+        except ValueError:
+            q = 0.0
+        entries.append((_ALIASES.get(media.lower(), media.lower()), params, q))
+    return sorted(entries, key=lambda e: -e[2])
+
+
+def negotiate(header: str, offered: Sequence[str]) -> Tuple[str, Dict[str, str]]:
+    """Primer formato de ``offered`` aceptado por el cliente; ``offered[0]`` si ninguno coincide."""
+    available = [m for m in offered if m != MSGPACK or msgpack is not None]
+    for media, params, q in parse_accept(header):
+        if q <= 0:
+            continue
+        if media in available:
+            return media, params
+        if media == "*/*":
+            break
+        if media.endswith("/*"):
+            match = next((m for m in available if m.startswith(media[:-1])), None)
+            if match is not None:
+                return match, {}
+    return available[0], {}
+
+
+def _dumps_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def _json_default(value: Any):
+    if np is not None and isinstance(value, np.ndarray):
+        return value.tolist()
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} no es serializable a JSON")
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """Comprime ``body`` con br o gzip si el cliente lo acepta y vale la pena."""
+    if COMPRESS_MIN_BYTES <= 0 or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = {media: q for media, _, q in parse_accept(accept_encoding)}
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return brotli.compress(body, quality=4), "br"
+    if accepted.get("gzip", 0) > 0:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+
+def _response(request: Request, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None,
+              compressible: bool = True, status: int = 200) -> Response:
+    headers = dict(headers or {})
+    if compressible:
+        with stage("compress"):
+            body, encoding = compress(body, request.headers.get("accept-encoding", ""))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept, Accept-Encoding"
+    return Response(body, status_code=status, media_type=content_type, headers=headers)
+
+
+def respond(request: Request, payload: Dict[str, Any], status: int = 200) -> Response:
+    """Serializa ``payload`` en JSON o msgpack según ``Accept``."""
+    media, _ = negotiate(request.headers.get("accept", ""), (JSON, MSGPACK))
+    with stage("serialize"):
+        body = msgpack.packb(payload, default=_json_default) if media == MSGPACK else _dumps_json(payload)
+    return _response(request, body, media, status=status)
+
+
+def respond_embeddings(request: Request, embeddings, model: str) -> Response:
+    """Embeddings como JSON (forma de ``EmbedResponse``), msgpack (bytes) o float32/float16 crudo."""
+    media, params = negotiate(request.headers.get("accept", ""), (JSON, MSGPACK, RAW))
+    dtype = params.get("dtype", "float32")
+    if dtype not in _DTYPES:
+        dtype = "float32"
+    rows = int(embeddings.shape[0])
+    dim = int(embeddings.shape[1]) if rows else 0
+    if media == JSON:
+        with stage("serialize"):
+            body = _dumps_json({"embeddings": embeddings, "dimensions": dim, "model": model})
+        return _response(request, body, JSON)
+    with stage("serialize"):
+        data = np.ascontiguousarray(embeddings, dtype=_DTYPES[dtype]).tobytes()
+        if media == MSGPACK:
+            payload = {"model": model, "dimensions": dim, "dtype": dtype, "shape": [rows, dim], "embeddings": data}
+            data = msgpack.packb(payload)
+    if media == MSGPACK:
+        # Floats crudos casi no comprimen: no se gasta CPU en gzip.
+        return _response(request, data, MSGPACK, compressible=False)
+    headers = {"X-RAG-Shape": f"{rows},{dim}", "X-RAG-Dtype": dtype, "X-RAG-Model": model}
+    return _response(request, data, f"{RAW}; dtype={dtype}", headers, compressible=False)